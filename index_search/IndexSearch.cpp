@@ -4,6 +4,11 @@
 
 #include <seqan/index.h>
 #include <seqan/sequence.h>
+#include <seqan/file.h>
+
+#include <algorithm>
+#include <stdexcept>
+#include <vector>
 
 // Currently using a 5 mer since a 7 mer gives an overflow error
 // during compile and a 6 mer is slower due to higher memory usage
@@ -13,13 +18,64 @@ namespace
 {				// Avoid cluttering the global namespace.
 
   typedef seqan::String < seqan::AminoAcid > Peptide;
+  // A peptide database living in memory mapped files. The index fibres
+  // of such a text are memory mapped too (see DefaultIndexStringSpec).
+  typedef seqan::String < seqan::AminoAcid, seqan::MMap <> > MappedPeptide;
 //  typedef seqan::String<char> Peptide;
 //  typedef seqan::StringSet<Peptide> PepSet;
-  typedef seqan::Index < Peptide,
-    seqan::IndexQGram < seqan::UngappedShape < MER_SIZE > > >MyIndex;
+  typedef seqan::IndexQGram < seqan::UngappedShape < MER_SIZE > > QGramSpec;
+
+  /* Common interface of the in-memory and the memory mapped indices,
+   * so that the Python wrappers below need not care which one they hold.
+   */
+  class IndexSearchBase
+  {
+  public:
+    virtual ~IndexSearchBase ()
+    {
+    }
+    virtual void findInto (const std::string & pepStr,
+			   std::vector < long >&positions) = 0;
+    virtual bool save (const char *fileName) = 0;
+
+    /* find takes a single peptide string and returns the list of its
+     * offsets in the database.
+     */
+    PyObject *find (const std::string & pepStr)
+    {
+      std::vector < long >found;
+      findInto (pepStr, found);
+      PyObject *positions = PyList_New (0);
+      for (size_t i = 0; i < found.size (); i++)
+	{
+	  PyObject *pos = PyInt_FromLong (found[i]);
+	  PyList_Append (positions, pos);
+	  Py_DECREF (pos);
+	}
+      return positions;
+    }
+
+    /* findMany searches every peptide in turn, appending the hits to
+     * offsets. bounds gets one more entry than there are peptides, so that
+     * the hits of peptide i are offsets[bounds[i]:bounds[i+1]]. It touches
+     * no Python objects and may run with the GIL released.
+     */
+    void findMany (const std::vector < std::string > &peptides,
+		   std::vector < long >&offsets, std::vector < long >&bounds)
+    {
+      bounds.push_back (0);
+      for (size_t i = 0; i < peptides.size (); i++)
+	{
+	  findInto (peptides[i], offsets);
+	  bounds.push_back (offsets.size ());
+	}
+    }
+  };
 
-  class IndexSearch
+  template < typename TPeptide > class IndexSearch:public IndexSearchBase
   {
+    typedef seqan::Index < TPeptide, QGramSpec > MyIndex;
+
   public:
     //IndexSearch(PyObject* dbStringList)
     /* Constructor takes a single string which is the Peptide database
@@ -41,45 +97,70 @@ namespace
          }
        */
 
-      dbStr = new Peptide (dbString);
+      dbStr = new TPeptide (dbString);
       dbIndex = new MyIndex (*dbStr);
+      // Build the fibres now rather than lazily in the first find, so that
+      // searches never modify the index and can run without the GIL
+      indexRequire (*dbIndex, seqan::QGramSADir ());
     }
-     ~IndexSearch ()
+
+    /* Constructor that opens an index previously written with save().
+     * Nothing is rebuilt; for MappedPeptide the text and the q-gram
+     * fibres are memory mapped read-only from the saved files.
+     */
+    IndexSearch (const char *fileName)
+    {
+      // The opened index owns its text
+      dbStr = 0;
+      dbIndex = new MyIndex ();
+      if (!seqan::open (*dbIndex, fileName, seqan::OPEN_RDONLY))
+	{
+	  delete dbIndex;
+	  throw std::runtime_error (fileName);
+	}
+    }
+
+    ~IndexSearch ()
     {
       delete dbIndex;
       delete dbStr;
     }
 
-    /* find takes a single peptide string which is searched against the db.
+    /* findInto takes a single peptide string which is searched against the db.
      * It locates the 1st kmer in the database using seqan::find. Finally,
      * it does an exact string compare of the search string on all the kmer
-     * positions in the database to find the full matches, which are returned
-     * in a python list.
+     * positions in the database to find the full matches, which are appended
+     * to positions.
      */
-    PyObject *find (const std::string & pepStr)
+    void findInto (const std::string & pepStr, std::vector < long >&positions)
     {
       seqan::Finder < MyIndex > finder (*dbIndex);
       const Peptide pep (pepStr);
       const int pepLen = length (pep);
-      PyObject *positions = PyList_New (0);
+      const TPeptide & dbText = indexText (*dbIndex);
 
 //          std::cout << "Length of db is " << seqan::length(db) << std::endl;
       while (seqan::find (finder, pep))
 	{
-	  int dbOffset = position (finder);
-	  const Peptide dbInfix = infixWithLength (*dbStr, dbOffset, pepLen);
-	  if (dbInfix == pepStr)
+	  long dbOffset = position (finder);
+	  if (infixWithLength (dbText, dbOffset, pepLen) == pep)
 	    {
-	      PyObject *pos = PyInt_FromLong (dbOffset);
-	      PyList_Append (positions, pos);
-	      Py_DECREF (pos);
+	      positions.push_back (dbOffset);
 	    }
 	}
-      return positions;
     }
+
+    /* save writes the text and the q-gram fibres into files sharing
+     * the given prefix.
+     */
+    bool save (const char *fileName)
+    {
+      return seqan::save (*dbIndex, fileName);
+    }
+
   private:
 //      PepSet *dbSet;
-    Peptide * dbStr;
+    TPeptide * dbStr;
     MyIndex *dbIndex;
   };
 }
@@ -92,7 +173,7 @@ const char *caps_name = "IndexSearch";
 
 static void del_IndexSearch(PyObject *pcaps)
 {
-	IndexSearch * oldind = static_cast<IndexSearch *>(PyCapsule_GetPointer(pcaps, caps_name));
+	IndexSearchBase * oldind = static_cast<IndexSearchBase *>(PyCapsule_GetPointer(pcaps, caps_name));
     delete oldind;
 }
 
@@ -105,7 +186,8 @@ static PyObject *new_IndexSearch(PyObject *, PyObject* args)
     try {
 	    //Capsule is the standard way to pass opaque C++ pointers
         //around starting with Python 2.7
-        return PyCapsule_New(new IndexSearch(dbString), caps_name, del_IndexSearch);
+        IndexSearchBase *ind = new IndexSearch<Peptide>(std::string(dbString));
+        return PyCapsule_New(ind, caps_name, del_IndexSearch);
     }
     catch (...) {
 
@@ -115,7 +197,23 @@ static PyObject *new_IndexSearch(PyObject *, PyObject* args)
     }
 }
 
+static PyObject *open_IndexSearch(PyObject *, PyObject* args)
+{
+    char *fileName = 0;
+    int ok = PyArg_ParseTuple(args,"s",&fileName);
+    if(!ok) return NULL;
+
+    try {
+        IndexSearchBase *ind = new IndexSearch<MappedPeptide>(fileName);
+        return PyCapsule_New(ind, caps_name, del_IndexSearch);
+    }
+    catch (...) {
 
+        PyErr_Format( PyExc_IOError, 
+                     "Unable to open IndexSearch files %s", fileName);
+        return NULL;    // trigger exception
+    }
+}
 
 static PyObject *IndexSearch_find(PyObject *, PyObject* args)
 {
@@ -126,19 +224,109 @@ static PyObject *IndexSearch_find(PyObject *, PyObject* args)
     //"O" is for Object
     if(!ok) return NULL;
 
-	IndexSearch * thisind = static_cast<IndexSearch *>(PyCapsule_GetPointer(pcaps, caps_name));
+	IndexSearchBase * thisind = static_cast<IndexSearchBase *>(PyCapsule_GetPointer(pcaps, caps_name));
 
     return thisind->find(pepStr);
 }
 
+static PyObject *IndexSearch_save(PyObject *, PyObject* args)
+{
+    PyObject *pcaps = 0;
+    char *fileName = 0;
+    int ok = PyArg_ParseTuple( args, "Os", &pcaps,&fileName);
+    if(!ok) return NULL;
+
+	IndexSearchBase * thisind = static_cast<IndexSearchBase *>(PyCapsule_GetPointer(pcaps, caps_name));
+
+    if (!thisind->save(fileName)) {
+        PyErr_Format( PyExc_IOError, 
+                     "Unable to save IndexSearch files %s", fileName);
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+/* Pack a vector of longs into a string, to be wrapped by array.array('l') */
+static PyObject *packLongs(const std::vector<long> & values)
+{
+    return PyString_FromStringAndSize(
+            values.empty() ? "" : reinterpret_cast<const char *>(&values[0]),
+            values.size() * sizeof(long));
+}
+
+static PyObject *IndexSearch_find_many(PyObject *, PyObject* args)
+{
+    PyObject *pcaps = 0;
+    PyObject *pepSeq = 0;
+    PyObject *seqStarts = Py_None;
+    int ok = PyArg_ParseTuple( args, "OO|O", &pcaps, &pepSeq, &seqStarts);
+    if(!ok) return NULL;
+
+	IndexSearchBase * thisind = static_cast<IndexSearchBase *>(PyCapsule_GetPointer(pcaps, caps_name));
+    if(!thisind) return NULL;
+
+    // Copy everything we need out of Python objects while holding the GIL
+    PyObject *fastSeq = PySequence_Fast(pepSeq, "peptides must be a sequence of strings");
+    if(!fastSeq) return NULL;
+    Py_ssize_t numPeps = PySequence_Fast_GET_SIZE(fastSeq);
+    std::vector<std::string> peptides;
+    peptides.reserve(numPeps);
+    for(Py_ssize_t i = 0; i < numPeps; i++) {
+        PyObject *pep = PySequence_Fast_GET_ITEM(fastSeq, i);
+        char *pepStr = 0;
+        Py_ssize_t pepLen = 0;
+        if(PyString_AsStringAndSize(pep, &pepStr, &pepLen) < 0) {
+            Py_DECREF(fastSeq);
+            return NULL;
+        }
+        peptides.push_back(std::string(pepStr, pepLen));
+    }
+    Py_DECREF(fastSeq);
+
+    // Optional sorted table of sequence begin offsets (array.array('l'))
+    const long *starts = 0;
+    Py_ssize_t numStarts = 0;
+    if(seqStarts != Py_None) {
+        const void *buf = 0;
+        Py_ssize_t bufLen = 0;
+        if(PyObject_AsReadBuffer(seqStarts, &buf, &bufLen) < 0) return NULL;
+        starts = static_cast<const long *>(buf);
+        numStarts = bufLen / sizeof(long);
+    }
+
+    std::vector<long> offsets, bounds, seqIds;
+    Py_BEGIN_ALLOW_THREADS
+    thisind->findMany(peptides, offsets, bounds);
+    if(starts) {
+        // upper_bound always gives us the sequence after 
+        // the one we want, so subtract 1
+        seqIds.reserve(offsets.size());
+        for(size_t i = 0; i < offsets.size(); i++) {
+            seqIds.push_back(std::upper_bound(starts, starts + numStarts, offsets[i]) - starts - 1);
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    return Py_BuildValue("(NNN)", packLongs(offsets), packLongs(bounds), packLongs(seqIds));
+}
+
 static PyMethodDef indexSearchMethods[] = 
 {
     { "new_IndexSearch", new_IndexSearch, 
         METH_VARARGS, 
       "new_IndexSearch(str)->new IndexSearch object"},
+    { "open_IndexSearch", open_IndexSearch, 
+        METH_VARARGS, 
+      "open_IndexSearch(fileName)->IndexSearch object memory mapped from saved files"},
     { "IndexSearch_find", IndexSearch_find, 
       METH_VARARGS, 
       "IndexSearch_find(IndexSearch,str) -> list"},
+    { "IndexSearch_find_many", IndexSearch_find_many, 
+      METH_VARARGS, 
+      "IndexSearch_find_many(IndexSearch,peptides[,seqStarts]) -> (offsets,bounds,seqIds) packed C longs"},
+    { "IndexSearch_save", IndexSearch_save, 
+      METH_VARARGS, 
+      "IndexSearch_save(IndexSearch,fileName) -> None"},
 
     {NULL,NULL,0,NULL}
 };
@@ -155,4 +343,3 @@ init_IndexSearch()
             indexSearchMethods,  // name of the method table
             "C++ IndexSearch class"); // doc string for module
 }
-
@@ -1,14 +1,37 @@
+import array
 import _IndexSearch as _c_impl
 
 class IndexSearch(object):
     """Search for protein string using Seqan k-mer index"""
 
-    def __init__(self,dbStr):
-        self._c_obj = _c_impl.new_IndexSearch(dbStr)
+    def __init__(self,dbStr=None,_c_obj=None):
+        if _c_obj is None:
+            _c_obj = _c_impl.new_IndexSearch(dbStr)
+        self._c_obj = _c_obj
+
+    @classmethod
+    def open(klass,fileName):
+        """Open an index written by save() without rebuilding it.
+        The files are memory mapped read-only, so processes on one node
+        share the same pages."""
+        return klass(_c_obj=_c_impl.open_IndexSearch(fileName))
 
     def find(self,pepStr):
         return _c_impl.IndexSearch_find(self._c_obj,pepStr)
 
+    def find_many(self,peptides,seqStarts=None):
+        """Search all peptides in one call, without holding the GIL.
+        Returns (offsets,bounds,seqIds) arrays of C longs; the offsets of
+        peptides[i] are offsets[bounds[i]:bounds[i+1]]. If seqStarts, the
+        sorted array('l') of sequence begin offsets, is given, seqIds holds
+        the index of the sequence that contains each offset."""
+        packed = _c_impl.IndexSearch_find_many(self._c_obj,peptides,seqStarts)
+        return tuple([ array.array('l',p) for p in packed ])
+
+    def save(self,fileName):
+        """Write the index into several files that share fileName as prefix"""
+        _c_impl.IndexSearch_save(self._c_obj,fileName)
+
 
 if __name__ == "__main__":
     dbStr = "".join("""\
@@ -41,7 +41,37 @@ class BinMaker:
     def Main(self):
 
         inspectParser = InspectResults.Parser( self.InputDir )
+        if InspectResults.numpy and not self.VerboseFlag:
+            self.CountBins(inspectParser)
+        else:
+            self.CountBinsByRow(inspectParser)
+        self.Header = inspectParser.header
 
+        if self.VerboseFlag:
+            self.PrintResults()
+        self.ComputeAndWriteTable()
+        self.WriteResults()
+
+    def CountBins(self, inspectParser):
+        """Same counts as CountBinsByRow, but binning whole batches of 
+        results with numpy"""
+        numpy = InspectResults.numpy
+        for Batch in inspectParser.iterBatches():
+            Index = (Batch["PValue"]/self.BinWidth).astype(int)
+            IsDecoy = numpy.array([Protein[0:3] == "XXX" for Protein in Batch["ProteinName"]], dtype=bool)
+            LowCharge = Batch["Charge"] <= 2
+            for (Counts, InCharge) in ((self.IScoreCounts_1_2, LowCharge), (self.IScoreCounts_3, ~LowCharge)):
+                if not InCharge.any():
+                    continue
+                ChargeIndex = Index[InCharge]
+                FPCounts = numpy.bincount(ChargeIndex, weights=IsDecoy[InCharge])
+                AllCounts = numpy.bincount(ChargeIndex)
+                for Bin in numpy.nonzero(AllCounts)[0].tolist():
+                    (TP,FP) = Counts.get(Bin, (0,0))
+                    BinFP = int(FPCounts[Bin])
+                    Counts[Bin] = (TP + int(AllCounts[Bin]) - BinFP, FP + BinFP)
+
+    def CountBinsByRow(self, inspectParser):
         for result in inspectParser:
             Charge = result.Charge
             Score = result.PValue
@@ -73,14 +103,6 @@ class BinMaker:
                 print self.IScoreCounts_1_2[Index]
                 print self.IScoreCounts_3[Index]
                 raw_input()
-                
-        self.Header = inspectParser.header
-
-        if self.VerboseFlag:
-            self.PrintResults()
-
-        self.ComputeAndWriteTable()
-        self.WriteResults()
         
     def WriteResults(self):
 
@@ -69,7 +69,7 @@ extern LDAModel* CCModel2LDA;
 extern SVMModel* CCModel1SVM;
 extern SVMModel* CCModel2SVM;
 
-extern PRMBayesianModel* PRMModelCharge2;
+extern THREAD_LOCAL PRMBayesianModel* PRMModelCharge2;
 
 // For converting parts-per-million:
 #define ONE_MILLION 1000000
@@ -367,6 +367,22 @@ int ChargeCorrectSpectrum(SpectrumNode* Node, float* Model1Score, float* Model2S
     return 3;
 }
 
+// Load the charge correction and parent mass correction models, which TweakSpectrum 
+// otherwise loads on first use.  (Must be called before spectra are tweaked in parallel)
+void LoadTweakModels()
+{
+#ifdef CC_USE_SVM
+    LoadCCModelSVM(0);
+#else
+    LoadCCModelLDA(0);
+#endif
+#ifdef PMC_USE_SVM
+    LoadPMCSVM();
+#else
+    LoadPMCLDA(0);
+#endif
+}
+
 // We've loaded a spectrum.  Now let's adjust its parent mass and its charge to the 
 // best possible. 
 void TweakSpectrum(SpectrumNode* Node)
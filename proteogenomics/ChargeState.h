@@ -48,6 +48,7 @@
 // both charge states.
 
 void TweakSpectrum(SpectrumNode* Node);
+void LoadTweakModels();
 
 void GetChargeCorrectionFeatures1(PMCSpectrumInfo* SpectrumInfo1, PMCSpectrumInfo* SpectrumInfo2,
     PMCSpectrumInfo* SpectrumInfo3, float* Features);
@@ -16,6 +16,8 @@ $SCRATCH/USER_NAME/ResultsX - Directory for results-files to be copied into.
 import os
 import re
 import sys
+import glob
+import heapq
 import getopt
 import shutil
 import tarfile
@@ -26,12 +28,24 @@ import SixFrameFasta
 import PrepDB
 import ShuffleDB
 import CountScans
+import bioseq
 
 # 50mb or so is plenty of stuff to search in one *unmodified* run:
 MAX_MZMXML_PER_RUN = 50000000
 
 ini_section = "main"
 
+# Predicted Inspect time per spectrum until there are logs of earlier runs
+# (see GetSecondsPerSpectrum):
+DEFAULT_SECONDS_PER_SPECTRUM = 0.2
+# Predicted run time to aim for in each standard search job; files that
+# would take longer are searched in several blocks of scans:
+DEFAULT_JOB_SECONDS = 3600
+# Guess for a file we know nothing about:
+UNKNOWN_SCAN_COUNT = 100
+
+ElapsedTimePattern = re.compile(r"Elapsed time: ([0-9.]+) seconds")
+
 class JobClass:
     """
     A job corresponds to a single shell-script to be submitted to the grid engine.
@@ -58,11 +72,18 @@ class JobClass:
     Master
     --Main1: FileA.mzxml,4
     --Main2: FileA.mzxml,5
+
+    In a standard search, a large file is also split into blocks of scans
+    (see ScriptMongler.GetSearchBlocks); the block number is then the first
+    scan of the block.  Main jobs searching part of a file have FirstScan
+    and LastScan (inclusive; -1 for the end of the file) set.
     """
     def __init__(self):
         self.SubJobs = None
         self.SpectrumFileName = None
         self.BlockNumber = None
+        self.FirstScan = None
+        self.LastScan = None
         self.File = None
         self.FileName = None
         self.TotalScans = None
@@ -71,13 +92,28 @@ class JobClass:
     def FlagRunningJob(self, Name, File):
         """
         Traverse the job tree (recursively).  Write out flags to indicate that
-        these blocks are "searched" (or "submitted" or whatever)
+        these blocks are "searched" (or "submitted" or whatever).  Jobs that
+        search part of a file also record its first and last scan, since the
+        block boundaries can differ from run to run.
         """
         if self.SpectrumFileName:
-            File.write("%s\t%s\t%s\t\n"%(Name, self.SpectrumFileName, self.BlockNumber))
+            if self.FirstScan != None:
+                File.write("%s\t%s\t%s\t%s\t%s\t\n"%(Name, self.SpectrumFileName, self.BlockNumber,
+                                                 self.FirstScan, self.LastScan))
+            else:
+                File.write("%s\t%s\t%s\t\n"%(Name, self.SpectrumFileName, self.BlockNumber))
         if self.SubJobs:
             for SubJob in self.SubJobs:
                 SubJob.FlagRunningJob(Name, File)
+    def GetMainJobs(self):
+        "The jobs (this one or its sub jobs, recursively) that search a spectrum file"
+        MainJobs = []
+        if self.SubJobs:
+            for SubJob in self.SubJobs:
+                MainJobs.extend(SubJob.GetMainJobs())
+        if self.SpectrumFileName:
+            MainJobs.append(self)
+        return MainJobs
     def GetSpectrumFileNames(self):
         FileNameList = []
         if self.SubJobs:
@@ -96,6 +132,7 @@ class ScriptMongler:
         # number of PTMs allowed per peptide; passed along to ClusterRunInspect
         self.PTMLimit = 0
         self.ScanCounts = {} # stub -> number of scans
+        self.FileSizes = {} # stub -> spectrum file size
         self.gridEnv = None
         self.scanCountFile = None
         # Count of the number of master jobs, to be used as job array index
@@ -104,11 +141,17 @@ class ScriptMongler:
         self.SpectraPerJob = 1
         # Allow user to specify an alternate base for the output directory
         self.scratchBase = None
+        # Cost model for packing standard search jobs:
+        self.SecondsPerSpectrum = DEFAULT_SECONDS_PER_SPECTRUM
+        self.JobSeconds = DEFAULT_JOB_SECONDS
 
-    def createMainJob(self, CurrentMasterJob, SpectrumFileName, BlockNumber):
+    def createMainJob(self, CurrentMasterJob, SpectrumFileName, BlockNumber,
+                      FirstScan = None, LastScan = None):
         MainJob = JobClass()
         MainJob.SpectrumFileName = SpectrumFileName
         MainJob.BlockNumber = BlockNumber
+        MainJob.FirstScan = FirstScan
+        MainJob.LastScan = LastScan
         CurrentMasterJob.SubJobs.append(MainJob)
 
     def createMasterJob(self):
@@ -145,6 +188,10 @@ class ScriptMongler:
             spectraPath = os.path.join( self.gridEnv.MZXMLDir,
                                         Bits[CountScans.CountScanBits.Stub])
             self.ScanCounts[spectraPath] = ScanCount
+            try:
+                self.FileSizes[spectraPath] = int(Bits[CountScans.CountScanBits.FileSize])
+            except:
+                pass
         scanfile.close()
 
     def BuildInspectInputFile(self,Job):
@@ -153,12 +200,10 @@ class ScriptMongler:
         Returns a string containing the desired contents of the file.
         """
         SpectraStr = ""
-        for SpectrumFileName in Job.GetSpectrumFileNames():
-            ScratchMZXMLPath = os.path.join(self.gridEnv.MZXMLDir, SpectrumFileName)
-            if self.BlindSearchFlag:
-                firstScanNumber = Job.BlockNumber * self.gridEnv.BLIND_BLOCK_SIZE
-                lastScanNumber  = firstScanNumber + self.gridEnv.BLIND_BLOCK_SIZE
-                SpectraStr += "spectra,%s,%s,%s\n"%(ScratchMZXMLPath, firstScanNumber, lastScanNumber)
+        for MainJob in Job.GetMainJobs():
+            ScratchMZXMLPath = os.path.join(self.gridEnv.MZXMLDir, MainJob.SpectrumFileName)
+            if MainJob.FirstScan != None:
+                SpectraStr += "spectra,%s,%s,%s\n"%(ScratchMZXMLPath, MainJob.FirstScan, MainJob.LastScan)
             else:
                 SpectraStr += "spectra,%s\n"%(ScratchMZXMLPath)
         param = self.config.get(ini_section,"inspect_param")
@@ -178,9 +223,13 @@ class ScriptMongler:
     def GetAlreadySearchedDict(self):
         """
         Return a dictionary of jobs which have already been searched.
-        Keys have the form (MZXMLFileName, BlockNumber)
+        Keys have the form (MZXMLFileName, BlockNumber); these are what the
+        blind search skips.  The standard search uses self.SearchedScans,
+        also filled in here: file name -> list of the (FirstScan, LastScan)
+        ranges flagged, LastScan -1 for the end of the file.
         """
         self.AlreadySearchedDict = {}
+        self.SearchedScans = {}
         if self.CheckDoneFlags:
             for DoneFileName in os.listdir(self.gridEnv.DoneDir):
                 DoneFile = open(os.path.join(self.gridEnv.DoneDir, DoneFileName), "rb")
@@ -192,6 +241,14 @@ class ScriptMongler:
                         continue
                     Key = (Bits[1], BlockNumber)
                     self.AlreadySearchedDict[Key] = 1
+                    try:
+                        ScanRange = (int(Bits[3]), int(Bits[4]))
+                    except:
+                        # No scan range: block 0 is how whole files are flagged
+                        if BlockNumber != 0:
+                            continue
+                        ScanRange = (0, -1)
+                    self.SearchedScans.setdefault(Bits[1], []).append(ScanRange)
                 DoneFile.close()
 ##        # DEBUG: Print the done flags:
 ##        print "===ClusterSub done flags:"
@@ -243,6 +300,9 @@ class ScriptMongler:
         # Scan counts are now created in ArchivveSpectraToRun
         # should probably refactor the code
         self.LoadScanCounts()
+        self.SecondsPerSpectrum = self.GetSecondsPerSpectrum()
+        if self.config.has_option(ini_section,"inspect_job_seconds"):
+            self.JobSeconds = self.config.getfloat(ini_section,"inspect_job_seconds")
         # Sanity-check our arguments:
         if not self.DBPath:
             raise Exception("** Error: No databases found in %s!" % self.projectDir)
@@ -268,36 +328,175 @@ class ScriptMongler:
         ########
         return JobList
 
-    def BuildJobsStandardSearch(self, SpectrumFileNames):
-        PendingJobList = []
-        CurrentMasterJob = None
+    def GetSecondsPerSpectrum(self):
+        """
+        Inspect time per spectrum in earlier runs: the "Elapsed time" of the
+        Inspect logs in ResultsX (and the grid output directory), over the
+        number of scans of the spectra in the matching job files.  Returns
+        DEFAULT_SECONDS_PER_SPECTRUM if there are no such logs.
+        """
+        TotalSeconds = 0.0
+        TotalScans = 0
+        JobCount = 0
+        LogPaths = glob.glob(os.path.join(self.gridEnv.ResultsXDir, "*.log")) + \
+                   glob.glob(os.path.join(self.gridEnv.OutputDir, "*.log"))
+        for LogPath in LogPaths:
+            JobStub = os.path.splitext(os.path.basename(LogPath))[0]
+            JobPath = os.path.join(self.gridEnv.JobDir, "%s.in"%JobStub)
+            if not os.path.exists(JobPath):
+                continue
+            LogFile = open(LogPath, "r")
+            Match = ElapsedTimePattern.search(LogFile.read())
+            LogFile.close()
+            if not Match:
+                continue
+            Scans = 0
+            JobFile = open(JobPath, "r")
+            for fileLine in JobFile.xreadlines():
+                Bits = fileLine.strip().split(",")
+                if Bits[0] != "spectra":
+                    continue
+                ScanCount = self.GetScanCountEstimate(Bits[1])
+                if len(Bits) > 3:
+                    LastScan = int(Bits[3])
+                    if LastScan < 0:
+                        LastScan = ScanCount
+                    ScanCount = max(0, min(LastScan, ScanCount) - int(Bits[2]) + 1)
+                Scans += ScanCount
+            JobFile.close()
+            if Scans:
+                TotalSeconds += float(Match.group(1))
+                TotalScans += Scans
+                JobCount += 1
+        if not TotalScans or not TotalSeconds:
+            return DEFAULT_SECONDS_PER_SPECTRUM
+        print "CS: %s seconds per spectrum in %s earlier jobs"%(TotalSeconds / TotalScans, JobCount)
+        return TotalSeconds / TotalScans
+
+    def GetScanCountEstimate(self, SpectrumFileName):
+        """
+        The (maximum) scan number of a spectrum file from ScanCount.txt.  For
+        files that weren't counted, guess from the file size and the bytes
+        per scan of the counted files.
+        """
+        SpectrumFilePath = os.path.join(self.gridEnv.MZXMLDir, SpectrumFileName)
+        (Stub, Extension) = os.path.splitext(SpectrumFilePath)
+        ScanCount = self.ScanCounts.get(Stub, None)
+        if ScanCount:
+            return ScanCount
+        BytesPerScan = [self.FileSizes[Key] / float(Count) for (Key, Count) in self.ScanCounts.items()
+                        if Count and self.FileSizes.get(Key, None)]
+        if BytesPerScan and os.path.exists(SpectrumFilePath):
+            BytesPerScan.sort()
+            BytesPerScan = BytesPerScan[len(BytesPerScan) / 2]
+            return max(1, int(os.path.getsize(SpectrumFilePath) / BytesPerScan))
+        return UNKNOWN_SCAN_COUNT
+
+    def GetUnsearchedScans(self, SpectrumFileName, ScanCount):
+        """
+        The (FirstScan, LastScan) ranges of a spectrum file that no done flag
+        covers, LastScan -1 for the end of the file.  Earlier runs may have
+        cut the file into other blocks (the seconds per spectrum is
+        re-learned on every run), so we subtract the flagged ranges rather
+        than look up our own blocks.
+        """
+        Ranges = []
+        NextScan = 0 # first scan not covered by the flags so far
+        Flagged = [(FirstScan, LastScan < 0 and sys.maxint or LastScan)
+                   for (FirstScan, LastScan) in self.SearchedScans.get(SpectrumFileName, [])]
+        Flagged.sort()
+        for (FirstScan, LastScan) in Flagged:
+            if FirstScan > NextScan:
+                Ranges.append((NextScan, FirstScan - 1))
+            NextScan = max(NextScan, LastScan + 1)
+        if NextScan <= ScanCount:
+            Ranges.append((NextScan, -1))
+        return Ranges
+
+    def GetSearchBlocks(self, SpectrumFileNames):
+        """
+        Split the scans of the spectrum files not searched yet (see
+        GetUnsearchedScans) into blocks that each take about self.JobSeconds
+        to search (or less).  Returns a list of (predicted seconds, file name,
+        first scan, last scan); first and last scan are None for a whole
+        file.  Only .mzXML files are split, so other files are searched
+        whole or not at all.
+        """
+        Blocks = []
+        MaxBlockScans = max(1, int(self.JobSeconds / self.SecondsPerSpectrum))
         for SpectrumFileName in SpectrumFileNames:
-            (prefix, Extension) = os.path.splitext(SpectrumFileName)
-            ScanCount = self.ScanCounts.get(prefix, None)
-            if not ScanCount:
-                # If we don't know the number of scans, let's assume it's few enough
-                # to handle in a single job.
-                ScanCount = 100
-                print "CS: File %s has UNKNOWN scan-count, guess %s"%(prefix, ScanCount)
-            else:
-                print "CS: File %s has %s scans"%(prefix, ScanCount)
-            BlockNumber = 0
-            JobKey = (SpectrumFileName, BlockNumber)
-            if self.AlreadySearchedDict.has_key(JobKey):
-                print "SKIP already searched:", JobKey
+            ScanCount = self.GetScanCountEstimate(SpectrumFileName)
+            print "CS: File %s has about %s scans"%(SpectrumFileName, ScanCount)
+            if os.path.splitext(SpectrumFileName)[1].lower() != ".mzxml":
+                if self.SearchedScans.has_key(SpectrumFileName):
+                    print "SKIP already searched:", SpectrumFileName
+                    continue
+                Blocks.append((ScanCount * self.SecondsPerSpectrum, SpectrumFileName, None, None))
                 continue
-            if not CurrentMasterJob:
-                CurrentMasterJob = self.createMasterJob()
-                CurrentMasterJob.TotalScans = 0
-            # Add a MAIN JOB, to search this file:
-            self.createMainJob(CurrentMasterJob, SpectrumFileName, BlockNumber)
-            CurrentMasterJob.TotalScans += ScanCount
-            # If the Master job now has two Main jobs, then finish it off:
-            if len(CurrentMasterJob.SubJobs) >= self.SpectraPerJob:
-                CurrentMasterJob = self.closeMasterJob(PendingJobList, CurrentMasterJob)
-        # The loop over spectrum files and blocks is now complete.
-        # If we're in the middle of handling a Master job, then finish it off.
-        if CurrentMasterJob:
+            Ranges = []
+            for (FirstScan, LastScan) in self.GetUnsearchedScans(SpectrumFileName, ScanCount):
+                # Scan numbers start at 1; the file's first block starts at 0
+                # and its last one runs to the end (-1), in case the count is low.
+                if LastScan < 0:
+                    RangeScans = ScanCount - max(FirstScan, 1) + 1
+                else:
+                    RangeScans = LastScan - max(FirstScan, 1) + 1
+                BlockCount = max(1, (RangeScans + MaxBlockScans - 1) / MaxBlockScans)
+                if BlockCount < 2 and (FirstScan, LastScan) == (0, -1):
+                    Ranges.append((None, None, ScanCount))
+                    continue
+                BlockScans = (RangeScans + BlockCount - 1) / BlockCount
+                Start = max(FirstScan, 1)
+                RangeBlocks = [(Start + Index * BlockScans, Start + (Index + 1) * BlockScans - 1, BlockScans)
+                               for Index in range(BlockCount)]
+                RangeBlocks[0] = (FirstScan,) + RangeBlocks[0][1:]
+                RangeBlocks[-1] = (RangeBlocks[-1][0], LastScan,
+                                   RangeScans - (BlockCount - 1) * BlockScans)
+                Ranges.extend(RangeBlocks)
+            if not Ranges:
+                print "SKIP already searched:", SpectrumFileName
+            for (FirstScan, LastScan, BlockScanCount) in Ranges:
+                Blocks.append((BlockScanCount * self.SecondsPerSpectrum, SpectrumFileName,
+                               FirstScan, LastScan))
+        return Blocks
+
+    def PackBlocks(self, Blocks):
+        """
+        Bin-pack search blocks into jobs of about equal predicted time: the
+        longest blocks first, each into the job with the least work so far
+        that has room (at most self.SpectraPerJob blocks per job).  Returns
+        a list of block lists.
+        """
+        if not Blocks:
+            return []
+        TotalSeconds = sum([Block[0] for Block in Blocks])
+        JobCount = max(int(TotalSeconds / float(self.JobSeconds) + 0.5),
+                       (len(Blocks) + self.SpectraPerJob - 1) / self.SpectraPerJob, 1)
+        Jobs = [[] for Index in range(JobCount)]
+        Loads = [(0.0, Index) for Index in range(JobCount)]
+        for Block in sorted(Blocks, reverse = True):
+            (Load, Index) = heapq.heappop(Loads)
+            Jobs[Index].append(Block)
+            if len(Jobs[Index]) < self.SpectraPerJob:
+                heapq.heappush(Loads, (Load + Block[0], Index))
+        return [Job for Job in Jobs if Job]
+
+    def BuildJobsStandardSearch(self, SpectrumFileNames):
+        """
+        One master job per group of blocks from PackBlocks, so that the jobs
+        take about the same time to run.
+        """
+        PendingJobList = []
+        for Job in self.PackBlocks(self.GetSearchBlocks(SpectrumFileNames)):
+            CurrentMasterJob = self.createMasterJob()
+            CurrentMasterJob.TotalScans = 0
+            for (Seconds, SpectrumFileName, FirstScan, LastScan) in Job:
+                # Add a MAIN JOB, to search this file (or block of it):
+                self.createMainJob(CurrentMasterJob, SpectrumFileName, FirstScan or 0,
+                                   FirstScan, LastScan)
+                CurrentMasterJob.TotalScans += int(Seconds / self.SecondsPerSpectrum)
+            print "CS: Job %s predicted to take %d seconds"%(CurrentMasterJob.FileName,
+                sum([Block[0] for Block in Job]))
             CurrentMasterJob = self.closeMasterJob(PendingJobList, CurrentMasterJob)
         return PendingJobList
 
@@ -330,7 +529,8 @@ class ScriptMongler:
                     CurrentMasterJob = self.createMasterJob()
 
                 # Add a MAIN JOB, to search this file:
-                self.createMainJob(CurrentMasterJob, SpectrumFileName, BlockNumber)
+                self.createMainJob(CurrentMasterJob, SpectrumFileName, BlockNumber,
+                                   FirstScanNumber, FirstScanNumber + self.gridEnv.BLIND_BLOCK_SIZE)
                 # If the Master job now has two Main jobs, then finish it off:
                 if len(CurrentMasterJob.SubJobs) >= self.SpectraPerJob:
                     CurrentMasterJob = self.closeMasterJob(PendingJobList, CurrentMasterJob)
@@ -348,7 +548,10 @@ class ScriptMongler:
         tarContents = {}
         tarCount = 0
         self.scanCountFile = os.path.join(self.gridEnv.ScratchDir,"ScanCount.txt")
-        scanArgStr = "-r %s -w %s" % (self.gridEnv.MZXMLDir, self.scanCountFile)
+        processes = 0
+        if self.config.has_option(ini_section,"prep_processes"):
+            processes = self.config.getint(ini_section,"prep_processes")
+        scanArgStr = "-r %s -w %s -i -p %s" % (self.gridEnv.MZXMLDir, self.scanCountFile, processes)
         scanArgs = scanArgStr.split()
 
         if not archiveDir:
@@ -371,16 +574,19 @@ class ScriptMongler:
 
                     tarContents[ mzFile ] = fulltar
                     tfile.extract(tinfo, path=self.gridEnv.MZXMLDir)
-                    try:
-                        CountScans.main( scanArgs )
-                    except IndexError:
-                        # An occasional mzxml file makes CountScans
-                        # raise an IndexError. Skip for now
-                        print "Spectrum file %s from %s had problem skipping." % (mzFile,tf)
-                        bad = os.path.join(self.gridEnv.MZXMLDir,mzFile)
-                        print "Removing %s." % bad
-                        os.unlink( bad )
-                        del(tarContents[ mzFile ])
+
+        # Count the scans of all the extracted files in one (parallel) pass
+        counter = CountScans.main( scanArgs )
+        for mzFile in counter.BadFiles:
+            # An occasional mzxml file has no scans CountScans can count.
+            # Skip for now
+            if mzFile not in tarContents:
+                continue
+            print "Spectrum file %s from %s had problem skipping." % (mzFile,tarContents[mzFile])
+            bad = os.path.join(self.gridEnv.MZXMLDir,mzFile)
+            print "Removing %s." % bad
+            os.unlink( bad )
+            del(tarContents[ mzFile ])
 
         print "Found %d spectra tar files with %d members" % (tarCount,len(tarContents))
         mzManifest = open(os.path.join(self.gridEnv.ScratchDir,"SpectraList.txt"),'w')
@@ -441,6 +647,10 @@ class ScriptMongler:
                             os.symlink( fullFastaPath, dest )
 
                         PrepDB.main( ['FASTA', dest] )
+                        if sixFrame:
+                            # Saved once here, so that every post-processing
+                            # task maps the q-gram index instead of building it
+                            bioseq.QGramIndex.prepare( fastaPrefix + sixFrame + '.trie' )
 
                         args = "-r %s -w %s -p" % (fastaPrefix + sixFrame + '.trie', rstrie)
                         ShuffleDB.main( args.split() ) 
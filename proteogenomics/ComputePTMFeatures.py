@@ -34,6 +34,7 @@ import ResultsParser
 import BuildConsensusSpectrum
 import SpectralSimilarity
 import StripPTM
+import SpectrumStore
 random.seed(1)
 from Utils import *
 from TrainPTMFeatures import FormatBits
@@ -124,6 +125,8 @@ class PTMFeatureComputer(ResultsParser.ResultsParser, ResultsParser.SpectrumOrac
         self.CachedFixedFilePaths = []
         self.StartOutputDBPos = 0
         self.RequiredFileNameChunk = None
+        # Spectrum files stay mapped, and recent spectra decoded, across clusters:
+        self.SpectrumStore = SpectrumStore.SpectrumStore()
         ResultsParser.ResultsParser.__init__(self)
         ResultsParser.SpectrumOracleMixin.__init__(self)
     def RememberString(self, StringList, NewString):
@@ -538,16 +541,12 @@ class PTMFeatureComputer(ResultsParser.ResultsParser, ResultsParser.SpectrumOrac
                 SpectrumFilePath = self.CachedFixedFilePaths[Info.FileNameIndex]
                 # Keep track of where these scans came from:
                 ClusterContentFile.write("%s\t%s\t\n"%(SpectrumFilePath, Info.ByteOffset))
-                Spectrum = MSSpectrum.SpectrumClass()
-                SpectrumFile = open(SpectrumFilePath, "rb")
-                SpectrumFile.seek(Info.ByteOffset)
-                Spectrum.ReadPeaksFromFile(SpectrumFile, SpectrumFilePath)
+                Spectrum = self.SpectrumStore.GetSpectrum(SpectrumFilePath, Info.ByteOffset)
                 if not Spectrum.PrecursorMZ:
                     print "* Error: Unable to read spectrum from '%s:%s'"%(SpectrumFilePath, Info.ByteOffset)
                     continue
                 ValidSpectra += 1
                 Spectrum.SetCharge(Charge)
-                SpectrumFile.close()
                 Builder.AddSpectrum(Spectrum)
                 # Special (and easy) case: If we only saw one spectrum, then write it
                 # out without changing it!
@@ -577,12 +576,8 @@ class PTMFeatureComputer(ResultsParser.ResultsParser, ResultsParser.SpectrumOrac
                         if Info.MQScore < ModlessMeanMQ - 3.0:
                             continue
                         SpectrumFilePath = self.CachedFixedFilePaths[Info.FileNameIndex]
-                        Spectrum = MSSpectrum.SpectrumClass()
-                        SpectrumFile = open(SpectrumFilePath, "rb")
-                        SpectrumFile.seek(Info.ByteOffset)
-                        Spectrum.ReadPeaksFromFile(SpectrumFile, SpectrumFilePath)
+                        Spectrum = self.SpectrumStore.GetSpectrum(SpectrumFilePath, Info.ByteOffset)
                         Spectrum.SetCharge(Charge)
-                        SpectrumFile.close()
                         Builder.AddSpectrum(Spectrum)
                     Spectrum = Builder.ProduceConsensusSpectrum()
                     Spectrum.WritePeaks(Species.Modless.ConsensusPath)
@@ -790,20 +785,15 @@ class PTMFeatureComputer(ResultsParser.ResultsParser, ResultsParser.SpectrumOrac
         Append the specified scan to an ever-growing .mgf file
         Returns 1 if successful, 0 if failed
         """
-        try:
-            SpectrumFile = open(InputFilePath, "rb")
-        except:
+        if not os.path.exists(InputFilePath):
             print "** Error: couldn't open spectrum data file %s"%InputFilePath
             return 0
-        SpectrumFile.seek(InputFilePos)
-        Spectrum = MSSpectrum.SpectrumClass()
         try:
-            Spectrum.ReadPeaksFromFile(SpectrumFile, InputFilePath)
+            Spectrum = self.SpectrumStore.GetSpectrum(InputFilePath, InputFilePos)
         except:
             traceback.print_exc()
-            print "***Can't parse:", InputFilePath, FileOffset
+            print "***Can't parse:", InputFilePath, InputFilePos
             return 0
-        SpectrumFile.close()
         ParentMass = Spectrum.PrecursorMZ * Charge - (Charge - 1)*1.0078 #Peptide.Masses[-1] + 19
         #MZ = (ParentMass + (Info.Charge - 1)*1.0078) / Info.Charge
         # Now write out this spectrum to the cluster:
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             # 
+#       Copyright (c) 2009 J. Craig Venter Institute.                         #     
+#       All rights reserved.                                                  #
+#                                                                             #
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+#                                                                             #
+###############################################################################
+
+UsageInfo = """ConvertInspectResults.py
+Convert Inspect/MSGF results between the tab delimited text format
+(.txt, .txt.bz2, ...) and the columnar binary format (.pgpc).
+
+Required Parameters
+ -r [FileName] Results file or directory to convert
+ -w [FileName] Output file or directory.  For a single file the format
+     is chosen by the extension (.pgpc, .bz2 or text)
+
+Additional Parameters
+ -e [Extension] Extension of the converted files when -r is a directory
+     (default .pgpc)
+"""
+
+import os
+import sys
+import getopt
+import InspectResults
+
+class ConverterClass:
+    def __init__(self):
+        self.InputPath = None
+        self.OutputPath = None
+        self.Extension = InspectResults.COLUMNAR_EXTENSION
+
+    def Main(self):
+        if os.path.isdir(self.InputPath):
+            InspectResults.ConvertResultsDir(self.InputPath, self.OutputPath, self.Extension)
+        else:
+            InspectResults.ConvertResults(self.InputPath, self.OutputPath)
+
+    def ParseCommandLine(self, Arguments):
+        (Options, Args) = getopt.getopt(Arguments, "r:w:e:")
+        OptionsSeen = {}
+        for (Option, Value) in Options:
+            OptionsSeen[Option] = 1
+            if Option == "-r":
+                if not os.path.exists(Value):
+                    print "** Error: couldn't find results file '%s'\n\n"%Value
+                    print UsageInfo
+                    sys.exit(1)
+                self.InputPath = Value
+            if Option == "-w":
+                self.OutputPath = Value
+            if Option == "-e":
+                self.Extension = Value
+        if not OptionsSeen.has_key("-r") or not OptionsSeen.has_key("-w"):
+            print UsageInfo
+            sys.exit(1)
+
+if __name__ == "__main__":
+    Converter = ConverterClass()
+    Converter.ParseCommandLine(sys.argv[1:])
+    Converter.Main()
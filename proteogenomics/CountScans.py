@@ -6,9 +6,15 @@ Iterate over a directory tree and produce sums for each file, and totals by dire
 import os
 import sys
 import getopt
+import re
+import mmap
+import multiprocessing
+import SpectrumStore
 
 MEG = 1024 * 1024
 
+ScanTagPattern = re.compile(r"<scan\s[^>]*>")
+
 # Keep track of the files for which we've written the scan count out.  When we come to
 # the end, if there are any known scan counts that we haven't yet written out,
 # then we write them out.
@@ -20,14 +26,101 @@ class CountScanBits:
     Count = 2
     MaxScan = 3
     FileSize = 4
+    MSLevels = 5
+
+def ScanMZXML(FilePath):
+    """
+    One pass over an .mzXML file: the start tag of each <scan> is matched
+    with a regular expression over a memory map of the file.  Returns a
+    SpectrumStore.ScanIndexEntry (scan number, byte offset, length, msLevel
+    and peak count; no precursor) for each scan.
+    """
+    Entries = []
+    File = open(FilePath, "rb")
+    if not os.fstat(File.fileno()).st_size:
+        File.close()
+        return Entries
+    Map = mmap.mmap(File.fileno(), 0, access = mmap.ACCESS_READ)
+    try:
+        for Match in ScanTagPattern.finditer(Map):
+            Tag = Match.group(0)
+            Entry = SpectrumStore.ScanIndexEntry(int(SpectrumStore.ScanNumPattern.search(Tag).group(1)),
+                                                 Match.start(), 0)
+            LevelMatch = SpectrumStore.MSLevelPattern.search(Tag)
+            if LevelMatch:
+                Entry.MSLevel = int(LevelMatch.group(1))
+            CountMatch = SpectrumStore.PeaksCountPattern.search(Tag)
+            if CountMatch:
+                Entry.PeakCount = int(CountMatch.group(1))
+            if Entries:
+                Entries[-1].Length = Entry.ByteOffset - Entries[-1].ByteOffset
+            Entries.append(Entry)
+        if Entries:
+            End = Map.find("</msRun>", Entries[-1].ByteOffset)
+            if End == -1:
+                End = len(Map)
+            Entries[-1].Length = End - Entries[-1].ByteOffset
+    finally:
+        Map.close()
+        File.close()
+    return Entries
+
+def SummarizeScans(Entries):
+    """
+    Returns (count, max scan number, msLevel histogram) for the scans of an
+    .mzXML file.  Only level 2 and 3 scans with more than 10 peaks are
+    counted; an IndexError is raised if there are none.
+    """
+    ScanNumbers = {}
+    MSLevels = {}
+    for Entry in Entries:
+        MSLevels[Entry.MSLevel] = MSLevels.get(Entry.MSLevel, 0) + 1
+        if Entry.PeakCount > 10 and Entry.MSLevel in (2, 3):
+            ScanNumbers[Entry.ScanNumber] = 1
+    if not ScanNumbers:
+        raise IndexError("no level 2 or 3 scans with more than 10 peaks")
+    return (len(ScanNumbers), max(ScanNumbers.keys()), MSLevels)
+
+def FormatMSLevels(MSLevels):
+    "msLevel histogram as 1:120,2:3400"
+    Keys = MSLevels.keys()
+    Keys.sort()
+    return ",".join(["%s:%s"%(Level, MSLevels[Level]) for Level in Keys])
+
+def ParseMSLevels(Text):
+    MSLevels = {}
+    for Bit in Text.split(","):
+        if Bit:
+            (Level, Count) = Bit.split(":")
+            MSLevels[int(Level)] = int(Count)
+    return MSLevels
+
+def CountScansTask(Task):
+    """
+    Pool worker: count the scans of one file.  Task is (file name, file
+    path, write scan index flag); returns (file name, result, error) where
+    result is None if the file isn't a spectrum file or has no countable
+    scans (error then says why).
+    """
+    (FileName, FilePath, WriteScanIndex) = Task
+    Counter = ScanCounter()
+    Counter.WriteScanIndex = WriteScanIndex
+    try:
+        return (FileName, Counter.CountScansInFile(FilePath), None)
+    except IndexError, Error:
+        return (FileName, None, str(Error))
 
 class ScanCounter:
     def __init__(self):
         self.KnownCounts = {} # filename -> number
         self.KnownMaxScans = {} # filename -> number
         self.FileSizes = {}
+        self.KnownMSLevels = {} # filename -> msLevel -> number of scans
+        self.BadFiles = [] # files with no scans to count
+        self.Processes = 1
         self.CountFileName = "ScanCount.txt"  # default
         self.CountDirectory = None
+        self.WriteScanIndex = 0
     def SaveKnownCounts(self, CountFileName):
         Keys = self.KnownCounts.keys()
         Keys.sort()
@@ -37,6 +130,7 @@ class ScanCounter:
             Str = "%s\t%s\t"%(FileName, Stub)
             Str += "%s\t%s\t"%(self.KnownCounts[FileName], self.KnownMaxScans[FileName])
             Str += "%s\t"%self.FileSizes[FileName]
+            Str += "%s\t"%FormatMSLevels(self.KnownMSLevels.get(FileName, {}))
             File.write(Str + "\n")
         File.close()
     def LoadKnownCounts(self, CountFileName):
@@ -54,9 +148,11 @@ class ScanCounter:
             self.KnownCounts[FileName] = Count
             self.KnownMaxScans[FileName] = MaxScan
             self.FileSizes[FileName] = FileSize
+            if len(Bits) > CountScanBits.MSLevels:
+                self.KnownMSLevels[FileName] = ParseMSLevels(Bits[CountScanBits.MSLevels])
         File.close()
     def ParseCommandLine(self, Arguments):
-        (Options, Args) = getopt.getopt(Arguments, "r:w:R")
+        (Options, Args) = getopt.getopt(Arguments, "r:w:Rip:")
         OptionsSeen = {}
         for (Option, Value) in Options:
             OptionsSeen[Option] = 1
@@ -64,6 +160,10 @@ class ScanCounter:
                 self.CountDirectory = Value
             elif Option == "-w":
                 self.CountFileName = Value
+            elif Option == "-i":
+                self.WriteScanIndex = 1
+            elif Option == "-p":
+                self.Processes = int(Value)
     def Main(self):
         # Load counts:
         self.LoadKnownCounts(self.CountFileName)
@@ -72,6 +172,12 @@ class ScanCounter:
         # Save counts:
         self.SaveKnownCounts(self.CountFileName)
     def CountScansInDirectory(self, InputFilePath):
+        """
+        Count the scans of every file under InputFilePath that we don't
+        know the count of yet; with self.Processes other than 1, several
+        files are counted at a time (0 means one process per CPU).
+        """
+        Tasks = []
         pathLen = len(InputFilePath) + 1
         for root,dirs,files in os.walk( InputFilePath ):
             if root == InputFilePath:
@@ -82,61 +188,67 @@ class ScanCounter:
                 # Handle a single file:
                 FileName = os.path.join(subDir,fileStr)
                 FilePath = os.path.join(root,fileStr)
+                if fileStr.endswith(SpectrumStore.SCAN_INDEX_EXTENSION):
+                    continue
                 if self.KnownCounts.has_key(FileName):
 #                    print "(Skip %s - already counted it)"%FileName
                     continue
+                Tasks.append((FileName, FilePath, self.WriteScanIndex))
+        if self.Processes == 1 or len(Tasks) < 2:
+            Results = map(CountScansTask, Tasks)
+            Pool = None
+        else:
+            Pool = multiprocessing.Pool(self.Processes or None)
+            Results = Pool.imap_unordered(CountScansTask, Tasks, 1)
+        try:
+            for (FileName, Result, Error) in Results:
                 print "(Count %s...)"%FileName
-                (Stub, Extension) = os.path.splitext(fileStr)
-                Extension = Extension.lower()
-                if Extension == ".mgf":
-                    Result = self.CountScansMGF(FilePath)
-                elif Extension == ".mzxml":
-                    Result = self.CountScansMZXML(FilePath)
-                elif Extension == ".ms2":
-                    Result = self.CountScansMS2(FilePath)
-                else:
-                    Result = None
+                if Error:
+                    print "** Can't count scans in %s: %s"%(FileName, Error)
+                    self.BadFiles.append(FileName)
+                    continue
                 if not Result:
                     continue
                 self.KnownCounts[FileName] = Result[0]
                 self.KnownMaxScans[FileName] = Result[1]
-                self.FileSizes[FileName] = os.stat(FilePath).st_size
+                self.KnownMSLevels[FileName] = Result[2]
+                self.FileSizes[FileName] = os.stat(os.path.join(InputFilePath, FileName)).st_size
+        finally:
+            if Pool:
+                Pool.close()
+                Pool.join()
+    def CountScansInFile(self, FilePath):
+        """
+        Returns (scan count, max scan number, msLevel histogram) for a
+        spectrum file, or None if it isn't one.  The histogram is empty
+        except for .mzXML files.
+        """
+        Extension = os.path.splitext(FilePath)[1].lower()
+        if Extension == ".mzxml":
+            if self.WriteScanIndex:
+                return SummarizeScans(SpectrumStore.GetScanIndex(FilePath, Save = 1))
+            return SummarizeScans(ScanMZXML(FilePath))
+        if self.WriteScanIndex and Extension == ".mgf":
+            Result = self.CountScansWithIndex(FilePath)
+        elif Extension == ".mgf":
+            Result = self.CountScansMGF(FilePath)
+        elif Extension == ".ms2":
+            Result = self.CountScansMS2(FilePath)
+        else:
+            return None
+        return Result + ({},)
+    def CountScansWithIndex(self, FilePath):
+        """
+        Build the SpectrumStore scan index of an .mzXML or .mgf file, save it
+        next to the file, and count the scans from it.
+        """
+        Entries = SpectrumStore.GetScanIndex(FilePath, Save = 1)
+        if os.path.splitext(FilePath)[1].lower() == ".mgf":
+            return (len(Entries), max(len(Entries) - 1, 0))
+        return SummarizeScans(Entries)[:2]
     def CountScansMZXML(self, FilePath):
-        FileScanCount = 0
-        File = open(FilePath, "r")
-        Text = ""
-        MZXMLScanNumbers = {}
-        while 1:
-            Block = File.read(MEG)
-            if not Block:
-                break
-            Text += Block
-            Pos = -1
-            while 1:
-                NextPos = Text.find("<scan num=\"", Pos + 1)
-                if NextPos == -1 or NextPos > len(Text) - 100:
-                    Text = Text[Pos + 1:]
-                    break
-                MSLevelPos = Text.find("msLevel=\"", Pos + 1)
-                PeakCountPos = Text.find("peaksCount=\"", Pos + 1)
-                QuotePos = Text.find('"', NextPos + 11)
-                ScanNumber = int(Text[NextPos + 11:QuotePos])
-                QuotePos = Text.find('"', PeakCountPos + 12)
-                PeakCount = int(Text[PeakCountPos + 12:QuotePos])
-                # Check the number of peaks AND the MSLevel:
-                if PeakCount > 10 and Text[MSLevelPos + 9] in ("2", "3"):
-                    #ScanCount += 1
-                    FileScanCount += 1
-                    MZXMLScanNumbers[ScanNumber] = 1
-                Pos = NextPos
-        File.close()
-        ScanNumbers = MZXMLScanNumbers.keys()
-        ScanNumbers.sort()
-        FileScanCount = len(ScanNumbers)
-#        MinScanNumber = ScanNumbers[0]
-        MaxScanNumber = ScanNumbers[-1]
-        return (FileScanCount, MaxScanNumber)
-        #return (MinScanNumber, MaxScanNumber, FileScanCount)
+        "Count the level 2 and 3 scans with more than 10 peaks in an .mzXML file."
+        return SummarizeScans(ScanMZXML(FilePath))[:2]
     def CountScansMGF(self, FilePath):
         "Count the number of SCAN= lines in an .mgf file."
         FileScanCount = 0
@@ -211,6 +323,10 @@ CountScans.py - report how many spectra are contained in an .mzXML or .mgf file
 Arguments:
  -r [Directory]: Count scans from here
  -w [FileName]: Save scan counts here.
+ -i: Also write a scan index (see SpectrumStore) next to each .mzXML and
+     .mgf file counted.
+ -p [Int]: Count this many files at a time (0: one process per CPU);
+     default 1.
 """
 
 def main(args):
@@ -219,6 +335,7 @@ def main(args):
     if not Counter.CountDirectory:
         raise Exception( UsageInfo )
     Counter.Main()
+    return Counter
 
 if __name__ == "__main__":
     try:
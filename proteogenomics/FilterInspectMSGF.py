@@ -9,7 +9,10 @@ class FilterInspect:
         self.pCutOff    = pCutOff
         self.justBest   = justBest
         self.inputPath  = inputPath
-        self.output     = bioseq.FlatFileIO(outputPath,'w')
+        if outputPath.endswith(InspectResults.COLUMNAR_EXTENSION):
+            self.output = InspectResults.ColumnarWriter(outputPath)
+        else:
+            self.output = bioseq.FlatFileIO(outputPath,'w')
 
     def filter(self):
         parser = InspectResults.Parser(self.inputPath)
@@ -43,6 +46,7 @@ class FilterInspect:
 
     def Main(self):
         self.filter()
+        self.output.close()
 
 def ParseCommandLine():
     Desc = 'Filter a MSGFInspectOutput file given a maximum P-value cutoff.'
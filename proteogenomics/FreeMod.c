@@ -660,7 +660,7 @@ void SearchDatabaseTagless(SearchInfo* Info, int MaxMods, int VerboseFlag, Spect
     }
     // Open the database, and start reading:
 
-    DBFile = Info->DB->DBFile;
+    DBFile = Info->DBFile;
 
     //DebugPrintPRMScores(Spectrum, Tweak); 
     Info->RecordNumber = 0;
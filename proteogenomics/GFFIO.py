@@ -30,37 +30,374 @@ NOTE: this is a utility, and not executable from the command line
 
 """
 
+import os
+import re
+import zlib
+import struct
+import tempfile
 from bioseq import FlatFileIO
 
-class File(FlatFileIO):
+GFF_INDEX_EXTENSION = ".gffidx"
+GFF_INDEX_VERSION = 1
+
+# Largest uncompressed BGZF block, as bgzip writes them
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+# The empty block that ends a BGZF file
+BGZF_EOF = "\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+RegionPattern = re.compile(r"^(.+?)(?::(\d+)-(\d+))?$")
+
+class GFFIndexEntry:
+    """Lines of one seqid at one place in a GFF file: Length bytes at DataOffset
+    into the BGZF block at FileOffset (DataOffset is 0 for a plain file), with
+    features from Start to End."""
+    Fields = ("SeqID", "FileOffset", "DataOffset", "Length", "Start", "End")
+    def __init__(self, SeqID, FileOffset, DataOffset, Length, Start, End):
+        self.SeqID = SeqID
+        self.FileOffset = FileOffset
+        self.DataOffset = DataOffset
+        self.Length = Length
+        self.Start = Start
+        self.End = End
+    def __str__(self):
+        return "\t".join([str(getattr(self, Field)) for Field in self.Fields])
+
+def formatRecord(record):
+    "The GFF line for a Record, without the newline"
+    attributes = '.'
+    if len(record.attributes) > 0:
+        # Attributes is a dictionary, which we join into key=value
+        # pairs with each separated by a ;
+        attributes = ";".join(["%s=%s" % pair for pair in record.attributes.items()])
+    return "\t".join([
+        record.seqid,
+        record.source,
+        record.type,
+        str(record.start),
+        str(record.end),
+        str(record.score),
+        record.strand,
+        str(record.phase),
+        attributes
+        ])
+
+def parseRegion(region):
+    """Parameters: "seqid" or "seqid:start-end" (1 based, inclusive)
+    Return: (seqid, start, end), with start and end None for a whole seqid
+    """
+    match = RegionPattern.match(region)
+    if not match:
+        raise ValueError("Bad GFF region %s" % region)
+    (seqid, start, end) = match.groups()
+    if start == None:
+        return (seqid, None, None)
+    return (seqid, int(start), int(end))
+
+def overlapsRegion(start, end, regionStart, regionEnd):
+    if regionStart == None:
+        return 1
+    if start == '.' or end == '.':
+        return 0
+    return start <= regionEnd and end >= regionStart
+
+def isScalar(column):
+    "True for a writeColumns column that is one value for every row"
+    return column is None or isinstance(column, (str, int, long, float))
+
+def makeBGZFBlock(data):
+    "One BGZF block (a gzip member with the block size in its header) of data"
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    blockSize = BGZF_HEADER.size + len(deflated) + 8
+    header = BGZF_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, blockSize - 1)
+    return header + deflated + struct.pack("<Ii", zlib.crc32(data) & 0xffffffff, len(data))
+
+def readBGZFBlock(handle, fileOffset):
+    "The uncompressed data of the BGZF block at fileOffset"
+    handle.seek(fileOffset)
+    header = handle.read(BGZF_HEADER.size)
+    fields = BGZF_HEADER.unpack(header)
+    if fields[0:4] != (0x1f, 0x8b, 8, 4) or fields[8:10] != (ord('B'), ord('C')):
+        raise ValueError("Not a BGZF block at %d" % fileOffset)
+    block = header + handle.read(fields[11] + 1 - BGZF_HEADER.size)
+    return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(block)
+
+def GFFIndexPath(filePath):
+    return filePath + GFF_INDEX_EXTENSION
+
+def SaveGFFIndex(filePath, entries, bgzip=0):
+    """Write the index of filePath next to it.  The size and time stamp of the
+    GFF file are recorded, so that a stale index is not used."""
+    stat = os.stat(filePath)
+    indexPath = GFFIndexPath(filePath)
+    # a temp file of our own, so that concurrent writers can't mix their lines
+    (fd, tmpPath) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(indexPath)))
+    handle = os.fdopen(fd, "wb")
+    handle.write("#GFFIndex\t%s\t%s\t%s\t%s\n" % (GFF_INDEX_VERSION, stat.st_size, int(stat.st_mtime), bgzip))
+    handle.write("#%s\n" % "\t".join(GFFIndexEntry.Fields))
+    handle.write("".join(["%s\n" % entry for entry in entries]))
+    handle.close()
+    os.chmod(tmpPath, 0644)
+    os.rename(tmpPath, indexPath)
+
+def LoadGFFIndex(filePath):
+    """The saved index of filePath as (entries, bgzip), or None if there is
+    none or it is stale."""
+    indexPath = GFFIndexPath(filePath)
+    if not os.path.exists(indexPath):
+        return None
+    stat = os.stat(filePath)
+    handle = open(indexPath, "rb")
+    bits = handle.readline().rstrip("\n").split("\t")
+    if len(bits) < 5 or bits[0] != "#GFFIndex" or int(bits[1]) != GFF_INDEX_VERSION \
+       or int(bits[2]) != stat.st_size or int(bits[3]) != int(stat.st_mtime):
+        handle.close()
+        return None
+    bgzip = int(bits[4])
+    entries = []
+    for line in handle:
+        if line[0] == "#":
+            continue
+        bits = line.split("\t")
+        entries.append(GFFIndexEntry(bits[0], int(bits[1]), int(bits[2]), int(bits[3]),
+                                     int(bits[4]), int(bits[5])))
+    handle.close()
+    return (entries, bgzip)
+
+def BuildGFFIndex(filePath):
+    """Parameters: a plain (uncompressed) GFF file
+    Return: list of GFFIndexEntry, one per run of lines of a seqid
+    (split every BGZF_BLOCK_SIZE bytes)
+    """
+    entries = []
+    handle = open(filePath, "rb")
+    offset = 0
+    entry = None
+    for line in handle:
+        if line[0] != "#" and line.strip():
+            cols = line.split("\t", 5)
+            (start, end) = (cols[3] == '.' and '.' or int(cols[3]), cols[4] == '.' and '.' or int(cols[4]))
+            if entry and entry.SeqID == cols[0] and entry.Length < BGZF_BLOCK_SIZE \
+                   and entry.FileOffset + entry.Length == offset:
+                entry.Length += len(line)
+            else:
+                entry = GFFIndexEntry(cols[0], offset, 0, len(line), None, None)
+                entries.append(entry)
+            if start != '.' and (entry.Start == None or start < entry.Start):
+                entry.Start = start
+            if end != '.' and (entry.End == None or end > entry.End):
+                entry.End = end
+        offset += len(line)
+    handle.close()
+    for entry in entries:
+        if entry.Start == None: # only '.' coordinates; no region will match them
+            (entry.Start, entry.End) = (0, 0)
+    return entries
+
+def GetGFFIndex(filePath, Save=0):
+    """The index of filePath as (entries, bgzip): the saved one if it is
+    current, else a new one for a plain file (saved next to it if Save is
+    set).  None for a compressed file without a saved index."""
+    index = LoadGFFIndex(filePath)
+    if index == None and os.path.splitext(filePath)[1] not in FlatFileIO.openTable:
+        index = (BuildGFFIndex(filePath), 0)
+        if Save:
+            SaveGFFIndex(filePath, index[0])
+    return index
 
-    ### inherits the constructor from FlatFileIO ###
+class File(FlatFileIO):
+    """Reads and writes GFF3.  Written to a path with saveIndex set, a File
+    keeps an index of where each seqid's lines are, saved next to the file
+    by close(), which query() uses to read just the lines of a region.
+    A path ending in .gz is written in BGZF blocks (as bgzip writes them, so
+    any gzip reader can read it), and the index points into the blocks;
+    close() must be called to write out the last block.
+    Writes of many records at once (writeRecords, writeColumns) are formatted
+    and written a chunk at a time.
+    """
+    def __init__(self, fileForIO, mode='r', saveIndex=0):
+        self.mode = mode
+        self.bgzip = 0
+        self.pending = [] # (seqid, start, end, line) not yet written
+        self.pendingSize = 0
+        self.indexEntries = None
+        FlatFileIO.__init__(self, fileForIO, mode)
+        if saveIndex:
+            if mode[0] != 'w' or not isinstance(fileForIO, str) or \
+                   os.path.splitext(fileForIO)[1] in ['.bz2']:
+                raise ValueError("Only a GFF written to a plain or .gz path can be indexed")
+            self.indexEntries = []
+
+    def open(self, fileName, mode):
+        if mode[0] == 'w' and os.path.splitext(fileName)[1] == '.gz':
+            self.bgzip = 1
+            return open(fileName, 'wb')
+        return FlatFileIO.open(self, fileName, mode)
 
     def __iter__(self):
-        for line in self.io.xreadlines():
+        for line in self.io:
             if line[0] in ["#", "\n", ""]:
                 continue
             yield Record(line)
 
-    def write(self,record):
-        attributes = '.'
-        if len(record.attributes) > 0:
-            # Attributes is a dictionary, which we join into key=value
-            # pairs with each separated by a ;
-            pairs = [(p[0],str(p[1])) for p in record.attributes.items()]
-            attributes = ";".join(["=".join(x) for x in pairs])
-
-        self.io.write("\t".join([
-            record.seqid,
-            record.source,
-            record.type,
-            str(record.start),
-            str(record.end),
-            str(record.score),
-            record.strand,
-            str(record.phase),
-            attributes
-            ]) + "\n")
+    def query(self, region):
+        """Parameters: a region "seqid" or "seqid:start-end"
+        Return: iterator of the Records of the seqid overlapping start-end
+        Description: reads only the indexed lines of the seqid; without an
+        index (e.g. a handle, not a path) the whole file is read.
+        """
+        (seqid, start, end) = parseRegion(region)
+        index = None
+        if getattr(self, 'name', None) and self.mode[0] == 'r':
+            index = GetGFFIndex(self.name)
+        if index == None:
+            for record in self:
+                if record.seqid == seqid and overlapsRegion(record.start, record.end, start, end):
+                    yield record
+            return
+        (entries, bgzip) = index
+        handle = open(self.name, 'rb')
+        blockOffset = None
+        for entry in entries:
+            if entry.SeqID != seqid or not overlapsRegion(entry.Start, entry.End, start, end):
+                continue
+            if bgzip:
+                if entry.FileOffset != blockOffset:
+                    block = readBGZFBlock(handle, entry.FileOffset)
+                    blockOffset = entry.FileOffset
+                data = block[entry.DataOffset:entry.DataOffset + entry.Length]
+            else:
+                handle.seek(entry.FileOffset)
+                data = handle.read(entry.Length)
+            for line in data.splitlines():
+                if line and line[0] != "#":
+                    record = Record(line)
+                    if overlapsRegion(record.start, record.end, start, end):
+                        yield record
+        handle.close()
+
+    def write(self, record):
+        self.writeRecords([record])
+
+    def writeRecords(self, records):
+        "Writes Records; plain files are written at the end of the call, bgzip a block at a time"
+        for record in records:
+            self.addLine(record.seqid, record.start, record.end, formatRecord(record))
+        self.flush(not self.bgzip)
+
+    def writeColumns(self, seqid, source, type, start, end, score, strand, phase, attributes):
+        """Parameters: the GFF columns, each either one value for every
+        feature, or a sequence (list, array, numpy array) with a value per
+        feature.  attributes maps (a dict, or a list of pairs) attribute
+        names to values, given the same way.
+        Description: writes one feature per row, as write() would the Record
+        """
+        columns = [seqid, source, type, start, end, score, strand, phase]
+        if isinstance(attributes, dict):
+            attributes = attributes.items()
+        rows = 1
+        for column in columns + [values for (key, values) in attributes]:
+            if not isScalar(column):
+                rows = len(column)
+                break
+        def Strings(column, prefix=""):
+            if isScalar(column):
+                return ["%s%s" % (prefix, column)] * rows
+            if hasattr(column, 'tolist'):
+                column = column.tolist()
+            if len(column) != rows:
+                raise ValueError("GFF columns of different lengths")
+            return ["%s%s" % (prefix, value) for value in column]
+        # numbers for the index, before they become strings
+        (starts, ends) = [Strings(column) for column in (start, end)]
+        stringColumns = [Strings(column) for column in (seqid, source, type)] + [starts, ends] + \
+                        [Strings(column) for column in (score, strand, phase)]
+        if len(attributes) > 0:
+            pairs = [Strings(values, "%s=" % key) for (key, values) in attributes]
+            stringColumns.append([";".join(row) for row in zip(*pairs)])
+        else:
+            stringColumns.append(['.'] * rows)
+        seqids = stringColumns[0]
+        lines = ["\t".join(row) for row in zip(*stringColumns)]
+        for i in xrange(rows):
+            self.addLine(seqids[i], starts[i] != '.' and int(starts[i]) or '.',
+                         ends[i] != '.' and int(ends[i]) or '.', lines[i])
+        self.flush(not self.bgzip)
+
+    def addLine(self, seqid, start, end, line):
+        self.pending.append( (seqid, start, end, line + "\n") )
+        self.pendingSize += len(line) + 1
+        if self.pendingSize >= BGZF_BLOCK_SIZE:
+            self.flush(0)
+
+    def flush(self, all=1):
+        """Writes the pending lines, a chunk of up to BGZF_BLOCK_SIZE bytes per
+        io.write (one BGZF block each when compressing).  Unless all is set,
+        a last partial chunk stays pending."""
+        while self.pending and (all or self.pendingSize >= BGZF_BLOCK_SIZE):
+            size = 0
+            count = 0
+            for (seqid, start, end, line) in self.pending:
+                if count > 0 and size + len(line) > BGZF_BLOCK_SIZE:
+                    break
+                size += len(line)
+                count += 1
+            chunk = self.pending[:count]
+            del self.pending[:count]
+            self.pendingSize -= size
+            self.writeChunk(chunk)
+
+    def writeChunk(self, chunk):
+        data = "".join([row[3] for row in chunk])
+        if self.bgzip:
+            block = makeBGZFBlock(data)
+            if len(block) > 0x10000 and len(chunk) > 1:
+                # Didn't compress into one block (very rare); write it in halves
+                self.writeChunk(chunk[:len(chunk) / 2])
+                self.writeChunk(chunk[len(chunk) / 2:])
+                return
+        if self.indexEntries != None:
+            self.indexChunk(chunk, self.io.tell())
+        if self.bgzip:
+            self.io.write(block)
+        else:
+            self.io.write(data)
+
+    def indexChunk(self, chunk, fileOffset):
+        dataOffset = 0
+        entry = None
+        if not self.bgzip and self.indexEntries:
+            # Carry on the last entry, if this chunk comes right after it
+            entry = self.indexEntries[-1]
+            if entry.FileOffset + entry.Length != fileOffset or entry.Length >= BGZF_BLOCK_SIZE:
+                entry = None
+        for (seqid, start, end, line) in chunk:
+            if entry and entry.SeqID == seqid and (self.bgzip or entry.Length < BGZF_BLOCK_SIZE):
+                entry.Length += len(line)
+            else:
+                if self.bgzip:
+                    entry = GFFIndexEntry(seqid, fileOffset, dataOffset, len(line), None, 0)
+                else:
+                    entry = GFFIndexEntry(seqid, fileOffset + dataOffset, 0, len(line), None, 0)
+                self.indexEntries.append(entry)
+            if start != '.' and end != '.':
+                if entry.Start == None or entry.Start > start:
+                    entry.Start = start
+                entry.End = max(entry.End, end)
+            dataOffset += len(line)
+
+    def close(self):
+        self.flush()
+        if self.bgzip:
+            self.io.write(BGZF_EOF)
+        self.io.close()
+        if self.indexEntries != None:
+            for entry in self.indexEntries:
+                if entry.Start == None:
+                    entry.Start = 0
+            SaveGFFIndex(self.name, self.indexEntries, self.bgzip)
+            self.indexEntries = None
 
 class Record(object):
     def __init__(self, gffline="\t".join(list('.'*9)) ): #default assign = nine dots separated by tabs === semantic NULL
@@ -78,12 +415,7 @@ class Record(object):
         self.score = cols[5] == '.' and '.' or float(cols[5])
         self.strand= cols[6]
         self.__phase = cols[7] == '.' and '.' or int(cols[7])
-        self.attributes = {}
-        for Pair in cols[8].split(";"):
-            if '.' == Pair:
-                continue
-            (Key, Value) = Pair.split("=")
-            self.attributes[Key] = Value
+        self.attributes = dict([Pair.split("=") for Pair in cols[8].split(";") if Pair != '.'])
 
     @property
     def phase(self):
@@ -28,11 +28,53 @@ Constants and methods for parsing (Inspect) search results
 """
 import os
 import bz2
+import zlib
+import struct
 import random
+import traceback
+import multiprocessing
 random.seed(1)
+try:
+    import numpy
+except ImportError:
+    numpy = None # the columnar format is not available without numpy
 
-class Row:
+# Extension of results files in the columnar binary format
+COLUMNAR_EXTENSION = ".pgpc"
+COLUMNAR_MAGIC = "PGPCOL01"
+COLUMNAR_CHUNK_ROWS = 65536
+
+# Row attributes in column order, with their type in the columnar format.
+# "dict" columns are dictionary encoded strings, stored as int32 codes.
+# A missing LFDR is stored as NaN.
+COLUMNS = [ ("SpectrumFile", "dict"),
+            ("ScanNumber", "<i4"),
+            ("Annotation", "dict"),
+            ("ProteinName", "dict"),
+            ("Charge", "<i4"),
+            ("MQScore", "<f8"),
+            ("Length", "<f8"),
+            ("TotalPRM", "<f8"),
+            ("MedianPRM", "<f8"),
+            ("FractionY", "<f8"),
+            ("FraxtionB", "<f8"),
+            ("Intensity", "<f8"),
+            ("NTT", "<f8"),
+            ("PValue", "<f8"),
+            ("FScore", "<f8"),
+            ("DeltaScoreAny", "<f8"),
+            ("DeltaScore", "<f8"),
+            ("ProteinID", "<i4"),
+            ("DBPos", "<i8"),
+            ("FileOffset", "<i8"),
+            ("LFDR", "<f8"),
+            ]
+
+class Row(object):
     "Object representing one row of inspect output."
+    # Millions of these pass through, so no per-instance dict
+    __slots__ = [Name for (Name, Type) in COLUMNS]
+
     def __init__(self):
         self.SpectrumFile = None
         self.ScanNumber = None
@@ -109,20 +151,359 @@ class Row:
         if numCols == 21:
             self.LFDR     = float(cols[20])
     
+def RowsFromBatch(Batch):
+    """Generator of Row objects from a batch of column arrays, as returned
+    by ColumnarReader.iterBatches
+    """
+    Names = [Name for (Name, Type) in COLUMNS]
+    Columns = [Batch[Name].tolist() for Name in Names]
+    for Values in zip(*Columns):
+        row = Row()
+        for (Name, Value) in zip(Names, Values):
+            setattr(row, Name, Value)
+        if row.LFDR != row.LFDR: # NaN, the column was not there
+            row.LFDR = None
+        yield row
+
+def BatchFromLines(Lines):
+    """Parses result text lines into a batch of column arrays, like the
+    ones from ColumnarReader.iterBatches.  The numbers are converted by
+    numpy for whole columns at once.
+    """
+    Rows = []
+    for Line in Lines:
+        Cols = Line.strip().split("\t")
+        NumCols = len(Cols)
+        if NumCols == 20:
+            Cols.append("nan") # no LFDR
+        elif NumCols != 21:
+            raise Exception("Error in number of columns, got %d:\n%s\n" % (NumCols,Cols))
+        Rows.append(Cols)
+    if Rows:
+        Columns = zip(*Rows)
+    else:
+        Columns = [()] * len(COLUMNS)
+    Batch = {}
+    for ((Name, Type), Column) in zip(COLUMNS, Columns):
+        if Type == "dict":
+            Type = object
+        Batch[Name] = numpy.array(Column, dtype=Type)
+    return Batch
+
+class ColumnarWriter:
+    """Writes results in the columnar binary format: chunks of up to
+    ChunkRows rows, each a zlib compressed block of one typed array per
+    column.  String columns are dictionary encoded, and every chunk carries
+    only the strings that are new since the previous chunk.
+    Besides writeRow, write accepts text lines as they are written to 
+    results files, so it can stand in for an output file handle.
+    """
+    def __init__(self, FileName, ChunkRows = COLUMNAR_CHUNK_ROWS):
+        if not numpy:
+            raise ImportError("numpy is required for the columnar results format")
+        self.handle = open(FileName, "wb")
+        self.handle.write(COLUMNAR_MAGIC)
+        self.chunkRows = ChunkRows
+        self.header = ""
+        self.codes = {} # column name -> {string: code}
+        self.newStrings = {} # column name -> strings added since last chunk
+        for (Name, Type) in COLUMNS:
+            if Type == "dict":
+                self.codes[Name] = {}
+                self.newStrings[Name] = []
+        self.__resetChunk()
+
+    def __resetChunk(self):
+        self.columns = dict([ (Name, []) for (Name, Type) in COLUMNS])
+        self.numRows = 0
+
+    def write(self, Text):
+        for Line in Text.splitlines(True):
+            if not Line.strip():
+                continue # blank lines carry no row, as in the text files
+            if Line[0] == "#":
+                self.header = Line
+                continue
+            row = Row()
+            row.populateFromString(Line)
+            self.writeRow(row)
+
+    def writeRow(self, row):
+        for (Name, Type) in COLUMNS:
+            Value = getattr(row, Name)
+            if Type == "dict":
+                Codes = self.codes[Name]
+                Code = Codes.get(Value)
+                if Code == None:
+                    Code = len(Codes)
+                    Codes[Value] = Code
+                    self.newStrings[Name].append(Value)
+                Value = Code
+            elif Value == None:
+                Value = numpy.nan
+            self.columns[Name].append(Value)
+        self.numRows += 1
+        if self.numRows >= self.chunkRows:
+            self.flush()
+
+    def flush(self):
+        if not self.numRows and not self.header:
+            return
+        Parts = [struct.pack("<I", len(self.header)), self.header]
+        for (Name, Type) in COLUMNS:
+            if Type == "dict":
+                Strings = "\0".join(self.newStrings[Name])
+                Parts.append(struct.pack("<II", len(self.newStrings[Name]), len(Strings)))
+                Parts.append(Strings)
+                self.newStrings[Name] = []
+        for (Name, Type) in COLUMNS:
+            if Type == "dict":
+                Type = "<i4"
+            Parts.append(numpy.array(self.columns[Name], dtype=Type).tostring())
+        Payload = "".join(Parts)
+        Compressed = zlib.compress(Payload, 6)
+        self.handle.write(struct.pack("<III", self.numRows, len(Payload), len(Compressed)))
+        self.handle.write(Compressed)
+        self.header = "" # written once
+        self.__resetChunk()
+
+    def close(self):
+        if self.handle.closed:
+            return
+        self.flush()
+        self.handle.close()
+
+    def __del__(self):
+        # Parser replaces its mirror handles without closing them
+        if hasattr(self, "handle"):
+            self.close()
+
+class ColumnarReader:
+    """Reads files written by ColumnarWriter, one chunk at a time."""
+    def __init__(self, FileName):
+        if not numpy:
+            raise ImportError("numpy is required for the columnar results format")
+        self.handle = open(FileName, "rb")
+        if self.handle.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError("%s is not a columnar results file"%FileName)
+        self.header = ""
+        self.strings = {}
+        for (Name, Type) in COLUMNS:
+            if Type == "dict":
+                self.strings[Name] = []
+
+    def iterBatches(self):
+        """Generator of dicts of column name -> numpy array, one per chunk.
+        String columns are decoded into object arrays.
+        """
+        ChunkHeaderSize = struct.calcsize("<III")
+        while 1:
+            ChunkHeader = self.handle.read(ChunkHeaderSize)
+            if len(ChunkHeader) < ChunkHeaderSize:
+                break
+            (NumRows, PayloadLen, CompressedLen) = struct.unpack("<III", ChunkHeader)
+            Payload = zlib.decompress(self.handle.read(CompressedLen))
+            if len(Payload) != PayloadLen:
+                raise ValueError("Corrupt columnar results chunk")
+            (HeaderLen,) = struct.unpack_from("<I", Payload, 0)
+            Pos = 4
+            if HeaderLen:
+                self.header = Payload[Pos:Pos + HeaderLen]
+            Pos += HeaderLen
+            for (Name, Type) in COLUMNS:
+                if Type == "dict":
+                    (Count, StringsLen) = struct.unpack_from("<II", Payload, Pos)
+                    Pos += 8
+                    if Count:
+                        self.strings[Name].extend(Payload[Pos:Pos + StringsLen].split("\0"))
+                    Pos += StringsLen
+            Batch = {}
+            for (Name, Type) in COLUMNS:
+                IsDict = (Type == "dict")
+                if IsDict:
+                    Type = "<i4"
+                Column = numpy.frombuffer(Payload, dtype=Type, count=NumRows, offset=Pos)
+                Pos += Column.nbytes
+                if IsDict:
+                    Column = numpy.array(self.strings[Name], dtype=object)[Column]
+                Batch[Name] = Column
+            yield Batch
+
+    def __iter__(self):
+        for Batch in self.iterBatches():
+            for row in RowsFromBatch(Batch):
+                yield row
+
+    def close(self):
+        self.handle.close()
+
+def IsResultsFile(FileName):
+    "True if FileName has the extension of a results file the Parser reads"
+    (Stub, Extension) = os.path.splitext(FileName)
+    Extension = Extension.lower()
+    if Extension == '.bz2':
+        return os.path.splitext(Stub)[1].lower() in Parser.extensions
+    return Extension in Parser.extensions or Extension == COLUMNAR_EXTENSION
+
+def OpenResultsInput(FileName):
+    """Returns a handle to read the results file FileName: a ColumnarReader,
+    a plain or a bz2 file.  None if the file is not a results file.
+    """
+    if not IsResultsFile(FileName):
+        return None
+    Extension = os.path.splitext(FileName)[1].lower()
+    if Extension == COLUMNAR_EXTENSION:
+        return ColumnarReader( FileName )
+    if Extension == '.bz2':
+        return bz2.BZ2File( FileName )
+    return open( FileName )
+
+def ParseFilesWorker(TaskQueue, OutQueue, BatchSize):
+    """Body of the worker processes of a Parser with Workers.  Takes 
+    (file index, file name) tasks from TaskQueue until it gets None, and
+    puts (kind, file index, payload) messages on OutQueue: "header" lines,
+    "batch"es of parsed rows, "end" of each file, "error" with a traceback
+    and finally "done".  OutQueue is bounded, so a worker only reads ahead
+    as far as the consumer lets it.
+    """
+    while 1:
+        Task = TaskQueue.get()
+        if Task == None:
+            OutQueue.put(("done", None, None))
+            return
+        (FileIndex, FileName) = Task
+        try:
+            fileHandle = OpenResultsInput(FileName)
+            if isinstance(fileHandle, ColumnarReader):
+                for Batch in fileHandle.iterBatches():
+                    if fileHandle.header:
+                        OutQueue.put(("header", FileIndex, fileHandle.header))
+                        fileHandle.header = ""
+                    OutQueue.put(("batch", FileIndex, Batch))
+            else:
+                Lines = []
+                for line in fileHandle:
+                    if line[0] == '#':
+                        OutQueue.put(("header", FileIndex, line))
+                        continue
+                    Lines.append(line)
+                    if len(Lines) == BatchSize:
+                        OutQueue.put(("batch", FileIndex, BatchFromLines(Lines)))
+                        Lines = []
+                if Lines:
+                    OutQueue.put(("batch", FileIndex, BatchFromLines(Lines)))
+            fileHandle.close()
+            OutQueue.put(("end", FileIndex, None))
+        except:
+            OutQueue.put(("error", FileIndex, traceback.format_exc()))
+            return
+
+def ReadCheckpoint(FileName):
+    """Reads a Parser checkpoint file: dict of consumed file name -> its
+    size in bytes.  Empty if there is no checkpoint yet.
+    """
+    Consumed = {}
+    if not os.path.exists(FileName):
+        return Consumed
+    for line in open(FileName):
+        Bits = line.rstrip("\n").split("\t")
+        if len(Bits) != 2:
+            continue # cut short by an interruption
+        Consumed[Bits[0]] = int(Bits[1])
+    return Consumed
+
+def OpenResultsOutput(FileName):
+    """Returns a handle to write results text to; a ColumnarWriter for files
+    with the columnar extension, a plain or bz2 file otherwise.
+    """
+    if FileName.endswith(COLUMNAR_EXTENSION):
+        return ColumnarWriter(FileName)
+    if FileName.endswith(".bz2"):
+        return bz2.BZ2File(FileName, "w")
+    return open(FileName, "w")
+
+def ConvertResults(InputPath, OutputPath):
+    """Copies the results file InputPath (text or columnar) into OutputPath.
+    The output format is chosen by OutputPath's extension: the columnar
+    extension, .bz2 or plain text.
+    """
+    if os.path.isdir(InputPath):
+        raise ValueError("Use ConvertResultsDir for directories")
+    Output = OpenResultsOutput(OutputPath)
+    parser = Parser(InputPath, QuietFlag = 1)
+    HeaderWritten = 0
+    for row in parser:
+        if not HeaderWritten:
+            if parser.header:
+                Output.write(parser.header)
+            HeaderWritten = 1
+        if isinstance(Output, ColumnarWriter):
+            Output.writeRow(row)
+        else:
+            Output.write(str(row))
+    if not HeaderWritten and parser.header:
+        Output.write(parser.header)
+    Output.close()
+
+def ConvertResultsDir(InputDir, OutputDir, Extension):
+    """Converts every results file in InputDir into OutputDir, replacing
+    its (possibly compressed) extension by Extension."""
+    if not os.path.exists(OutputDir):
+        os.makedirs(OutputDir)
+    for FileName in sorted(os.listdir(InputDir)):
+        (Stub, Ext) = os.path.splitext(FileName)
+        if Ext.lower() == ".bz2":
+            (Stub, Ext) = os.path.splitext(Stub)
+        if Ext.lower() not in Parser.extensions + (COLUMNAR_EXTENSION,):
+            continue
+        ConvertResults(os.path.join(InputDir, FileName),
+                       os.path.join(OutputDir, Stub + Extension))
+
 class Parser():
     """Class to iterate through an inspect results file, or every
         search-results file in a directory. Supports bz2 compressed files,
         as well as a method to mirror the input directory structure into
         a new location on output.
     """
-    def __init__(self, FilePath, MaxFilesToParse = None, QuietFlag = 0, inputMirrorTo = None):
+    extensions = (".txt", ".res", ".csv", ".out", ".msgf")
+
+    def __init__(self, FilePath, MaxFilesToParse = None, QuietFlag = 0, inputMirrorTo = None,
+                 Workers = None, Ordered = True, ReadAhead = 4,
+                 ScanOrder = "name", Checkpoint = None):
         """Constructor arguments: FilePath is input file or dir of inspect results.
         MaxFilesToParse: sets a hard limit on how many files from a dir to read.
+            They are taken evenly spaced through the scan order, so that
+            they are not just the first runs by name (or size).
         QuietFlag: True for quiet False for verbose
         inputMirrorTo: an output directory to mirror the input dir structure to.
             obj.mirrorOutHandle will be the handle to write out to the current file.
+        Workers: number of processes that decompress and parse files ahead
+            of the consumer (needs numpy).  None or 1 reads in this process.
+        Ordered: with Workers, hand out the rows file by file in the scan 
+            order.  If false, batches come in whatever order the workers
+            finish them (and mirroring is not possible).
+        ReadAhead: with Workers, how many batches each worker may have
+            parsed but not yet consumed.
+        ScanOrder: order to read the files of a dir in; "name", "size"
+            (smallest first) or "random" (a shuffle).
+        Checkpoint: a file to record the files already consumed in.  Files
+            in it are skipped (unless they changed size since), so an 
+            interrupted run can be restarted where it stopped.  A file counts
+            as consumed once its last row was taken and the next one was
+            asked for; its mirror file is closed at that point.
         """
-        self.extensions = (".txt", ".res", ".csv", ".out", ".msgf")
+        if Workers > 1 and not numpy:
+            print "InspectResults.Parser: numpy not found, reading results in one process"
+            Workers = None
+        if Workers > 1 and not Ordered and (inputMirrorTo or Checkpoint):
+            raise ValueError("Mirroring the input or checkpointing needs the results in order")
+        if ScanOrder not in ("name", "size", "random"):
+            raise ValueError("Unknown scan order %s" % ScanOrder)
+        self.workers = Workers
+        self.ordered = Ordered
+        self.readAhead = ReadAhead
+        self.scanOrder = ScanOrder
+        self.checkpoint = Checkpoint
         self.maxFiles = MaxFilesToParse
         self.quiet = QuietFlag
         self.filePath = FilePath
@@ -135,39 +516,224 @@ class Parser():
             os.makedirs( inputMirrorTo )
 
     def __del__(self):
-        if self.outputMirrorInput:
+        if self.mirrorOutHandle:
             self.mirrorOutHandle.close()
 
     def __createHandles__( self, FileName ):
         """Internal method that creates the input and optional
         output file handles for the iterator.
         """
-        fileHandle = None
-        (dirName,baseName) = os.path.split( FileName )
-        (Stub, Extension) = os.path.splitext(FileName)
-        if Extension.lower() in self.extensions:
-            fileHandle = open( FileName )
-            if self.outputMirrorInput:
-                self.mirrorOutHandle = open( os.path.join(
-                    self.outputMirrorInput, baseName ), "w")
-
-        elif Extension.lower() == '.bz2':
-            Extension = os.path.splitext(Stub)[1]
-            if Extension.lower() in self.extensions:
-                fileHandle = bz2.BZ2File( FileName )
-                if self.outputMirrorInput:
-                    self.mirrorOutHandle = bz2.BZ2File( os.path.join(
-                        self.outputMirrorInput, baseName ),"w")
-
+        fileHandle = OpenResultsInput( FileName )
+        if fileHandle and self.outputMirrorInput:
+            self.__createMirror__( FileName )
         return fileHandle
 
-    def __iter__(self):
+    def __createMirror__( self, FileName ):
+        """Internal method that opens mirrorOutHandle for an input file,
+        in the same format as the input.
+        """
+        baseName = os.path.basename( FileName )
+        mirrorName = os.path.join( self.outputMirrorInput, baseName )
+        Extension = os.path.splitext(FileName)[1].lower()
+        if Extension == COLUMNAR_EXTENSION:
+            self.mirrorOutHandle = ColumnarWriter( mirrorName )
+        elif Extension == '.bz2':
+            self.mirrorOutHandle = bz2.BZ2File( mirrorName, "w" )
+        else:
+            self.mirrorOutHandle = open( mirrorName, "w" )
+
+    def iterBatches(self, BatchSize = COLUMNAR_CHUNK_ROWS):
+        """Generator of batches of up to BatchSize rows, as dicts of column 
+        name -> numpy array (see COLUMNS; strings are object arrays and a
+        missing LFDR is NaN).  A batch never spans two files, so 
+        currentFileName and mirrorOutHandle are valid for the whole batch.
+        """
+        if not numpy:
+            raise ImportError("numpy is required for reading results in batches")
         print "ResultsParser:%s" % self.filePath
+        if self.workers > 1:
+            for (FileName, Batches) in self.__iterWorkerFiles__(BatchSize):
+                for Batch in Batches:
+                    yield Batch
+            return
+        for (FileName, fileHandle) in self.__iterFiles__():
+            if isinstance(fileHandle, ColumnarReader):
+                for Batch in fileHandle.iterBatches():
+                    self.header = fileHandle.header
+                    NumRows = len(Batch["ScanNumber"])
+                    for Start in xrange(0, NumRows, BatchSize):
+                        yield dict([(Name, Column[Start:Start + BatchSize]) 
+                                    for (Name, Column) in Batch.items()])
+            else:
+                Lines = []
+                for line in fileHandle:
+                    if line[0] == '#':
+                        self.header = line
+                        if self.outputMirrorInput:
+                            self.mirrorOutHandle.write( line )
+                        continue
+                    Lines.append(line)
+                    if len(Lines) == BatchSize:
+                        yield BatchFromLines(Lines)
+                        Lines = []
+                if Lines:
+                    yield BatchFromLines(Lines)
+            fileHandle.close()
+
+    def __iterWorkerFiles__(self, BatchSize):
+        """Internal generator of (file name, iterator over the batches of
+        the file), parsed by worker processes.
+        Ordered: worker k gets files k, k+Workers, ... and its own queue, so
+        the batches of each file can be taken from its worker in turn.
+        Unordered: the workers share one queue of files and one of batches,
+        and each batch comes on its own.
+        """
+        FileNames = filter(IsResultsFile, self.__listFiles__())
+        if self.maxFiles != None:
+            FileNames = FileNames[:max(self.maxFiles + 1 - self.FileCount, 0)]
+        Workers = min(self.workers, max(len(FileNames), 1))
+        if self.ordered:
+            TaskQueues = [multiprocessing.Queue() for Worker in range(Workers)]
+            OutQueues = [multiprocessing.Queue(self.readAhead) for Worker in range(Workers)]
+        else:
+            TaskQueues = [multiprocessing.Queue()] * Workers
+            OutQueues = [multiprocessing.Queue(self.readAhead * Workers)] * Workers
+        for (FileIndex, FileName) in enumerate(FileNames):
+            TaskQueues[FileIndex % Workers].put((FileIndex, FileName))
+        for Worker in range(Workers):
+            TaskQueues[Worker].put(None)
+        Processes = [multiprocessing.Process(target = ParseFilesWorker,
+                        args = (TaskQueues[Worker], OutQueues[Worker], BatchSize))
+                     for Worker in range(Workers)]
+        for Process in Processes:
+            Process.daemon = True
+            Process.start()
+        try:
+            if self.ordered:
+                for (FileIndex, FileName) in enumerate(FileNames):
+                    self.__startWorkerFile__(FileIndex, FileNames)
+                    Queue = OutQueues[FileIndex % Workers]
+                    Batches = self.__iterWorkerFileBatches__(Queue)
+                    yield (FileName, Batches)
+                    for Batch in Batches:
+                        pass # the rest the consumer did not take
+                    self.__fileConsumed__(FileName)
+            else:
+                Done = 0
+                Started = {}
+                while Done < Workers:
+                    (Kind, Index, Payload) = OutQueues[0].get()
+                    if Kind == "done":
+                        Done += 1
+                        continue
+                    if Kind == "end":
+                        continue
+                    if not Started.has_key(Index):
+                        Started[Index] = 1
+                        self.__startWorkerFile__(Index, FileNames)
+                    self.currentFileName = FileNames[Index]
+                    Batch = self.__workerMessage__(Kind, Payload)
+                    if Batch != None:
+                        yield (self.currentFileName, [Batch])
+            for Process in Processes:
+                Process.join()
+        finally:
+            # also when the consumer stopped early
+            for Process in Processes:
+                if Process.is_alive():
+                    Process.terminate()
+
+    def __iterWorkerFileBatches__(self, Queue):
+        "Internal generator of the batches of one file from a worker's queue"
+        while 1:
+            (Kind, Index, Payload) = Queue.get()
+            if Kind == "end":
+                return
+            Batch = self.__workerMessage__(Kind, Payload)
+            if Batch != None:
+                yield Batch
+
+    def __startWorkerFile__(self, FileIndex, FileNames):
+        FileName = FileNames[FileIndex]
+        if not self.quiet:
+            print "(%s/%s) %s"%(FileIndex, len(FileNames), FileName)
+        self.FileCount += 1
+        self.currentFileName = FileName
+        if self.outputMirrorInput:
+            self.__createMirror__( FileName )
+
+    def __workerMessage__(self, Kind, Payload):
+        """Internal: handles one worker message, returns the batch if it was one"""
+        if Kind == "error":
+            raise Exception("Error parsing %s in a worker:\n%s"%(self.currentFileName, Payload))
+        if Kind == "header":
+            self.header = Payload
+            # maintain the comment lines in the mirrored output
+            if self.outputMirrorInput:
+                self.mirrorOutHandle.write( Payload )
+            return None
+        return Payload
+
+    def __listFiles__(self):
+        """Internal: the files to read, in the order to read them, less the
+        ones in the checkpoint (which are counted in FileCount).
+        """
         if os.path.isdir(self.filePath):
             FileNames = [os.path.join(self.filePath,x) for x in os.listdir(self.filePath)]
-            random.shuffle(FileNames)
+            if self.scanOrder == "random":
+                random.shuffle(FileNames)
+            elif self.scanOrder == "size":
+                FileNames = [(os.path.getsize(x), x) for x in FileNames]
+                FileNames.sort()
+                FileNames = [x for (Size, x) in FileNames]
+            else:
+                FileNames.sort()
+            if self.maxFiles != None:
+                FileNames = self.__sampleFiles__(FileNames)
         else:
             FileNames = [self.filePath]
+        if not self.checkpoint:
+            return FileNames
+        Consumed = ReadCheckpoint(self.checkpoint)
+        Remaining = []
+        for FileName in FileNames:
+            if Consumed.get(FileName) == os.path.getsize(FileName):
+                self.FileCount += 1
+            else:
+                Remaining.append(FileName)
+        if Consumed and not self.quiet:
+            print "ResultsParser: resuming after %s files in %s" % (self.FileCount, self.checkpoint)
+        return Remaining
+
+    def __sampleFiles__(self, FileNames):
+        """Internal: the results files among FileNames that MaxFilesToParse
+        lets us read, evenly spaced through the list and in its order.  The
+        whole dir is sampled (not what is left after the checkpoint), so a
+        resumed run reads the same files.
+        """
+        FileNames = filter(IsResultsFile, FileNames)
+        # the readers stop once FileCount > maxFiles:
+        Count = self.maxFiles + 1
+        if len(FileNames) <= Count:
+            return FileNames
+        return [FileNames[Index * len(FileNames) / Count] for Index in range(Count)]
+
+    def __fileConsumed__(self, FileName):
+        """Internal: called once all the rows of FileName were taken.  Closes
+        its mirror file and records it in the checkpoint.
+        """
+        if self.mirrorOutHandle:
+            self.mirrorOutHandle.close()
+        if self.checkpoint:
+            Handle = open(self.checkpoint, "a")
+            Handle.write("%s\t%s\n" % (FileName, os.path.getsize(FileName)))
+            Handle.close()
+
+    def __iterFiles__(self):
+        """Internal generator of (file name, open handle) for each results
+        file, honoring MaxFilesToParse.
+        """
+        FileNames = self.__listFiles__()
 
         for FileNameIndex in range(len(FileNames)):
             FileName = FileNames[FileNameIndex]
@@ -180,22 +746,63 @@ class Parser():
 
             self.FileCount += 1
             self.currentFileName = FileName
+            yield (FileName, fileHandle)
+            self.__fileConsumed__(FileName)
 
-            for line in fileHandle:
-                if line[0] == '#':
-                    self.header = line
-                    # maintain the comment lines in the mirrored output
-                    if self.outputMirrorInput:
-                        self.mirrorOutHandle.write( line )
-                    continue
-                row = Row()
-                row.populateFromString(line)
+            # Don't parse every single file, that will take too long!
+            if self.maxFiles != None and self.FileCount > self.maxFiles:
+                return
+
+    def iterFiles(self):
+        """Generator of (file name, iterator over the rows of the file).  A
+        file is only taken as consumed (mirror closed, checkpoint written) 
+        when the next one is asked for, so what is still to be written to 
+        mirrorOutHandle for a file can be written after its rows ran out.
+        The rows of each file must be read before asking for the next.
+        """
+        if self.workers > 1:
+            print "ResultsParser:%s" % self.filePath
+            for (FileName, Batches) in self.__iterWorkerFiles__(COLUMNAR_CHUNK_ROWS):
+                yield (FileName, (row for Batch in Batches for row in RowsFromBatch(Batch)))
+            return
+        print "ResultsParser:%s" % self.filePath
+        for (FileName, fileHandle) in self.__iterFiles__():
+            yield (FileName, self.__iterFileRows__(fileHandle))
+
+    def __iter__(self):
+        if self.workers > 1:
+            for Batch in self.iterBatches():
+                for row in RowsFromBatch(Batch):
+                    yield row
+            return
+        print "ResultsParser:%s" % self.filePath
+        for (FileName, fileHandle) in self.__iterFiles__():
+            for row in self.__iterFileRows__(fileHandle):
                 yield row
 
+    def __iterFileRows__(self, fileHandle):
+        "Internal generator of the rows of one open results file"
+        if isinstance(fileHandle, ColumnarReader):
+            for row in fileHandle:
+                if fileHandle.header != self.header:
+                    self.header = fileHandle.header
+                    if self.outputMirrorInput:
+                        self.mirrorOutHandle.write( self.header )
+                yield row
             fileHandle.close()
-#           Can't close mirrorOutHandle here since it's needed to write the
-#           final record to. Guess we need to call close else where ie __del__
+            return
 
-            # Don't parse every single file, that will take too long!
-            if self.maxFiles != None and self.FileCount > self.maxFiles:
-                raise StopIteration 
+        for line in fileHandle:
+            if line[0] == '#':
+                self.header = line
+                # maintain the comment lines in the mirrored output
+                if self.outputMirrorInput:
+                    self.mirrorOutHandle.write( line )
+                continue
+            row = Row()
+            row.populateFromString(line)
+            yield row
+
+        fileHandle.close()
+#       mirrorOutHandle stays open, it's needed to write the final record to.
+#       It is closed once the next file is asked for.
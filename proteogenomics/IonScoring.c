@@ -39,12 +39,14 @@
 
 // Global variables: Bayesian networks for PRM scoring (for MS-Alignment) and
 // for cut scoring (for tagging and match-scoring)
-PRMBayesianModel* PRMModelCharge2 = NULL;
-PRMBayesianModel* PRMModelCharge3 = NULL;
-PRMBayesianModel* TAGModelCharge2 = NULL;
-PRMBayesianModel* TAGModelCharge3 = NULL;
-PRMBayesianModel* PhosCutModelCharge2 = NULL;
-PRMBayesianModel* PhosCutModelCharge3 = NULL;
+// The nodes of a PRMBayesianModel hold transient values while scoring, so each search
+// thread scores with its own copies of these models (see CopyBayesianModels):
+THREAD_LOCAL PRMBayesianModel* PRMModelCharge2 = NULL;
+THREAD_LOCAL PRMBayesianModel* PRMModelCharge3 = NULL;
+THREAD_LOCAL PRMBayesianModel* TAGModelCharge2 = NULL;
+THREAD_LOCAL PRMBayesianModel* TAGModelCharge3 = NULL;
+THREAD_LOCAL PRMBayesianModel* PhosCutModelCharge2 = NULL;
+THREAD_LOCAL PRMBayesianModel* PhosCutModelCharge3 = NULL;
 
 // Forward declarations:
 int IonScoringGetPrefixContainPhos(PRMBayesianNode* Node, Peptide* Match, int AminoIndex);
@@ -1003,6 +1005,73 @@ void DebugPrintPRMBayesianModel(PRMBayesianModel* Model)
 // These nodes must be visited during tag generation, when the flanking amino acids are finally 
 // learned.  To save time, we build up a singly-linked list (Model->FirstFlank...Model->LastFlank)
 // to keep track of such nodes.
+// Copy a Bayesian network model.  The copy shares no memory with the original.
+PRMBayesianModel* CopyPRMBayesianModel(PRMBayesianModel* Model)
+{
+    PRMBayesianModel* Copy;
+    PRMBayesianNode* Node;
+    PRMBayesianNode* NewNode;
+    int NodeIndex;
+    int ParentIndex;
+    //
+    if (!Model)
+    {
+        return NULL;
+    }
+    Copy = (PRMBayesianModel*)calloc(1, sizeof(PRMBayesianModel));
+    memcpy(Copy, Model, sizeof(PRMBayesianModel));
+    Copy->Head = NULL;
+    Copy->Tail = NULL;
+    Copy->FirstFlank = NULL;
+    Copy->LastFlank = NULL;
+    Copy->Nodes = (PRMBayesianNode**)calloc(max(1, Model->NodeCount), sizeof(PRMBayesianNode*));
+    for (NodeIndex = 0; NodeIndex < Model->NodeCount; NodeIndex++)
+    {
+        Node = Model->Nodes[NodeIndex];
+        NewNode = (PRMBayesianNode*)calloc(1, sizeof(PRMBayesianNode));
+        memcpy(NewNode, Node, sizeof(PRMBayesianNode));
+        NewNode->Next = NULL;
+        NewNode->Parents = NULL;
+        NewNode->ParentBlocks = NULL;
+        if (Node->ParentCount)
+        {
+            NewNode->ParentBlocks = (int*)calloc(Node->ParentCount, sizeof(int));
+            memcpy(NewNode->ParentBlocks, Node->ParentBlocks, sizeof(int) * Node->ParentCount);
+        }
+        NewNode->CountTable = (int*)calloc(Node->TableSize, sizeof(int));
+        memcpy(NewNode->CountTable, Node->CountTable, sizeof(int) * Node->TableSize);
+        NewNode->ProbTable = (float*)calloc(Node->TableSize, sizeof(float));
+        memcpy(NewNode->ProbTable, Node->ProbTable, sizeof(float) * Node->TableSize);
+        Copy->Nodes[NodeIndex] = NewNode;
+        if (Copy->Tail)
+        {
+            Copy->Tail->Next = NewNode;
+        }
+        else
+        {
+            Copy->Head = NewNode;
+        }
+        Copy->Tail = NewNode;
+    }
+    // Point the copied nodes at their copied parents:
+    for (NodeIndex = 0; NodeIndex < Model->NodeCount; NodeIndex++)
+    {
+        Node = Model->Nodes[NodeIndex];
+        if (!Node->ParentCount)
+        {
+            continue;
+        }
+        NewNode = Copy->Nodes[NodeIndex];
+        NewNode->Parents = (PRMBayesianNode**)calloc(Node->ParentCount, sizeof(PRMBayesianNode*));
+        for (ParentIndex = 0; ParentIndex < Node->ParentCount; ParentIndex++)
+        {
+            NewNode->Parents[ParentIndex] = Copy->Nodes[Node->Parents[ParentIndex]->Index];
+        }
+    }
+    BuildModelFlankList(Copy);
+    return Copy;
+}
+
 void BuildModelFlankList(PRMBayesianModel* Model)
 {
     int NodeIndex;
@@ -1415,6 +1484,29 @@ void FreeBayesianModels()
     PhosCutModelCharge3 = NULL;
 }
 
+// Copy this thread's PRM, tag and cut scoring models into Models (an array of 
+// BAYESIAN_MODEL_COUNT entries), for use by another search thread.
+void CopyBayesianModels(PRMBayesianModel** Models)
+{
+    Models[0] = CopyPRMBayesianModel(PRMModelCharge2);
+    Models[1] = CopyPRMBayesianModel(PRMModelCharge3);
+    Models[2] = CopyPRMBayesianModel(TAGModelCharge2);
+    Models[3] = CopyPRMBayesianModel(TAGModelCharge3);
+    Models[4] = CopyPRMBayesianModel(PhosCutModelCharge2);
+    Models[5] = CopyPRMBayesianModel(PhosCutModelCharge3);
+}
+
+// Score with the models from CopyBayesianModels on this thread.
+void SetBayesianModels(PRMBayesianModel** Models)
+{
+    PRMModelCharge2 = Models[0];
+    PRMModelCharge3 = Models[1];
+    TAGModelCharge2 = Models[2];
+    TAGModelCharge3 = Models[3];
+    PhosCutModelCharge2 = Models[4];
+    PhosCutModelCharge3 = Models[5];
+}
+
 // Load PRMBayesianModel objects for scoring PRMs and for scoring tags.
 void InitBayesianModels()
 {
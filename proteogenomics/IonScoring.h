@@ -177,13 +177,19 @@ int CountTrypticTermini(Peptide* Match);
 int ComputeMQScoreFeatures(MSSpectrum* Spectrum, Peptide* Match, float* MQFeatures, int VerboseFlag);
 char* GetFragmentTypeName(int FragmentType);
 void FreeBayesianModels();
+PRMBayesianModel* CopyPRMBayesianModel(PRMBayesianModel* Model);
+void CopyBayesianModels(PRMBayesianModel** Models);
+void SetBayesianModels(PRMBayesianModel** Models);
 
-extern PRMBayesianModel* PRMModelCharge2;
-extern PRMBayesianModel* PRMModelCharge3;
-extern PRMBayesianModel* TAGModelCharge2;
-extern PRMBayesianModel* TAGModelCharge3;
-extern PRMBayesianModel* PhosCutModelCharge2;
-extern PRMBayesianModel* PhosCutModelCharge3;
+// Number of models handled by CopyBayesianModels:
+#define BAYESIAN_MODEL_COUNT 6
+
+extern THREAD_LOCAL PRMBayesianModel* PRMModelCharge2;
+extern THREAD_LOCAL PRMBayesianModel* PRMModelCharge3;
+extern THREAD_LOCAL PRMBayesianModel* TAGModelCharge2;
+extern THREAD_LOCAL PRMBayesianModel* TAGModelCharge3;
+extern THREAD_LOCAL PRMBayesianModel* PhosCutModelCharge2;
+extern THREAD_LOCAL PRMBayesianModel* PhosCutModelCharge3;
 
 #endif // ION_SCORING_H
 
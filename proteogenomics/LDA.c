@@ -140,9 +140,7 @@ LDAModel* LoadLDAModel(char* LDAModelFileName)
     Model = (LDAModel*)calloc(1, sizeof(LDAModel));
     //ReadBinary(&Value, sizeof(float), 1, File);
     ReadBinary(&Model->FeatureCount, sizeof(int), 1, File);
-    assert(Model->FeatureCount >= 1 && Model->FeatureCount < 100);
-    Model->ScaledVector = (double*)calloc(Model->FeatureCount, sizeof(double));
-    Model->TempProductVector = (double*)calloc(Model->FeatureCount, sizeof(double));
+    assert(Model->FeatureCount >= 1 && Model->FeatureCount < MAX_LDA_FEATURES);
     
     // Read min and max values:
     Model->MinValues = (double*)calloc(Model->FeatureCount, sizeof(double));
@@ -186,13 +184,12 @@ void FreeLDAModel(LDAModel* Model)
     SafeFree(Model->MinValues);
     SafeFree(Model->MaxValues);
     SafeFree(Model->CovInv);
-    SafeFree(Model->ScaledVector);
-    SafeFree(Model->TempProductVector);
     SafeFree(Model->MeanVectorTrue);
     SafeFree(Model->MeanVectorFalse);
     SafeFree(Model);
 }
 
+// The scratch vectors live on the stack, so that search threads can share one model.
 float ApplyLDAModel(LDAModel* Model, float* Features)
 {
     int FeatureIndex;
@@ -200,33 +197,35 @@ float ApplyLDAModel(LDAModel* Model, float* Features)
     int ColumnIndex;
     double ProductTrue;
     double ProductFalse;
+    double ScaledVector[MAX_LDA_FEATURES];
+    double TempProductVector[MAX_LDA_FEATURES];
     //
     //printf("\nCFeatures %.4f...%.4f\n", Features[0], Features[Model->FeatureCount - 1]);
     // Scale the features into [-1, 1]:
     for (FeatureIndex = 0; FeatureIndex < Model->FeatureCount; FeatureIndex++)
     {
         HalfRange = (float)((Model->MaxValues[FeatureIndex] - Model->MinValues[FeatureIndex]) / 2.0);
-        Model->ScaledVector[FeatureIndex] = (float)((Features[FeatureIndex] - Model->MinValues[FeatureIndex]) / HalfRange - 1.0);
+        ScaledVector[FeatureIndex] = (float)((Features[FeatureIndex] - Model->MinValues[FeatureIndex]) / HalfRange - 1.0);
     }
-    //printf("Scaled vector %.4f...%.4f\n", Model->ScaledVector[0], Model->ScaledVector[Model->FeatureCount - 1]);
+    //printf("Scaled vector %.4f...%.4f\n", ScaledVector[0], ScaledVector[Model->FeatureCount - 1]);
     // Compute the product of the inverse covariance matrix with our feature vector:
     for (FeatureIndex = 0; FeatureIndex < Model->FeatureCount; FeatureIndex++)
     {
-        Model->TempProductVector[FeatureIndex] = 0;
+        TempProductVector[FeatureIndex] = 0;
         for (ColumnIndex = 0; ColumnIndex < Model->FeatureCount; ColumnIndex++)
         {
-            Model->TempProductVector[FeatureIndex] += (float)(Model->ScaledVector[ColumnIndex] * Model->CovInv[FeatureIndex * Model->FeatureCount + ColumnIndex]);
+            TempProductVector[FeatureIndex] += (float)(ScaledVector[ColumnIndex] * Model->CovInv[FeatureIndex * Model->FeatureCount + ColumnIndex]);
         }
     }
-    //printf("Temp product vector vector %.4f...%.4f\n", Model->TempProductVector[0], Model->TempProductVector[Model->FeatureCount - 1]);
+    //printf("Temp product vector vector %.4f...%.4f\n", TempProductVector[0], TempProductVector[Model->FeatureCount - 1]);
 
     // Compute u0 * C-1 * X and u1 * C-1 * X
     ProductTrue = 0;
     ProductFalse = 0;
     for (FeatureIndex = 0; FeatureIndex < Model->FeatureCount; FeatureIndex++)
     {
-        ProductTrue += (float)(Model->MeanVectorTrue[FeatureIndex] * Model->TempProductVector[FeatureIndex]);
-        ProductFalse += (float)(Model->MeanVectorFalse[FeatureIndex] * Model->TempProductVector[FeatureIndex]);
+        ProductTrue += (float)(Model->MeanVectorTrue[FeatureIndex] * TempProductVector[FeatureIndex]);
+        ProductFalse += (float)(Model->MeanVectorFalse[FeatureIndex] * TempProductVector[FeatureIndex]);
     }
     ProductTrue += Model->ConstantTrue;
     ProductFalse += Model->ConstantFalse;
@@ -30,6 +30,8 @@
 #ifndef LDA_H
 #define LDA_H
 
+#define MAX_LDA_FEATURES 100
+
 typedef struct LDAModel
 {
     int FeatureCount;
@@ -38,8 +40,6 @@ typedef struct LDAModel
     double* CovInv;
     double* MeanVectorTrue;
     double* MeanVectorFalse;
-    double* ScaledVector;
-    double* TempProductVector;
     double ConstantFalse;
     double ConstantTrue;
 } LDAModel;
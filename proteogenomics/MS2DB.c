@@ -605,7 +605,7 @@ void SearchMS2DB(SearchInfo* Info)
     MS2ParseCursor* Cursor;
     int Error;
     //
-    DBFile = Info->DB->DBFile;
+    DBFile = Info->DBFile;
     if (!DBFile)
     {
         printf("** Error: Unable to open database file '%s'\n", Info->DB->FileName);
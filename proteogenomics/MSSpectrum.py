@@ -12,6 +12,11 @@ import math
 import base64 # for mzxml parsing
 import ParseXML
 from Utils import *
+try:
+    import numpy
+except ImportError:
+    numpy = None # peaks are kept as a list of PeakClass only
+
 Initialize()
 
 # Some systems have old versions of base64, without the new decode interface.
@@ -63,9 +68,16 @@ class PeakClass:
         print "Mass %f Intensity %f "%(self.Mass,self.Intensity)
         print "IonType %s PeptideIndex %s IntensityRank %d"%(self.IonType, self.PeptideIndex, self.IntensityRank)
 
-class SpectrumClass:
+class SpectrumClass(object):
     """
     Mass-spec data, and some functions to filter peaks and such.  
+
+    Peaks read from .mzXML and .mzData files (when numpy is available) are
+    held as parallel arrays PeakMasses and PeakIntensities, sorted by mass.
+    The list of PeakClass objects self.Peaks is built from them the first
+    time it is asked for, and from then on the list is used instead.
+    GetPeak, GetBestPeak, RankPeaksByIntensity and FilterPeaks work on the
+    arrays while there are arrays.
     """
     InstanceCount = 0
     def __del__(self):
@@ -78,11 +90,70 @@ class SpectrumClass:
         self.PrecursorMZ = None
         self.PrecursorIntensity = None
         self.Charge = 1 # default
+        self.PeakMasses = None # numpy arrays of peak masses and intensities
+        self.PeakIntensities = None
+        self.PeakIntensityRanks = None # array of IntensityRank, once ranked
+        self.PeakObjects = {} # peak index -> PeakClass handed out from the arrays
         self.Peaks = None # list of PeakClass instances
         self.PRMPeaks = None # list of PeakClass instances
         # The actual parent peptide (instance of PeptideClass), if known:
         self.CorrectPeptide = None
         self.Scoring = Scoring
+    def SetPeakArrays(self, Masses, Intensities):
+        """
+        Set our peaks from numpy arrays of masses and intensities, sorted by
+        mass.  The arrays are replaced, never changed in place, so spectra
+        may share them.
+        """
+        self.PeakList = None
+        self.PeakMasses = Masses
+        self.PeakIntensities = Intensities
+        self.PeakIntensityRanks = None
+        self.PeakObjects = {}
+    def GetPeakObject(self, Index):
+        """
+        The PeakClass for peak number Index of the arrays.  The same object
+        is returned each time, and is the one that ends up in self.Peaks.
+        """
+        Peak = self.PeakObjects.get(Index, None)
+        if Peak is None:
+            Peak = PeakClass(float(self.PeakMasses[Index]), float(self.PeakIntensities[Index]))
+            if self.PeakIntensityRanks is not None:
+                Peak.IntensityRank = int(self.PeakIntensityRanks[Index])
+            self.PeakObjects[Index] = Peak
+        return Peak
+    def GetPeaks(self):
+        if self.PeakMasses is not None:
+            Masses = self.PeakMasses.tolist()
+            Intensities = self.PeakIntensities.tolist()
+            Ranks = None
+            if self.PeakIntensityRanks is not None:
+                Ranks = self.PeakIntensityRanks.tolist()
+            Peaks = []
+            for Index in xrange(len(Masses)):
+                Peak = self.PeakObjects.get(Index, None)
+                if Peak is None:
+                    Peak = PeakClass(Masses[Index], Intensities[Index])
+                    if Ranks:
+                        Peak.IntensityRank = Ranks[Index]
+                Peaks.append(Peak)
+            # Callers may change the list, so it replaces the arrays:
+            self.Peaks = Peaks
+        return self.PeakList
+    def SetPeaks(self, Peaks):
+        self.PeakList = Peaks
+        self.PeakMasses = None
+        self.PeakIntensities = None
+        self.PeakIntensityRanks = None
+        self.PeakObjects = {}
+    Peaks = property(GetPeaks, SetPeaks, doc = "List of PeakClass instances")
+    def GetPeakCount(self):
+        "Number of peaks, without building the peak list"
+        if self.PeakMasses is not None:
+            return len(self.PeakMasses)
+        if self.PeakList is None:
+            return 0
+        return len(self.PeakList)
     def GetSignalToNoise(self):
         "Return signal-to-noise ratio for this spectrum"
         Intensities = []
@@ -211,6 +282,15 @@ class SpectrumClass:
         self.Peaks.append(Peak)
     def RankPeaksByIntensity(self):
         "Set Peak.IntensityRank for each of our peaks."
+        if self.PeakMasses is not None:
+            # Most intense first; ties go to the larger mass, as below.
+            Order = numpy.lexsort((self.PeakMasses, self.PeakIntensities))[::-1]
+            Ranks = numpy.empty(len(Order), numpy.int32)
+            Ranks[Order] = numpy.arange(len(Order))
+            self.PeakIntensityRanks = Ranks
+            for (Index, Peak) in self.PeakObjects.items():
+                Peak.IntensityRank = int(Ranks[Index])
+            return
         PeaksSortedByIntensity = []
         for Peak in self.Peaks:
             PeaksSortedByIntensity.append((Peak.Intensity, Peak))
@@ -324,6 +404,16 @@ class SpectrumClass:
         "Used in labeling.  Find the best nearby peak whose intensity doesn't exceed our limit."
         if MaxIntensity == 0:
             return (None, None)
+        if self.PeakMasses is not None:
+            Errors = self.PeakMasses - Mass
+            Mask = (Errors >= -Epsilon) & (Errors <= Epsilon)
+            if MaxIntensity:
+                Mask &= (self.PeakIntensities <= MaxIntensity)
+            Indices = numpy.flatnonzero(Mask)
+            if not len(Indices):
+                return (None, None)
+            Index = Indices[numpy.argmax(self.PeakIntensities[Indices])]
+            return (self.GetPeakObject(Index), float(Errors[Index]))
         BestPeak = None
         BestPeakError = None
         ClosestError = None
@@ -344,6 +434,16 @@ class SpectrumClass:
         """
         Get the closest peak to the specified mass, with a maximum error of Epsilon.
         """
+        if self.PeakMasses is not None:
+            if not len(self.PeakMasses):
+                return None
+            # Peaks up to and including the first one past Mass:
+            Stop = numpy.searchsorted(self.PeakMasses, Mass, "right") + 1
+            Errors = numpy.abs(self.PeakMasses[:Stop] - Mass)
+            Index = numpy.argmin(Errors)
+            if Errors[Index] < Epsilon:
+                return self.GetPeakObject(Index)
+            return None
         ClosestPeak = None
         ClosestError = None
         for Peak in self.Peaks:
@@ -408,6 +508,8 @@ class SpectrumClass:
         worst rank to keep.  
         """
         #print "Apply window:", WindowSizes, RegionCutoffs, MaxRankInclusive
+        if self.PeakMasses is not None:
+            return self.ApplyWindowFilterArrays(RegionCutoffs, WindowSizes, MaxRankInclusive)
         GoodPeaks = []
         # List of region-edges:
         Borders = []
@@ -443,6 +545,37 @@ class SpectrumClass:
             return BadPeakIntensityList[len(BadPeakIntensityList)/2]
         else:
             return -1
+    def ApplyWindowFilterArrays(self, RegionCutoffs, WindowSizes, MaxRankInclusive):
+        """
+        ApplyWindowFilter on the peak arrays.  A peak is kept if no more than
+        MaxRankInclusive peaks in its window are more intense than it.
+        """
+        Masses = self.PeakMasses
+        Intensities = self.PeakIntensities
+        Borders = [self.ParentMass * Cutoff for Cutoff in RegionCutoffs]
+        HalfSizes = numpy.array([WindowSize/2 for WindowSize in WindowSizes])
+        HalfSizes = HalfSizes[numpy.searchsorted(Borders, Masses, "left")]
+        # Each window holds the peaks in (MinMass, MaxMass]:
+        Starts = numpy.searchsorted(Masses, Masses - HalfSizes, "right")
+        Ends = numpy.searchsorted(Masses, Masses + HalfSizes, "right")
+        Keep = numpy.empty(len(Masses), bool)
+        for Index in xrange(len(Masses)):
+            Window = Intensities[Starts[Index]:Ends[Index]]
+            Keep[Index] = numpy.count_nonzero(Window > Intensities[Index]) <= MaxRankInclusive
+        BadPeakIntensities = numpy.sort(Intensities[~Keep])
+        KeptIndices = numpy.flatnonzero(Keep)
+        PeakObjects = self.PeakObjects
+        Ranks = self.PeakIntensityRanks
+        self.SetPeakArrays(Masses[KeptIndices], Intensities[KeptIndices])
+        if Ranks is not None:
+            self.PeakIntensityRanks = Ranks[KeptIndices]
+        for (NewIndex, Index) in enumerate(KeptIndices.tolist()):
+            if PeakObjects.has_key(Index):
+                self.PeakObjects[NewIndex] = PeakObjects[Index]
+        if len(BadPeakIntensities):
+            return float(BadPeakIntensities[len(BadPeakIntensities)/2])
+        else:
+            return -1
     def FilterPeaks(self, WindowSize = 50, PeakCount = 6):
         self.ApplyWindowFilter([], (WindowSize,), PeakCount - 1)       
     def WritePeaks(self, FilePath):
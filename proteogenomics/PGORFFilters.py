@@ -27,12 +27,21 @@ THis is a set of classes designed to help filter out spurious
 ORFs from the proteogenomics pipeline.  Each new filter should
 be added as a new class, inheriting from 'Filter' and implementing
 a method called 'filterORF' where the magic gets done.
+
+Filters may also implement 'filterColumns', the same filter applied to
+the PeptideColumns of all the ORFs at once.  FilterList uses these when
+every filter in it has one (and numpy is installed); filterORF stays the
+reference they must agree with.
  
 NOTE: this is a utility, and not executable from the command line
 
 """
 #import math #used to calculate logs
 import os
+try:
+    import numpy
+except ImportError:
+    numpy = None # filters are only applied one ORF at a time
 
 class FilterList:
     """Class FilterList: This is a container object for a list
@@ -51,6 +60,7 @@ class FilterList:
         (Path, Ext) = os.path.splitext(OutputPath)
         FilterPath = "%s.filterreport.txt"%Path
         self.Handle = open(FilterPath, "w")
+        self.UseColumns = 1 # filter all ORFs at once, if every filter can
         
     def ApplyAllFilters(self, DictionaryOfORFs):
         """
@@ -64,18 +74,26 @@ class FilterList:
         KillList = [] # a list of ORF.name to kill
         FiltersKillingORFs = {} #filter.name -> [list of orfs killed]
         ORFStrings = {} #orf.name -> orf.__string__
-        for (Name, ORF) in DictionaryOfORFs.items():
+        Items = DictionaryOfORFs.items()
+        KilledBy = None
+        if self.CanFilterColumns():
+            KilledBy = self.FilterColumns([ORF for (Name, ORF) in Items])
+        for (Index, (Name, ORF)) in enumerate(Items):
             #now cycle through all our filters.  We use the ordering
             #of the list, meaning that you should have throught about
             #what order you wanted to filter them in when you created 
             #me as an object
             DeleteMe = 0 #assume innnocence
             CurrFilter = None
-            for aFilter in self.List:
-                CurrFilter = aFilter.name
-                DeleteMe = aFilter.filterORF(ORF)
-                if DeleteMe:
-                    break #quit cycling through all the filters already, we know it sucks
+            if KilledBy:
+                CurrFilter = KilledBy[Index]
+                DeleteMe = CurrFilter != None
+            else:
+                for aFilter in self.List:
+                    CurrFilter = aFilter.name
+                    DeleteMe = aFilter.filterORF(ORF)
+                    if DeleteMe:
+                        break #quit cycling through all the filters already, we know it sucks
             # so here's the deal.  We have created ORFs for two reasons
             #1. It contains peptides
             #2. It contains a predicted protein, which is important to keep track
@@ -114,6 +132,37 @@ class FilterList:
             self.Handle.write("\n")
         return DictionaryOfORFs
 
+    def CanFilterColumns(self):
+        if not self.UseColumns or numpy == None:
+            return 0
+        for aFilter in self.List:
+            if not hasattr(aFilter, "filterColumns"):
+                return 0
+        return 1
+
+    def FilterColumns(self, ORFs):
+        """
+        Parameters: a list of ORF objects
+        Return: a list with the name of the filter that deleted each ORF, or None
+        Description: the batch version of the filterORF loop in ApplyAllFilters.
+        Each filter sees the peptides the filters before it left, and an ORF
+        is left alone once a filter deleted it, just like the loop.  The ORFs
+        are then given their surviving peptides.
+        """
+        Columns = PeptideColumns(ORFs)
+        Killed = numpy.zeros(len(ORFs), bool)
+        KilledBy = [None] * len(ORFs)
+        for aFilter in self.List:
+            (DeleteORFs, KeepPeptides) = aFilter.filterColumns(Columns)
+            if KeepPeptides is not None:
+                Columns.Live &= KeepPeptides | Killed[Columns.ORF]
+            if DeleteORFs is not None:
+                for Index in numpy.flatnonzero(DeleteORFs & ~Killed):
+                    KilledBy[Index] = aFilter.name
+                Killed |= DeleteORFs
+        Columns.UpdateORFs()
+        return KilledBy
+
     def GetListString(self):
         """return the string names of all the filters in this list"""
         String = ""
@@ -123,6 +172,100 @@ class FilterList:
         return String
 
 
+class PeptideColumns:
+    """Class PeptideColumns: the peptides of a list of ORFs as numpy arrays,
+    one entry per peptide, for the filterColumns methods.
+    Variables:
+        self.ORFs, self.Peptides: the objects behind the arrays
+        self.ORF: index into self.ORFs of each peptide
+        self.Start, self.Stop, self.Strand (1 or -1)
+        self.Unique, self.FullyTryptic: bool arrays
+        self.Length, self.LowMWCount: residues in total, and G or A residues
+        self.Live: bool array of the peptides still in their ORF.  Filters
+            only look at live peptides.
+        self.FivePrimeOrder: set by filters that leave the ORF peptides
+            sorted 5' to 3', as ORF.GetFivePrimePeptide does
+    """
+    def __init__(self, ORFs):
+        self.ORFs = ORFs
+        self.Peptides = []
+        ORFIndex = []
+        Start = []
+        Stop = []
+        Strand = []
+        Unique = []
+        Tryptic = []
+        Length = []
+        LowMWCount = []
+        Counts = {} # aminos -> (len, G and A count)
+        for (Index, ORF) in enumerate(ORFs):
+            for Peptide in ORF.peptideIter():
+                self.Peptides.append(Peptide)
+                ORFIndex.append(Index)
+                Start.append(Peptide.GetStart())
+                Stop.append(Peptide.GetStop())
+                Strand.append(Peptide.Strand() == "+" and 1 or -1)
+                Unique.append(bool(Peptide.isUnique))
+                Tryptic.append(Peptide.isFullyTryptic())
+                Aminos = Peptide.aminos
+                if not Counts.has_key(Aminos):
+                    Counts[Aminos] = (len(Aminos), Aminos.count("G") + Aminos.count("A"))
+                (AminosLength, AminosLowMW) = Counts[Aminos]
+                Length.append(AminosLength)
+                LowMWCount.append(AminosLowMW)
+        self.ORF = numpy.array(ORFIndex, dtype = int)
+        self.Start = numpy.array(Start, dtype = int)
+        self.Stop = numpy.array(Stop, dtype = int)
+        self.Strand = numpy.array(Strand, dtype = int)
+        self.Unique = numpy.array(Unique, dtype = bool)
+        self.FullyTryptic = numpy.array(Tryptic, dtype = bool)
+        self.Length = numpy.array(Length, dtype = int)
+        self.LowMWCount = numpy.array(LowMWCount, dtype = int)
+        self.Live = numpy.ones(len(self.Peptides), bool)
+        self.FivePrimeOrder = 0
+
+    def CountPerORF(self, Mask = None):
+        """Parameters: optional bool array over the peptides
+        Return: the number of live (and Mask) peptides in each ORF
+        """
+        Selected = self.Live
+        if Mask is not None:
+            Selected = Selected & Mask
+        return numpy.bincount(self.ORF[Selected], minlength = len(self.ORFs))
+
+    def FivePrimeRows(self):
+        """Return: the live peptides, grouped by ORF and sorted 5' to 3' within
+        it, keeping the ORF order for ties (the sort in GetFivePrimePeptide is stable).
+        """
+        Rows = numpy.flatnonzero(self.Live)
+        Plus = self.Strand[Rows] > 0
+        FirstKey = numpy.where(Plus, self.Start[Rows], -self.Stop[Rows])
+        SecondKey = numpy.where(Plus, self.Stop[Rows], -self.Start[Rows])
+        return Rows[numpy.lexsort((SecondKey, FirstKey, self.ORF[Rows]))]
+
+    def UpdateORFs(self):
+        """Parameters: None
+        Return: None
+        Description: give every ORF its live peptides, in the order that the
+        filterORF methods would have left them in
+        """
+        if self.FivePrimeOrder:
+            Rows = self.FivePrimeRows()
+        else:
+            Rows = numpy.flatnonzero(self.Live)
+        Counts = numpy.bincount(self.ORF[Rows], minlength = len(self.ORFs))
+        Totals = numpy.bincount(self.ORF, minlength = len(self.ORFs))
+        Rows = Rows.tolist()
+        End = 0
+        for (Index, ORF) in enumerate(self.ORFs):
+            Begin = End
+            End += Counts[Index]
+            if Counts[Index] == Totals[Index] and not self.FivePrimeOrder:
+                continue # untouched
+            ORF.DeleteAllPeptides()
+            ORF.addLocatedPeptides([self.Peptides[Row] for Row in Rows[Begin:End]])
+
+
 class Filter:
     """Class Filter: this is a generic filter, meant to be inherited to 
     the actual specific filter classes, e.g. SequenceComplexityFilter
@@ -187,6 +330,14 @@ class UniquenessFilter(Filter):
             return 0 #keep me around
         return 1 # delete me NOW
 
+    def filterColumns(self, Columns):
+        """
+        Parameters: a PeptideColumns object
+        Return: (ORFs to delete, None)
+        Description: delete the ORFs without a live unique peptide
+        """
+        return (Columns.CountPerORF(Columns.Unique) == 0, None)
+
 class TrypticFilter(Filter):
     """Class TrypticFilter: this is an ORF level filter for proteogenomcis,
     and works to get rid of ORFs that do not have any tgryptic peptides
@@ -228,6 +379,14 @@ class TrypticFilter(Filter):
             return 0 #keep me around
         return 1 # delete me NOW
 
+    def filterColumns(self, Columns):
+        """
+        Parameters: a PeptideColumns object
+        Return: (ORFs to delete, None)
+        Description: delete the ORFs without a live fully tryptic peptide
+        """
+        return (Columns.CountPerORF(Columns.FullyTryptic) == 0, None)
+
 class MinPeptideFilter(Filter):
     """Class MinPeptideFilter: this is an ORF level filter for proteogenomcis,
     and works to get rid of ORFs thathave too few peptides.  Although Pavel
@@ -262,6 +421,14 @@ class MinPeptideFilter(Filter):
             return 0 #keep me around
         return 1 # delete me NOW
 
+    def filterColumns(self, Columns):
+        """
+        Parameters: a PeptideColumns object
+        Return: (ORFs to delete, None)
+        Description: delete the ORFs with too few live peptides
+        """
+        return (Columns.CountPerORF() < self.MinimumPeptides, None)
+
 
 class PeptideDistance(Filter):
     """Class PeptideDistance: an ORF level filter that removes peptides
@@ -319,6 +486,77 @@ class PeptideDistance(Filter):
         # We want to keep the ORF, we only delete peptides so return 0
         return 0
 
+    def filterColumns(self, Columns):
+        """
+        Parameters: a PeptideColumns object
+        Return: (None, peptides to keep)
+        Description: Most ORFs have no isolated peptide, which we find from the
+        gaps between neighbouring 5' sorted peptides.  The rest go through
+        DeletePeptideRows, which follows filterORF step by step.
+        """
+        Keep = numpy.ones(len(Columns.Peptides), bool)
+        Columns.FivePrimeOrder = 1
+        Rows = Columns.FivePrimeRows()
+        if not len(Rows):
+            return (None, Keep)
+        ORF = Columns.ORF[Rows]
+        Start = Columns.Start[Rows]
+        Stop = Columns.Stop[Rows]
+        # filterORF passes over peptides at the same location as the one before
+        Distinct = numpy.ones(len(Rows), bool)
+        Distinct[1:] = (ORF[1:] != ORF[:-1]) | (Start[1:] != Start[:-1]) | (Stop[1:] != Stop[:-1])
+        DistinctRows = numpy.flatnonzero(Distinct)
+        DistinctORF = ORF[DistinctRows]
+        SameORF = DistinctORF[1:] == DistinctORF[:-1]
+        Gap = numpy.abs(Start[DistinctRows[1:]] - Stop[DistinctRows[:-1]])
+        # an ORF with a single location, or a gap too wide, loses peptides
+        Check = numpy.zeros(len(Columns.ORFs), bool)
+        Check[DistinctORF[1:][SameORF & (Gap > self.maxDistance)]] = True
+        Check |= numpy.bincount(DistinctORF, minlength = len(Columns.ORFs)) == 1
+        Counts = numpy.bincount(ORF, minlength = len(Columns.ORFs))
+        Ends = numpy.cumsum(Counts)
+        for Index in numpy.flatnonzero(Check):
+            ORFRows = Rows[Ends[Index] - Counts[Index]:Ends[Index]].tolist()
+            for Row in self.DeletePeptideRows(ORFRows, Columns.Start, Columns.Stop):
+                Keep[Row] = False
+        return (None, Keep)
+
+    def DeletePeptideRows(self, Rows, Starts, Stops):
+        """
+        Parameters: the peptide rows of one ORF sorted 5' to 3', their start and stop arrays
+        Return: the rows filterORF deletes
+        Description: filterORF deletes peptides from the list it is iterating
+        over, so the peptide after each deleted one is never looked at.  We
+        keep that, so the two agree.
+        """
+        Location = lambda Row: (Starts[Row], Stops[Row])
+        Remaining = list(Rows)
+        Deleted = []
+        def Delete(Row):
+            # ORF.deletePeptide removes the first peptide at the same location
+            for (Position, Other) in enumerate(Remaining):
+                if Location(Other) == Location(Row):
+                    Deleted.append(Remaining.pop(Position))
+                    return
+        numPeptides = len(Remaining)
+        prevRow = Remaining[0]
+        left2far = True
+        Position = 0
+        while Position < len(Remaining):
+            Row = Remaining[Position]
+            Position += 1
+            if Location(Row) == Location(prevRow):
+                continue
+            right2far = abs(Starts[Row] - Stops[prevRow]) > self.maxDistance
+            if left2far and right2far:
+                Delete(prevRow)
+                numPeptides -= 1
+            prevRow = Row
+            left2far = right2far
+        if numPeptides > 0 and left2far:
+            Delete(prevRow)
+        return Deleted
+
 class SequenceComplexityFilter(Filter):
     """Class SequenceComplexityFilter: this is an ORF level filter for 
     proteogenomics, and works to get rid of ORFs who are represented by
@@ -385,6 +623,15 @@ class SequenceComplexityFilter(Filter):
         else:
             return False
 
+    def filterColumns(self, Columns):
+        """
+        Parameters: a PeptideColumns object
+        Return: (None, peptides to keep)
+        Description: lowComplexFilter for all the peptides at once
+        """
+        NonLowMWCount = Columns.Length - Columns.LowMWCount
+        return (None, (Columns.Length >= 10) | (NonLowMWCount >= Columns.Length // 3))
+
     def filterORF(self, ORF):
         """
         Parameters: an ORF object that is filled with peptides 
@@ -76,6 +76,35 @@ cd %(cwd)s
 $PGP_PYTHON $pvalue_script -r %(pepnovo_dir)s $pvalue_args
 """
 
+pvalue_map_script_tpl = """\
+#!/bin/bash
+source %(env)s
+set -e
+[ -n "$1" ] || exit 1
+[ -n "$2" ] || exit 1
+pvalue_script=$PGP_HOME/PValue.py
+$PGP_PYTHON $pvalue_script -r $1 -M $2
+"""
+
+pvalue_reduce_script_tpl = """\
+#!/bin/bash
+source %(env)s
+set -e
+pvalue_script=$PGP_HOME/PValue.py
+pvalue_args="-p 0.1 -S 0.5 -1 -H"
+$PGP_PYTHON $pvalue_script -A %(scores_dir)s -s %(pvalue_dist)s $pvalue_args
+"""
+
+pvalue_apply_script_tpl = """\
+#!/bin/bash
+source %(env)s
+set -e
+[ -n "$1" ] || exit 1
+pvalue_script=$PGP_HOME/PValue.py
+pvalue_args="-w %(pvalue_dir)s -p 0.1 -S 0.5 -1 -H"
+$PGP_PYTHON $pvalue_script -l %(pvalue_dist)s -r $1 $pvalue_args
+"""
+
 msgf_script_tpl = """\
 #!/bin/bash
 source %(env)s
@@ -100,6 +129,20 @@ $PGP_PYTHON $postproc_script \
 touch %(postproc_flag_ok)s
 """
 
+postproc_all_script_tpl = """\
+#!/bin/bash
+source %(env)s
+set -e
+rm -f %(postproc_flag_ok)s
+postproc_script=$PGP_HOME/ProteogenomicsPostProcessing.py
+$PGP_PYTHON $postproc_script \
+-r %(msgf_dir)s \
+-L %(genome_list)s \
+-n %(processes)s \
+-p 1e-10
+touch %(postproc_flag_ok)s
+"""
+
 class pgp_makeflow(object):
     """Generator of Makeflow input for the PGP pipeline."""
 
@@ -220,6 +263,9 @@ class pgp_makeflow(object):
         pepnovo_dir = config.get(ini_section,"pepnovo_dir")
         pvalue_dir = config.get(ini_section,"pvalue_dir")
         makedir(pvalue_dir)
+        if config.has_option(ini_section,"pvalue_map_reduce") and \
+                config.getboolean(ini_section,"pvalue_map_reduce"):
+            return self.gen_pvalue_map_reduce(tasks_inspect=tasks_inspect)
         script = pvalue_script_tpl % dict(
                 env=task_env,
                 cwd=pvalue_dir,
@@ -241,6 +287,66 @@ class pgp_makeflow(object):
                 )
         return tasks
 
+    def gen_pvalue_map_reduce(self,tasks_inspect):
+        """PValue in three steps: a map task per PepNovo output that writes
+        its scores, one reduce task that fits the p-value distribution to all
+        the scores, and an apply task per PepNovo output that rescores it.
+        The map tasks can run as soon as their search is done."""
+        config = self.config
+        mf_out = self.mf_out
+        task_env = config.get(ini_section,"task_env")
+        pvalue_dir = config.get(ini_section,"pvalue_dir")
+        scores_dir = pjoin(pvalue_dir,"scores")
+        makedir(scores_dir)
+        pvalue_dist = pjoin(pvalue_dir,"PValues.txt")
+        script_file_map = config.get(ini_section,"pvalue_map_wrapper")
+        strToFile(pvalue_map_script_tpl % dict(env=task_env),
+                script_file_map)
+        script_file_reduce = config.get(ini_section,"pvalue_reduce_wrapper")
+        strToFile(pvalue_reduce_script_tpl % dict(
+                env=task_env,
+                scores_dir=os.path.abspath(scores_dir),
+                pvalue_dist=os.path.abspath(pvalue_dist)
+                ),
+                script_file_reduce)
+        script_file_apply = config.get(ini_section,"pvalue_apply_wrapper")
+        strToFile(pvalue_apply_script_tpl % dict(
+                env=task_env,
+                pvalue_dir=os.path.abspath(pvalue_dir),
+                pvalue_dist=os.path.abspath(pvalue_dist)
+                ),
+                script_file_apply)
+        tasks = []
+        scores_all = []
+        for task_inspect in tasks_inspect:
+            scores = pjoin(scores_dir,task_inspect["inspect_task_id"]+".pvs")
+            cmd = "bash %s %s %s" % (script_file_map,
+                    task_inspect["pepnovo_res"],
+                    scores)
+            mf_out.write(makeflow_rule_tpl %\
+                    dict(targets=scores,
+                        inputs=task_inspect["pepnovo_res"],
+                        cmd=cmd)
+                    )
+            scores_all.append(scores)
+        mf_out.write(makeflow_rule_tpl %\
+                dict(targets=pvalue_dist,
+                    inputs=" ".join(scores_all),
+                    cmd="bash %s" % (script_file_reduce,))
+                )
+        for task_inspect in tasks_inspect:
+            task = dict(pvalue_task_id=task_inspect["inspect_task_id"],
+                pvalue_res=pjoin(pvalue_dir,task_inspect["inspect_task_id"]+".res"))
+            cmd = "bash %s %s" % (script_file_apply,
+                    task_inspect["pepnovo_res"])
+            mf_out.write(makeflow_rule_tpl %\
+                    dict(targets=task["pvalue_res"],
+                        inputs="%s %s" % (task_inspect["pepnovo_res"],pvalue_dist),
+                        cmd=cmd)
+                    )
+            tasks.append(task)
+        return tasks
+
     def gen_msgf(self,tasks_pvalue):
         config = self.config
         mf_out = self.mf_out
@@ -298,6 +404,12 @@ class pgp_makeflow(object):
         -p 1e-10
         """
         msgf_res_all = " ".join([ task["msgf_res"] for task in tasks_msgf ])
+        postproc_processes = 0
+        if config.has_option(ini_section,"postproc_processes"):
+            postproc_processes = config.getint(ini_section,"postproc_processes")
+        if postproc_processes > 0:
+            return self.gen_postproc_all(msgf_res_all=msgf_res_all,
+                    processes=postproc_processes)
         tasks = []
         gbk_files = glob.glob(gbk_glob)
         for gbk in gbk_files:
@@ -337,6 +449,48 @@ class pgp_makeflow(object):
                 )
         return [dict(postproc_res=postproc_flag_ok_root)]
 
+    def gen_postproc_all(self,msgf_res_all,processes):
+        """Single post-processing rule for all genomes, which parses the
+        MSGF results once and runs the genomes in a pool of processes"""
+        config = self.config
+        mf_out = self.mf_out
+        task_env = config.get(ini_section,"task_env")
+        msgf_dir = config.get(ini_section,"msgf_dir")
+        postproc_flag_ok_root = config.get(ini_section,"postproc_flag_ok")
+        db_genomic_dir = config.get(ini_section,"db_genomic_dir")
+        gbk_ext = config.get(ini_section,"gbk_ext")
+        gbk_glob = pjoin(db_genomic_dir,"*"+gbk_ext)
+        postproc_results_dir = config.get(ini_section,"postproc_results_dir")
+        gff_dir = config.get(ini_section,"gff_dir")
+        genome_list = config.get(ini_section,"postproc_wrapper")+".genomes"
+        genomes = []
+        for gbk in glob.glob(gbk_glob):
+            acc = os.path.basename(gbk).rsplit(gbk_ext,1)[0].strip()
+            genomes.append("\t".join((gbk,
+                pjoin(db_genomic_dir,
+                    acc+config.get(ini_section,"_6frame_trie_ext")),
+                pjoin(gff_dir,
+                    acc+config.get(ini_section,"peptides_gff_ext")),
+                pjoin(postproc_results_dir,
+                    acc+config.get(ini_section,"other_out_ext")))))
+        strToFile("".join([ g+"\n" for g in genomes ]),genome_list)
+        script = postproc_all_script_tpl % dict(
+                env=task_env,
+                msgf_dir=msgf_dir,
+                genome_list=genome_list,
+                processes=processes,
+                postproc_flag_ok=postproc_flag_ok_root
+                )
+        script_file = config.get(ini_section,"postproc_wrapper")
+        strToFile(script,script_file)
+        cmd = "bash %s" % (script_file,)
+        mf_out.write(makeflow_rule_tpl %\
+                dict(targets=postproc_flag_ok_root,
+                    inputs=msgf_res_all,
+                    cmd=cmd)
+                )
+        return [dict(postproc_res=postproc_flag_ok_root)]
+
 def getProgOptions():
     from optparse import OptionParser, make_option
     option_list = [
@@ -22,9 +22,19 @@
 
 
 
+import os
+import array
+import mmap
+import struct
+import tempfile
 from Bio import SeqIO
+from Bio.Seq import Seq
 import GFFIO
 import bioseq
+try:
+    import numpy
+except ImportError:
+    numpy = None # PeptideStore.GetColumn hands out the array.array columns themselves
 
 
 ###############################################################################
@@ -226,6 +236,10 @@ class GenomicLocation(object):
 ###############################################################################
 
 class LocatedPeptide(object):
+    # there can be millions of these, so no per object __dict__
+    __slots__ = ("location", "name", "aminos", "bestScore", "spectrumCount", "isUnique",
+                 "TrypticNTerm", "TrypticCTerm", "ORFName", "MSMSSource")
+
     def __init__(self, Aminos, location):
         self.location = location
         self.name = None
@@ -341,6 +355,278 @@ class LocatedPeptide(object):
         return self.MSMSSource
         
 
+###############################################################################
+
+NaN = float("nan") # bestScore of None in a PeptideStore
+
+class PeptideStore(object):
+    """Columnar storage for the located peptides of a genome.  A mapping run
+    makes one LocatedPeptide per genomic location, and with millions of them
+    the per-object attribute dicts, the GenomicLocation behind each one and
+    the copied MSMS source lists take most of the memory.  Here every peptide
+    is a row across a set of compact array.array columns, and the strings
+    (aminos, ORF names, chromosomes) live once in a string table.  AddPeptide
+    returns a StoredPeptide, a two slot view with the LocatedPeptide API, so
+    ORFs, filters and writers don't know the difference.
+    Rows are never removed; deleting a peptide from an ORF just drops the view.
+    """
+    UNIQUE = 1
+    TRYPTIC_N_TERM = 2
+    TRYPTIC_C_TERM = 4
+
+    def __init__(self):
+        self.Start = array.array("l")
+        self.Stop = array.array("l")
+        self.Strand = array.array("b") # 1 for +, -1 for -
+        self.Frame = array.array("b") # 0 while unset
+        self.Chromosome = array.array("l") # index into self.Strings, -1 for None
+        self.ORF = array.array("l") # index into self.Strings, -1 for None
+        self.Aminos = array.array("l") # index into self.Strings
+        self.BestScore = array.array("d") # NaN for None
+        self.SpectrumCount = array.array("l")
+        self.Flags = array.array("B") # UNIQUE | TRYPTIC_N_TERM | TRYPTIC_C_TERM
+        self.Names = [] # peptide names are unique, so no point in the string table
+        self.Sources = [] # the MSMS source list of each row, shared and not copied
+        self.OwnSources = array.array("B") # 1 if the row's source list is its own, not shared
+        self.Strings = []
+        self.StringIDs = {}
+
+    def __len__(self):
+        return len(self.Start)
+
+    def GetStringID(self, String):
+        if String == None:
+            return -1
+        ID = self.StringIDs.get(String)
+        if ID == None:
+            ID = len(self.Strings)
+            self.StringIDs[String] = ID
+            self.Strings.append(String)
+        return ID
+
+    def GetString(self, ID):
+        if ID < 0:
+            return None
+        return self.Strings[ID]
+
+    def AddPeptide(self, Aminos, location):
+        """Parameters: amino acid string, GenomicLocation of the peptide
+        Return: a StoredPeptide viewing the new row
+        Description: the counterpart of LocatedPeptide(Aminos, location)
+        """
+        Row = len(self.Start)
+        self.Start.append(0)
+        self.Stop.append(0)
+        self.Strand.append(1)
+        self.Frame.append(0)
+        self.Chromosome.append(-1)
+        self.ORF.append(-1)
+        self.Aminos.append(self.GetStringID(Aminos))
+        self.BestScore.append(NaN)
+        self.SpectrumCount.append(0)
+        self.Flags.append(0)
+        self.Names.append(None)
+        self.Sources.append(None)
+        self.OwnSources.append(0)
+        Peptide = StoredPeptide(self, Row)
+        Peptide.location = location
+        return Peptide
+
+    def GetColumn(self, Name):
+        """Parameters: the name of a column, e.g. "Start" or "Flags"
+        Return: a numpy array with a copy of the column, for whole genome
+        arithmetic.  Without numpy, the array.array itself.
+        """
+        Column = getattr(self, Name)
+        if numpy == None:
+            return Column
+        return numpy.frombuffer(Column, dtype = numpy.dtype(Column.typecode)).copy()
+
+    def GetFlag(self, Row, Flag):
+        if self.Flags[Row] & Flag:
+            return 1
+        return None
+
+    def SetFlag(self, Row, Flag, Value):
+        if Value:
+            self.Flags[Row] |= Flag
+        else:
+            self.Flags[Row] &= ~Flag
+
+def StoredFlagProperty(Flag):
+    return property(lambda self: self.store.GetFlag(self.row, Flag),
+                    lambda self, Value: self.store.SetFlag(self.row, Flag, Value))
+
+def StoredStringProperty(Column):
+    return property(lambda self: self.store.GetString(getattr(self.store, Column)[self.row]),
+                    lambda self, Value: getattr(self.store, Column).__setitem__(self.row, self.store.GetStringID(Value)))
+
+def StoredColumnProperty(Column):
+    return property(lambda self: getattr(self.store, Column)[self.row],
+                    lambda self, Value: getattr(self.store, Column).__setitem__(self.row, Value))
+
+
+class StoredLocation(GenomicLocation):
+    """A GenomicLocation whose values are one row of a PeptideStore, so that
+    changing it (AddOneAminoAcidFivePrime, setting frame or chromosome)
+    changes the row.  GenomicLocation keeps its values in private attributes,
+    which are the column properties here.
+    """
+    __slots__ = ("store", "row")
+
+    def __init__(self, Store, Row):
+        self.store = Store
+        self.row = Row
+
+    _GenomicLocation__start = StoredColumnProperty("Start")
+    _GenomicLocation__stop = StoredColumnProperty("Stop")
+    chromosome = StoredStringProperty("Chromosome")
+
+    @property
+    def _GenomicLocation__strand(self):
+        return self.store.Strand[self.row] > 0 and "+" or "-"
+
+    @property
+    def _GenomicLocation__frame(self):
+        return self.store.Frame[self.row] or None
+
+    @_GenomicLocation__frame.setter
+    def _GenomicLocation__frame(self, Frame):
+        self.store.Frame[self.row] = Frame or 0
+
+
+class StoredPeptide(LocatedPeptide):
+    """A LocatedPeptide whose values are one row of a PeptideStore.  Its
+    location is a StoredLocation view of the same row.
+    """
+    __slots__ = ("store", "row")
+
+    def __init__(self, Store, Row):
+        self.store = Store
+        self.row = Row
+
+    aminos = StoredStringProperty("Aminos")
+    ORFName = StoredStringProperty("ORF")
+    isUnique = StoredFlagProperty(PeptideStore.UNIQUE)
+    TrypticNTerm = StoredFlagProperty(PeptideStore.TRYPTIC_N_TERM)
+    TrypticCTerm = StoredFlagProperty(PeptideStore.TRYPTIC_C_TERM)
+
+    @property
+    def location(self):
+        return StoredLocation(self.store, self.row)
+
+    @location.setter
+    def location(self, Location):
+        Store = self.store
+        Row = self.row
+        Store.Start[Row] = Location.start
+        Store.Stop[Row] = Location.stop
+        Store.Strand[Row] = Location.strand == "+" and 1 or -1
+        Store.Frame[Row] = Location.frame or 0
+        Store.Chromosome[Row] = Store.GetStringID(Location.chromosome)
+
+    @property
+    def name(self):
+        return self.store.Names[self.row]
+
+    @name.setter
+    def name(self, Name):
+        self.store.Names[self.row] = Name
+
+    @property
+    def bestScore(self):
+        Score = self.store.BestScore[self.row]
+        if Score != Score: # NaN
+            return None
+        return Score
+
+    @bestScore.setter
+    def bestScore(self, Score):
+        if Score == None:
+            Score = NaN
+        self.store.BestScore[self.row] = Score
+
+    @property
+    def spectrumCount(self):
+        return self.store.SpectrumCount[self.row]
+
+    @spectrumCount.setter
+    def spectrumCount(self, Count):
+        self.store.SpectrumCount[self.row] = Count
+
+    @property
+    def MSMSSource(self):
+        """The row's own list of sources, so it can be changed in place.  A
+        list shared with other rows is copied first."""
+        Store = self.store
+        Row = self.row
+        if not Store.OwnSources[Row]:
+            Store.Sources[Row] = list(Store.Sources[Row] or [])
+            Store.OwnSources[Row] = 1
+        return Store.Sources[Row]
+
+    @MSMSSource.setter
+    def MSMSSource(self, Sources):
+        self.store.Sources[self.row] = Sources
+        self.store.OwnSources[self.row] = 1
+
+    def GetMSMSSource(self):
+        "The sources without copying a shared list; don't change it in place"
+        Sources = self.store.Sources[self.row]
+        if Sources == None:
+            return self.MSMSSource
+        return Sources
+
+    @property
+    def chromosome(self):
+        return self.store.GetString(self.store.Chromosome[self.row])
+
+    def GetStart(self):
+        return self.store.Start[self.row]
+
+    def GetStop(self):
+        return self.store.Stop[self.row]
+
+    def Strand(self):
+        return self.store.Strand[self.row] > 0 and "+" or "-"
+
+    def GetFivePrimeNucleotide(self):
+        if self.store.Strand[self.row] < 0:
+            return self.store.Stop[self.row]
+        return self.store.Start[self.row]
+
+    def GetThreePrimeNucleotide(self):
+        if self.store.Strand[self.row] < 0:
+            return self.store.Start[self.row]
+        return self.store.Stop[self.row]
+
+    def __cmp__(self, other):
+        Value = cmp(self.GetStart(), other.GetStart())
+        if Value == 0:
+            return cmp(self.GetStop(), other.GetStop())
+        return Value
+
+    def AppendMSMSSource(self, Array):
+        """Parameters: an array of tuples [(filename, spectrum), ...]
+        Return: None
+        Description: The first array is kept as is, so all the locations of
+        an amino acid string share one list.  Later ones make a list of the
+        row's own rather than extend the shared one.
+        """
+        Store = self.store
+        Row = self.row
+        Sources = Store.Sources[Row]
+        if Sources == None:
+            Sources = Array
+        elif Store.OwnSources[Row]:
+            Sources.extend(Array)
+        else:
+            Sources = list(Sources) + list(Array)
+            Store.OwnSources[Row] = 1
+        Store.Sources[Row] = Sources
+        Store.SpectrumCount[Row] = len(Sources)
+
+
 ###############################################################################
 
 class LocatedProtein(object):
@@ -408,7 +694,7 @@ class OpenReadingFrame(object):
         self.GCWholeORF = None
         self.GCPredictedProtein = None
         self.GCObservedRegion = None
-        self.CDS = None # biopython SeqFeature for the CDS record from a genbank file
+        self.CDS = None # biopython SeqFeature (or IndexedFeature) for the CDS record from a genbank file
         #set is AddLocatedProtein, this is the offset before the protein starts.  It is
         #set such that if you do a slice aaseq[offset:] you will get the protein sequence
         ##with the exception of the wrong translation for alt start codons.  have to fix that later
@@ -755,14 +1041,18 @@ class GFFPeptide(GFFIO.File):
 
     ### Inherits the constructor of the GFFIO.File ###
 
-    def generateORFs(self, sequenceFile, genome):
+    def generateORFs(self, sequenceFile, genome, region=None):
         '''Parameters: A sequence file supported by SequenceIO, a Genome() object
         to populate with OpenReadingFrame objects and their LocatedPeptides,
-        and optionally a class for parsing the sequence accession.
+        and optionally a region ("seqid" or "seqid:start-end") to read the
+        peptides of, rather than the whole GFF.
         Description: Reads the peptides from the GFF, and the ORFs from the sequence file
         '''
+        gffRecords = self
+        if region:
+            gffRecords = self.query( region )
         # Read in the peptides from the GFF file, creating ORFs as needed
-        for gffRec in self:
+        for gffRec in gffRecords:
             protein = gffRec.attributes['Parent']
             chrom = genome.chromosomes[ gffRec.seqid ]
             orf = chrom.getOrf( protein )
@@ -783,20 +1073,20 @@ class GFFPeptide(GFFIO.File):
         genome.addSeqToPepOnlyOrfs( sequenceFile )
 
     def writeORFPeptides(self, orf):
-        gffRec = GFFIO.Record() #create empty record.  add values below then write each one
-        gffRec.source = 'Proteomics'
-        gffRec.type = 'polypeptide'
-        gffRec.seqid = orf.chromosome
-        gffRec.attributes['Parent'] = orf.name
-
-        for peptide in orf.peptideIter():
-            gffRec.start = peptide.GetStart()
-            gffRec.end   = peptide.GetStop()
-            gffRec.score = peptide.bestScore
-            gffRec.strand= peptide.Strand()
-            gffRec.attributes['Name'] = peptide.aminos
-            gffRec.attributes['ID'] = peptide.name
-            self.write( gffRec )
+        "Writes a polypeptide line per peptide of the ORF, all in one writeColumns"
+        peptides = list( orf.peptideIter() )
+        if not peptides:
+            return
+        attributes = {}
+        attributes['Parent'] = orf.name
+        attributes['Name'] = [peptide.aminos for peptide in peptides]
+        attributes['ID'] = [peptide.name for peptide in peptides]
+        self.writeColumns( orf.chromosome, 'Proteomics', 'polypeptide',
+                           [peptide.GetStart() for peptide in peptides],
+                           [peptide.GetStop() for peptide in peptides],
+                           [peptide.bestScore for peptide in peptides],
+                           [peptide.Strand() for peptide in peptides],
+                           '.', attributes )
 
 
 ###############################################################################
@@ -858,6 +1148,8 @@ class Genome(object):
     def __init__(self,taxon=None):
         self.taxon = taxon
         self.chromosomes = {}
+        self.peptides = PeptideStore() # columns behind the mapped peptides of all chromosomes
+        self.annotationIndex = None # GenomeAnnotationIndex the genome was loaded from, if any
 
     def addOrf(self, orf, orfType):
         self.chromosomes[ orf.chromosome ].addOrf( orf, orfType )
@@ -908,6 +1200,19 @@ class Genome(object):
             chrom.complexOrfs = filteredOrfDict
 
     def addSeqToPepOnlyOrfs( self, sequenceFile, definitionParser=ORFFastaHeader):
+        if self.annotationIndex and definitionParser == ORFFastaHeader and \
+               self.annotationIndex.isIndexOf( sequenceFile ):
+            # Look up just the pepOnly ORFs, rather than reading every sequence
+            for chrom in self.chromosomes.values():
+                for orf in chrom.pepOnlyOrfs.values():
+                    found = self.annotationIndex.getOrfSequence( orf.name )
+                    if found:
+                        (header, aaseq) = found
+                        orf.aaseq = aaseq
+                        orf.location = GenomicLocation.FromHeader( definitionParser( header ),
+                                                                  len(aaseq),
+                                                                  addStop=True)
+            return
         seqReader = bioseq.SequenceIO( sequenceFile )
         # Read in only the needed ORFs from the sequence file
         for seq in seqReader:
@@ -936,12 +1241,23 @@ class GenbankGenomeReader(bioseq.FlatFileIO):
     The BioPython SeqFeature object is store in the ORF object as the CDS
     member. The BioPython Seq object is stored in the Chromosome object
     as the seq member variable. 
+    If useIndex is set, the genome is loaded from a GenomeAnnotationIndex
+    next to the genbank file (made on the first run), and the CDS members
+    are IndexedFeature objects instead.
     """
+    useIndex = 1
+
     def __init__(self, gbFile, sixFrameFile):
         bioseq.FlatFileIO.__init__(self,gbFile)
         self.orfReader = bioseq.SequenceIO(sixFrameFile)
+        self.gbFile = gbFile
+        self.sixFrameFile = sixFrameFile
 
     def makeGenomeWithProteinORFs(self):
+        if self.useIndex:
+            index = GetGenomeIndex( self.gbFile, self.sixFrameFile )
+            if index:
+                return self.makeGenomeFromIndex( index )
         genome = Genome()
         # First read in all the CDS features from the genbank file
         # we store these based on their 3' coordinate so we can 
@@ -954,12 +1270,7 @@ class GenbankGenomeReader(bioseq.FlatFileIO):
             # Store the cds SeqFeatures in the chromsome indexed by 3' end
             for feat in gb_rec.features:
                 if feat.type == 'CDS':
-                    if feat.strand == 1:
-                        chrom.endToCDS[ feat.location.end.position ] = feat
-                    else:
-                        # biopython 1.53 seems to use 0, or space based coords
-                        # so start is 1 less then what's in the genbank file
-                        chrom.endToCDS[ feat.location.start.position + 1 ] = feat
+                    chrom.endToCDS[ CDSThreePrime( feat ) ] = feat
 
         # Now read in the ORFs from the 6Frame file and match their
         # ends with the ends of the annotated proteins
@@ -976,43 +1287,80 @@ class GenbankGenomeReader(bioseq.FlatFileIO):
 
             if chrom.endToCDS.has_key( orfThreePrime ):
                 cds = chrom.endToCDS.pop( orfThreePrime )
-                tmpOrf.CDS = cds # Keep the SeqFeature object for future reference
-                orfStart = tmpOrf.location.start
-                orfStop  = tmpOrf.location.stop
                 # +1 is back to 1 based
-                prot5Prime = cds.location.start.position + 1
-                if cds.strand == -1:
-                    prot5Prime = cds.location.end.position
-
-                # separate simple ORFs from complex ORFs for now
-                # not sure if we'll need to further separate complex ORFs
-                if prot5Prime >= orfStart and prot5Prime <= orfStop:
-                    # Create a LocatedProtein object for this protein
-                    locProt = LocatedProtein( GenomicLocation(
-                        cds.location.start.position + 1,
-                        cds.location.end.position,
-                        cds.strand == 1 and '+' or '-',
-                        tmpOrf.chromosome
-                    ))
-                    # BioPython SeqFeature.qualifiers always seem to be lists
-                    # so take the 1st element. Should probably check list size
-                    locProt.name = cds.qualifiers['product'][0]
-                    locProt.ORFName = tmpOrf.name
-                    # and add it to the ORF
-                    tmpOrf.addLocatedProtein( locProt )
-                    chrom.addOrf( tmpOrf, 'Simple' )
-
-                elif len(cds.sub_features) > 0:
-                    # More then 1 sub_feature, meaning some sort of splicing
-                    chrom.addOrf( tmpOrf, 'Complex' )
-                    print "Complex ORF for protein %s" % cds.qualifiers['protein_id'][0]
-                else:
-                    chrom.addOrf( tmpOrf, 'Other' )
-                    print "Other ORF for protein %s" % cds.qualifiers['protein_id'][0]
+                self.addOrfForCDS( chrom, tmpOrf, cds,
+                                   cds.location.start.position + 1,
+                                   cds.location.end.position,
+                                   cds.strand,
+                                   len(getattr(cds, 'sub_features', [])) )
             else:
                 # ORF without a 3' mapping to a protein
                 unusedOrfs += 1
 
+        self.printGenomeSummary( genome, unusedOrfs )
+        return genome
+
+    def makeGenomeFromIndex(self, index):
+        """Parameters: a GenomeAnnotationIndex
+        Return: Genome object
+        Description: same genome as makeGenomeWithProteinORFs, but only the
+        ORFs that end at a CDS are read from the six frame file
+        """
+        genome = Genome()
+        genome.annotationIndex = index
+        for (accession, sequence) in index.chromosomes:
+            genome.makeChromosome( accession, Seq(sequence) )
+        for (row, feature) in index.orfCDS:
+            (header, aaseq) = index.getSequence( row )
+            tmpOrf = OpenReadingFrame( header, aaseq )
+            chrom = genome.chromosomes[ tmpOrf.chromosome ]
+            self.addOrfForCDS( chrom, tmpOrf, feature, feature.start, feature.end,
+                               feature.strand, feature.numSubFeatures )
+        for feature in index.unmatchedCDS:
+            genome.chromosomes[ feature.chromosome ].endToCDS[ feature.threePrime ] = feature
+        self.printGenomeSummary( genome, index.numOrfs - len(index.orfCDS) )
+        return genome
+
+    def addOrfForCDS(self, chrom, tmpOrf, cds, cdsStart, cdsEnd, cdsStrand, numSubFeatures):
+        """Parameters: Chromosome, the ORF ending at a CDS, the CDS feature,
+        its 1 based start and end, strand (1 or -1) and number of sub features
+        Return: None
+        Description: adds the ORF to the chromosome as Simple, Complex or Other
+        """
+        tmpOrf.CDS = cds # Keep the SeqFeature object for future reference
+        orfStart = tmpOrf.location.start
+        orfStop  = tmpOrf.location.stop
+        prot5Prime = cdsStart
+        if cdsStrand == -1:
+            prot5Prime = cdsEnd
+
+        # separate simple ORFs from complex ORFs for now
+        # not sure if we'll need to further separate complex ORFs
+        if prot5Prime >= orfStart and prot5Prime <= orfStop:
+            # Create a LocatedProtein object for this protein
+            locProt = LocatedProtein( GenomicLocation(
+                cdsStart,
+                cdsEnd,
+                cdsStrand == 1 and '+' or '-',
+                tmpOrf.chromosome
+            ))
+            # BioPython SeqFeature.qualifiers always seem to be lists
+            # so take the 1st element. Should probably check list size
+            locProt.name = cds.qualifiers['product'][0]
+            locProt.ORFName = tmpOrf.name
+            # and add it to the ORF
+            tmpOrf.addLocatedProtein( locProt )
+            chrom.addOrf( tmpOrf, 'Simple' )
+
+        elif numSubFeatures > 0:
+            # More then 1 sub_feature, meaning some sort of splicing
+            chrom.addOrf( tmpOrf, 'Complex' )
+            print "Complex ORF for protein %s" % cds.qualifiers['protein_id'][0]
+        else:
+            chrom.addOrf( tmpOrf, 'Other' )
+            print "Other ORF for protein %s" % cds.qualifiers['protein_id'][0]
+
+    def printGenomeSummary(self, genome, unusedOrfs):
         # Some QC checks and info
         print "Read %d chromosomes with %d Simple, %d Complex, %d Other ORFs" % (
             genome.numChromosomes(),
@@ -1025,4 +1373,300 @@ class GenbankGenomeReader(bioseq.FlatFileIO):
                 print "Warning, unmapped protein %s on chrom %s" % (
                         cds.qualifiers['locus_tag'][0], acc )
 
-        return genome
+
+###############################################################################
+
+def CDSThreePrime(feat):
+    "The 1 based 3' end of a biopython CDS SeqFeature"
+    if feat.strand == 1:
+        return feat.location.end.position
+    # biopython 1.53 seems to use 0, or space based coords
+    # so start is 1 less then what's in the genbank file
+    return feat.location.start.position + 1
+
+GENOME_INDEX_EXTENSION = ".pgpidx"
+GENOME_INDEX_MAGIC = "PGPGIX02"
+# magic, the stamps of the indexed files, then the payload length and ORF count
+GENOME_INDEX_HEADER = struct.Struct("<8sqqqqqi")
+# The only CDS qualifiers the pipeline reads, and so the only ones indexed
+GENOME_INDEX_QUALIFIERS = ('protein_id', 'product', 'locus_tag', 'translation')
+
+class IndexedFeature(object):
+    """The parts of a genbank CDS SeqFeature kept in a GenomeAnnotationIndex.
+    qualifiers holds lists, as in biopython, for GENOME_INDEX_QUALIFIERS."""
+    def __init__(self, chromosome, threePrime, start, end, strand, numSubFeatures, qualifiers):
+        self.chromosome = chromosome
+        self.threePrime = threePrime
+        self.start = start # 1 based
+        self.end = end
+        self.strand = strand
+        self.numSubFeatures = numSubFeatures
+        self.qualifiers = qualifiers
+
+def GenomeIndexPath(gbFile):
+    return gbFile + GENOME_INDEX_EXTENSION
+
+def GenomeIndexSixFramePath(sixFrameFile):
+    """The six frame file path an index can point into: a single plain
+    .trie or fasta file.  None for anything else."""
+    if isinstance(sixFrameFile, list):
+        if len(sixFrameFile) != 1:
+            return None
+        sixFrameFile = sixFrameFile[0]
+    if not isinstance(sixFrameFile, str):
+        return None
+    extension = os.path.splitext(sixFrameFile)[1].lower()
+    if extension in ['.trie', '.fa', '.fasta', '.fsa', '.fna', '.faa']:
+        return sixFrameFile
+    return None
+
+def GenomeIndexStamp(gbFile, sixFrameFile):
+    "Sizes and time stamps of the indexed files, so that a stale index is not used"
+    gbStat = os.stat(gbFile)
+    orfStat = os.stat(sixFrameFile)
+    return struct.pack("<qqqq", gbStat.st_size, int(gbStat.st_mtime),
+                       orfStat.st_size, int(orfStat.st_mtime))
+
+def ReadSixFrameRecords(sixFrameFile):
+    """Parameters: a .trie or fasta six frame file
+    Return: list of (header, byte offset, byte length, residue count) of its sequences
+    Description: the bytes of a fasta sequence include its line breaks
+    """
+    records = []
+    if os.path.splitext(sixFrameFile)[1].lower() == '.trie':
+        (names, positions) = bioseq.TrieReader(sixFrameFile).readIndex()
+        handle = open(sixFrameFile, "rb")
+        handle.seek(0, 2)
+        trieEnd = handle.tell()
+        if trieEnd > 0:
+            handle.seek(-1, 2)
+            if handle.read(1) == '*':
+                trieEnd -= 1
+        handle.close()
+        for i in xrange(len(names)):
+            if i + 1 < len(positions):
+                end = positions[i+1] - 1 # the * between sequences
+            else:
+                end = trieEnd
+            records.append( (names[i], positions[i], end - positions[i], end - positions[i]) )
+        return records
+    handle = open(sixFrameFile, "rb")
+    offset = 0
+    record = None
+    for line in handle:
+        if line[0] == '>':
+            if record:
+                records.append(tuple(record))
+            record = [line[1:].split(None, 1)[0], offset + len(line), 0, 0]
+        elif record:
+            record[2] += len(line)
+            record[3] += len(line.rstrip())
+        offset += len(line)
+    if record:
+        records.append(tuple(record))
+    handle.close()
+    return records
+
+def PackString(string):
+    return struct.pack("<i", len(string)) + string
+
+def BuildGenomeIndex(gbFile, sixFrameFile):
+    """Parameters: genbank file, and a .trie or fasta six frame file
+    Return: None
+    Description: writes the GenomeAnnotationIndex of the pair next to the
+    genbank file.  The CDS features are matched to the ORFs here, the same
+    way makeGenomeWithProteinORFs does it, so loading just reads the result.
+    """
+    stamp = GenomeIndexStamp(gbFile, sixFrameFile)
+    chromosomes = []
+    chromIndex = {}
+    features = [] # (chromosome index, 3' end, start, end, strand, sub features, qualifiers)
+    endToCDS = {} # (chromosome, 3' end) -> index into features
+    handle = open(gbFile, "rb")
+    for gb_rec in SeqIO.parse(handle, 'genbank'):
+        chromIndex[gb_rec.name] = len(chromosomes)
+        chromosomes.append( (gb_rec.name, str(gb_rec.seq)) )
+        for feat in gb_rec.features:
+            if feat.type == 'CDS':
+                threePrime = CDSThreePrime(feat)
+                qualifiers = [(key, feat.qualifiers[key][0]) for key in GENOME_INDEX_QUALIFIERS
+                              if feat.qualifiers.has_key(key)]
+                endToCDS[ (gb_rec.name, threePrime) ] = len(features)
+                features.append( (chromIndex[gb_rec.name], threePrime,
+                                  feat.location.start.position + 1, feat.location.end.position,
+                                  feat.strand or 0, len(getattr(feat, 'sub_features', [])), qualifiers) )
+    handle.close()
+
+    records = ReadSixFrameRecords(sixFrameFile)
+    orfNames = []
+    orfCDS = []
+    for (header, offset, byteLength, residues) in records:
+        parsedHeader = ORFFastaHeader(header)
+        orfNames.append(parsedHeader.ORFName)
+        cds = -1
+        if not chromIndex.has_key(parsedHeader.Chromosome):
+            raise KeyError(parsedHeader.Chromosome) # as makeGenomeWithProteinORFs would
+        if not parsedHeader.ORFName.startswith('XXX'):
+            location = GenomicLocation.FromHeader(parsedHeader, residues, addStop=True)
+            cds = endToCDS.pop( (parsedHeader.Chromosome, location.GetThreePrime()), -1 )
+        orfCDS.append(cds)
+
+    parts = [struct.pack("<i", len(chromosomes))]
+    for (accession, sequence) in chromosomes:
+        parts.append(PackString(accession))
+        parts.append(PackString(sequence))
+    parts.append(struct.pack("<i", len(features)))
+    for (chromosome, threePrime, start, end, strand, numSubFeatures, qualifiers) in features:
+        parts.append(struct.pack("<iqqqii", chromosome, threePrime, start, end, strand, numSubFeatures))
+        parts.append(struct.pack("<i", len(qualifiers)))
+        for (key, value) in qualifiers:
+            parts.append(PackString(key))
+            parts.append(PackString(value))
+    parts.append(struct.pack("<i", len(records)))
+    parts.append(PackString("\n".join([record[0] for record in records])))
+    parts.append(PackString("\n".join(orfNames)))
+    parts.append(struct.pack("<%dq"%len(records), *[record[1] for record in records]))
+    parts.append(struct.pack("<%dq"%len(records), *[record[2] for record in records]))
+    parts.append(struct.pack("<%di"%len(records), *orfCDS))
+    payload = "".join(parts)
+
+    # Runs on the same genome (e.g. cluster jobs) each write a temp file
+    # of their own, and the last rename wins
+    indexPath = GenomeIndexPath(gbFile)
+    (fd, tmpPath) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(indexPath)))
+    out = os.fdopen(fd, "wb")
+    out.write(GENOME_INDEX_HEADER.pack(GENOME_INDEX_MAGIC, *(struct.unpack("<qqqq", stamp) +
+                                       (len(payload), len(records)))))
+    out.write(payload)
+    out.close()
+    os.chmod(tmpPath, 0644)
+    os.rename(tmpPath, indexPath)
+
+class GenomeAnnotationIndex(object):
+    """A pickle free binary index of a genbank file and its six frame
+    translation, stored next to the genbank file as Foo.gbk.pgpidx:
+    the chromosome sequences, the CDS features (GENOME_INDEX_QUALIFIERS only),
+    and for every six frame ORF its header, ORF name, where its residues are
+    in the six frame file, and the CDS its 3' end matched.
+    The index is read through one mmap.  ORF sequences are read (through a
+    mmap of the six frame file) only when asked for.
+    """
+    def __init__(self, indexPath, sixFrameFile):
+        """Raises ValueError if the index file is truncated or corrupt"""
+        self.sixFrameFile = sixFrameFile
+        self.sixFrameMap = None
+        self.orfRows = None # ORF name -> row, made on first use
+        handle = open(indexPath, "rb")
+        try:
+            if os.fstat(handle.fileno()).st_size < GENOME_INDEX_HEADER.size:
+                raise ValueError("Truncated genome index %s" % indexPath)
+            data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.parse(data)
+            except (struct.error, IndexError):
+                raise ValueError("Corrupt genome index %s" % indexPath)
+            finally:
+                data.close()
+        finally:
+            handle.close()
+
+    def parse(self, data):
+        header = GENOME_INDEX_HEADER.unpack_from(data, 0)
+        (payloadLength, numOrfs) = header[-2:]
+        if len(data) != GENOME_INDEX_HEADER.size + payloadLength:
+            raise ValueError("Genome index payload is %d bytes, not %d" % (
+                len(data) - GENOME_INDEX_HEADER.size, payloadLength))
+        self.pos = GENOME_INDEX_HEADER.size
+        self.chromosomes = []
+        for i in xrange(self.unpack(data, "<i")[0]):
+            self.chromosomes.append( (self.unpackString(data), self.unpackString(data)) )
+        features = []
+        for i in xrange(self.unpack(data, "<i")[0]):
+            (chromosome, threePrime, start, end, strand, numSubFeatures) = self.unpack(data, "<iqqqii")
+            qualifiers = {}
+            for j in xrange(self.unpack(data, "<i")[0]):
+                key = self.unpackString(data)
+                qualifiers[key] = [self.unpackString(data)]
+            features.append( IndexedFeature(self.chromosomes[chromosome][0], threePrime,
+                                            start, end, strand, numSubFeatures, qualifiers) )
+        self.numOrfs = self.unpack(data, "<i")[0]
+        if self.numOrfs != numOrfs:
+            raise ValueError("Genome index has %d ORFs, not %d" % (self.numOrfs, numOrfs))
+        self.headers = self.unpackString(data).split("\n")
+        self.orfNames = self.unpackString(data).split("\n")
+        self.offsets = self.unpack(data, "<%dq"%self.numOrfs)
+        self.byteLengths = self.unpack(data, "<%dq"%self.numOrfs)
+        orfCDS = self.unpack(data, "<%di"%self.numOrfs)
+        if self.pos != len(data) or len(self.headers) != numOrfs or len(self.orfNames) != numOrfs:
+            raise ValueError("Genome index records don't fill its payload")
+        del self.pos
+        # the CDS of each matched ORF, in six frame file order, and the CDS no ORF matched
+        self.orfCDS = [(row, features[cds]) for (row, cds) in enumerate(orfCDS) if cds >= 0]
+        matched = set([cds for cds in orfCDS if cds >= 0])
+        self.unmatchedCDS = [feature for (cds, feature) in enumerate(features) if not cds in matched]
+
+    def unpack(self, data, format):
+        values = struct.unpack_from(format, data, self.pos)
+        self.pos += struct.calcsize(format)
+        return values
+
+    def unpackString(self, data):
+        length = self.unpack(data, "<i")[0]
+        self.pos += length
+        return data[self.pos - length:self.pos]
+
+    def isIndexOf(self, sixFrameFile):
+        return GenomeIndexSixFramePath(sixFrameFile) == self.sixFrameFile
+
+    def getSequence(self, row):
+        "(header, residues) of an ORF by its row in the six frame file"
+        if self.sixFrameMap == None:
+            handle = open(self.sixFrameFile, "rb")
+            self.sixFrameMap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            handle.close()
+        offset = self.offsets[row]
+        residues = self.sixFrameMap[offset:offset + self.byteLengths[row]]
+        return (self.headers[row], residues.replace("\n", "").replace("\r", ""))
+
+    def getOrfSequence(self, orfName):
+        "(header, residues) of the ORF with this ORFFastaHeader.ORFName, or None"
+        if self.orfRows == None:
+            # the last one wins for repeated names, as in addSeqToPepOnlyOrfs
+            self.orfRows = dict(zip(self.orfNames, xrange(self.numOrfs)))
+        row = self.orfRows.get(orfName)
+        if row == None:
+            return None
+        return self.getSequence(row)
+
+def LoadGenomeIndex(gbFile, sixFrameFile):
+    "The saved index of the pair, or None if there is none, or it is stale or corrupt."
+    indexPath = GenomeIndexPath(gbFile)
+    if not os.path.exists(indexPath):
+        return None
+    handle = open(indexPath, "rb")
+    header = handle.read(len(GENOME_INDEX_MAGIC) + struct.calcsize("<qqqq"))
+    handle.close()
+    if header != GENOME_INDEX_MAGIC + GenomeIndexStamp(gbFile, sixFrameFile):
+        return None
+    try:
+        return GenomeAnnotationIndex(indexPath, sixFrameFile)
+    except ValueError, error:
+        print "Not using genome index: %s" % error
+        return None
+
+def GetGenomeIndex(gbFile, sixFrameFile):
+    """The index of a genbank file and its six frame file: the saved one if it
+    is current, else a new one.  None if the files can't be indexed (e.g. a
+    compressed six frame file) or the index can't be written.
+    """
+    sixFrameFile = GenomeIndexSixFramePath(sixFrameFile)
+    if not isinstance(gbFile, str) or not sixFrameFile:
+        return None
+    index = LoadGenomeIndex(gbFile, sixFrameFile)
+    if index == None:
+        try:
+            BuildGenomeIndex(gbFile, sixFrameFile)
+        except (IOError, OSError):
+            return None
+        index = LoadGenomeIndex(gbFile, sixFrameFile)
+    return index
@@ -44,6 +44,9 @@ import os
 import sys
 import math
 import getopt
+import array
+import struct
+import itertools
 import traceback
 import InspectResults
 import SelectProteins
@@ -102,6 +105,10 @@ MIN_MQSCORE = -10.0
 MAX_RESULTS_FILES_TO_PARSE = 2000
 
 BIN_MULTIPLIER = 10.0
+
+# Score files written by -M, merged by -A
+SCORE_CACHE_EXTENSION = ".pvs"
+SCORE_CACHE_MAGIC = "PGPPVS01"
 SQRT2PI = math.sqrt(2 * math.pi)
 
 Cof = [76.18009172947146, -86.50532032941677,
@@ -123,6 +130,48 @@ def Gamma(Z):
 class Bag:
     pass
 
+class ScoreCache:
+    """The scores of the top match of each spectrum, kept in compact arrays
+    by the delta-score pass so that the score histogram can be built
+    without parsing the results again.
+    """
+    def __init__(self):
+        self.Charge3 = array.array("B")
+        self.MQScore = array.array("d")
+        self.DeltaScore = array.array("d")
+        self.Shuffled = array.array("B")
+        self.Hits = array.array("i")
+    def append(self, Charge, MQScore, DeltaScore, Protein, Hit):
+        self.Charge3.append(Charge >= 3)
+        self.MQScore.append(MQScore)
+        self.DeltaScore.append(DeltaScore)
+        self.Shuffled.append(Protein[:3] == "XXX")
+        self.Hits.append(Hit)
+    def __len__(self):
+        return len(self.Charge3)
+    def __iter__(self):
+        "(charge3 flag, MQScore, DeltaScore, shuffled flag, hits) per spectrum"
+        return itertools.izip(self.Charge3, self.MQScore, self.DeltaScore,
+                              self.Shuffled, self.Hits)
+    def Columns(self):
+        return (self.Charge3, self.MQScore, self.DeltaScore, self.Shuffled, self.Hits)
+    def Save(self, FileName):
+        "Write the scores to FileName (in the machine's byte order)"
+        File = open(FileName, "wb")
+        File.write(struct.pack("<8sQ", SCORE_CACHE_MAGIC, len(self)))
+        for Column in self.Columns():
+            Column.tofile(File)
+        File.close()
+    def Load(self, FileName):
+        "Add the scores from a file written by Save"
+        File = open(FileName, "rb")
+        (Magic, Count) = struct.unpack("<8sQ", File.read(struct.calcsize("<8sQ")))
+        if Magic != SCORE_CACHE_MAGIC:
+            raise ValueError("%s is not a PValue score file" % FileName)
+        for Column in self.Columns():
+            Column.fromfile(File, Count)
+        File.close()
+
 class PValueParser():
     def __init__(self):
         self.RetainBadMatches = 0
@@ -151,6 +200,15 @@ class PValueParser():
         # Overwrite existing files in -w target:
         self.OverwriteNewScoresFlag = 1
         self.ClusterInfoPath = None
+        # Resume -w from this checkpoint file:
+        self.CheckpointPath = None
+        # Keep the scores from the delta-score pass for the score histogram,
+        # instead of parsing the results a second time:
+        self.CacheScoresFlag = 1
+        self.ScoreCache = None
+        # -M and -A, for fitting the distribution in map and reduce steps:
+        self.WriteScoreCachePath = None
+        self.ReadScoreCachePath = None
 
     def ReadDeltaScoreDistribution(self, FilePath):
         """
@@ -162,7 +220,42 @@ class PValueParser():
         self.AllSpectrumCount3 = 0
         self.MeanDeltaScore2 = 0
         self.MeanDeltaScore3 = 0
+        if self.CacheScoresFlag:
+            self.ScoreCache = ScoreCache()
         self.ReadDeltaScoreDistributionFromFile(FilePath)
+        self.FinishMeanDeltaScores()
+
+    def ReadScoreCaches(self, FilePath):
+        """
+        Read the scores written by -M from a score file, or every score file
+        in a directory, and compute the average delta-scores from them.
+        """
+        self.AllSpectrumCount2 = 0
+        self.AllSpectrumCount3 = 0
+        self.MeanDeltaScore2 = 0
+        self.MeanDeltaScore3 = 0
+        self.ScoreCache = ScoreCache()
+        if os.path.isdir(FilePath):
+            FileNames = [os.path.join(FilePath, FileName) for FileName in sorted(os.listdir(FilePath))
+                         if FileName.endswith(SCORE_CACHE_EXTENSION)]
+        else:
+            FileNames = [FilePath]
+        for FileName in FileNames:
+            self.ScoreCache.Load(FileName)
+        print "Read scores of %s spectra from %s files"%(len(self.ScoreCache), len(FileNames))
+        for (Charge3, MQScore, DeltaScore, Shuffled, Hit) in self.ScoreCache:
+            if DeltaScore < 0:
+                continue
+            if Charge3:
+                self.AllSpectrumCount3 += 1
+                self.MeanDeltaScore3 += DeltaScore
+            else:
+                self.AllSpectrumCount2 += 1
+                self.MeanDeltaScore2 += DeltaScore
+        self.FinishMeanDeltaScores()
+
+    def FinishMeanDeltaScores(self):
+        "Turn the delta-score sums into means"
         self.MeanDeltaScore2 /= max(1, self.AllSpectrumCount2)
         self.MeanDeltaScore3 /= max(1, self.AllSpectrumCount3)
         if self.VerboseFlag:
@@ -198,6 +291,9 @@ class PValueParser():
             Length = len(Peptide.Aminos)
             if Length < self.MinimumPeptideLength:
                 continue
+            if self.ScoreCache != None:
+                self.ScoreCache.append(Charge, MQScore, DeltaScore, row.ProteinName,
+                                       self.GetClusterHits(row))
             if DeltaScore < 0:
                 print "## Warning: DeltaScore < 0!", Spectrum, FilePath
                 print row
@@ -213,7 +309,12 @@ class PValueParser():
     def ReadScoreDistributionFromFile(self, FilePath):
         """
         Read F-scores from a single file, to compute the score histogram.
+        If the delta-score pass cached the scores, they are used instead.
         """
+        if self.ScoreCache != None:
+            print "Compute score distribution for %s spectra..."%len(self.ScoreCache)
+            self.ReadScoreDistributionFromCache()
+            return
         print "Read score distribution from %s..."%FilePath
         try:
             resultsParser = InspectResults.Parser(FilePath, MaxFilesToParse=MAX_RESULTS_FILES_TO_PARSE)
@@ -243,26 +344,45 @@ class PValueParser():
                 MeanDeltaScore = self.MeanDeltaScore3
             WeightedScore = self.MQScoreWeight * MQScore + self.DeltaScoreWeight * (DeltaScore / MeanDeltaScore)
             ScoreBin = int(round(WeightedScore * BIN_MULTIPLIER))
-            Hit = 1
-            if self.ClusterInfoPath:
-                # Get this cluster's size:
-                ClusterFileName = row.SpectrumFile.replace("/","\\").split("\\")[-1]
-                ScanNumber = row.ScanNumber
-                ClusterSize = self.ClusterSizes.get((ClusterFileName, ScanNumber), None)
-                if not ClusterSize:
-                    print "* Warning: ClusterSize not known for %s, %s"%(ClusterFileName, ScanNumber)
+            Hit = self.GetClusterHits(row)
+            self.AddToScoreHistogram(Charge >= 3, ScoreBin, Protein[:3] == "XXX", Hit)
+
+    def ReadScoreDistributionFromCache(self):
+        "Compute the score histogram from the scores in self.ScoreCache."
+        for (Charge3, MQScore, DeltaScore, Shuffled, Hit) in self.ScoreCache:
+            if Charge3:
+                MeanDeltaScore = self.MeanDeltaScore3
+            else:
+                MeanDeltaScore = self.MeanDeltaScore2
+            WeightedScore = self.MQScoreWeight * MQScore + self.DeltaScoreWeight * (DeltaScore / MeanDeltaScore)
+            ScoreBin = int(round(WeightedScore * BIN_MULTIPLIER))
+            self.AddToScoreHistogram(Charge3, ScoreBin, Shuffled, Hit)
+
+    def AddToScoreHistogram(self, Charge3, ScoreBin, Shuffled, Hit):
+        if not Charge3:
+            self.ScoreHistogram2[ScoreBin] = self.ScoreHistogram2.get(ScoreBin, 0) + Hit
+        else:
+            self.ScoreHistogram3[ScoreBin] = self.ScoreHistogram3.get(ScoreBin, 0) + Hit
+        if self.ShuffledDatabaseFraction:
+            if Shuffled:
+                if not Charge3:
+                    self.ShuffledScoreHistogram2[ScoreBin] = self.ShuffledScoreHistogram2.get(ScoreBin, 0) + Hit
                 else:
-                    Hit = ClusterSize
-            if Charge < 3:
-                self.ScoreHistogram2[ScoreBin] = self.ScoreHistogram2.get(ScoreBin, 0) + Hit
+                    self.ShuffledScoreHistogram3[ScoreBin] = self.ShuffledScoreHistogram3.get(ScoreBin, 0) + Hit
+
+    def GetClusterHits(self, row):
+        "How many spectra the match counts for; the cluster size for -X"
+        Hit = 1
+        if self.ClusterInfoPath:
+            # Get this cluster's size:
+            ClusterFileName = row.SpectrumFile.replace("/","\\").split("\\")[-1]
+            ScanNumber = row.ScanNumber
+            ClusterSize = self.ClusterSizes.get((ClusterFileName, ScanNumber), None)
+            if not ClusterSize:
+                print "* Warning: ClusterSize not known for %s, %s"%(ClusterFileName, ScanNumber)
             else:
-                self.ScoreHistogram3[ScoreBin] = self.ScoreHistogram3.get(ScoreBin, 0) + Hit
-            if self.ShuffledDatabaseFraction:
-                if Protein[:3] == "XXX":
-                    if Charge < 3:
-                        self.ShuffledScoreHistogram2[ScoreBin] = self.ShuffledScoreHistogram2.get(ScoreBin, 0) + Hit
-                    else:
-                        self.ShuffledScoreHistogram3[ScoreBin] = self.ShuffledScoreHistogram3.get(ScoreBin, 0) + Hit
+                Hit = ClusterSize
+        return Hit
 
     def ProduceScoreDistributionImage(self, ImagePath, Charge3Flag = 0):
         """
@@ -546,7 +666,8 @@ class PValueParser():
             return
         MinBin = min(Keys)
         MaxBin = max(Keys)
-        self.OutputDistributionFile.write("#MeanDeltaScore\t%s\n"%MeanDeltaScore)
+        self.OutputDistributionFile.write("#Charge3Flag\t%s\n"%Charge3Flag)
+        self.OutputDistributionFile.write("#MeanDeltaScore\t%r\n"%MeanDeltaScore)
         self.OutputDistributionFile.write("#BlindFlag\t%s\n"%self.BlindFlag)
         if self.ShuffledDatabaseFraction != None:
             Header = "#Bin\tFDR\tTotalHits\tHitsValid\tHitsInvalid\tPeptideFDR\tPeptidesValid\tPeptidesInvalid\tProteinFDR\tProteinsValid\tProteinsInvalid\t\n"
@@ -606,7 +727,7 @@ class PValueParser():
         for Bin in range(MinBin, MaxBin + 1):
             FDR = 1.0 - OddsTrue[Bin]
             AllHits = ScoreHistogram.get(Bin, 0)
-            self.OutputDistributionFile.write("%s\t%s\t%s\t"%(Bin, FDR, AllHits))
+            self.OutputDistributionFile.write("%s\t%r\t%s\t"%(Bin, FDR, AllHits))
             if self.ShuffledDatabaseFraction != None:
                 FalseHits = ShuffledScoreHistogram.get(Bin, 0)
                 TrueHits = AllHits - FalseHits
@@ -628,12 +749,21 @@ class PValueParser():
                     CumulativeFalseProteins -= InvalidProteins.get(Bin, 0)
             self.OutputDistributionFile.write("\n")
     def LoadPValueDistribution(self, FileName, Charge3Flag = 0):
+        """
+        Load the distribution for one charge class from a file written by
+        SavePValueDistribution.  The file holds the charge 1..2 section, then
+        the charge 3 one; each starts with a #Charge3Flag line (or, in older
+        files, the #MeanDeltaScore line).
+        """
         OddsTrue = {}
         if Charge3Flag:
             self.OddsTrue3 = OddsTrue
         else:
             self.OddsTrue2 = OddsTrue
         File = open(FileName, "rb")
+        Section = None # the charge class of the lines being read
+        SectionFlagged = 0
+        SectionsSeen = 0
         for FileLine in File.xreadlines():
             Bits = list(FileLine.strip().split("\t"))
             if len(Bits) < 2:
@@ -641,6 +771,17 @@ class PValueParser():
             if FileLine[0] == "#":
                 # Header line.  Parse special lines:
                 Name = Bits[0][1:]
+                if Name == "Charge3Flag":
+                    Section = int(Bits[1])
+                    SectionFlagged = 1
+                    continue
+                if Name == "MeanDeltaScore":
+                    if not SectionFlagged:
+                        Section = SectionsSeen
+                    SectionFlagged = 0
+                    SectionsSeen += 1
+                if Section != Charge3Flag:
+                    continue
                 if Name == "BlindFlag":
                     self.BlindFlag = int(Bits[1])
                 elif Name == "MeanDeltaScore":
@@ -651,8 +792,10 @@ class PValueParser():
                 else:
                     print "(Skipping comment '%s', not understood)"%Bits[0]
                 continue
+            if Section != Charge3Flag:
+                continue
             Bin = int(Bits[0])
-            OddsTrue[Bin] = float(Bits[1])
+            OddsTrue[Bin] = 1.0 - float(Bits[1]) # the file has the FDR
         File.close()
         if self.BlindFlag:
             self.MQScoreWeight = Defaults.BlindMQScoreWeight
@@ -734,36 +877,39 @@ class PValueParser():
     def WriteFixedScoresFile(self, Path):
         try:
             inspectParser = InspectResults.Parser(Path,
-                    inputMirrorTo=self.WriteScoresPath)
+                    inputMirrorTo=self.WriteScoresPath,
+                    Checkpoint=self.CheckpointPath)
 
             LineCount = 0
             self.LinesAcceptedCount = 0
-            OldSpectrum = None
-            MatchesForSpectrum = []
-            for row in inspectParser:
-                Match = Bag()
-                try:
-                    Match.Bits = row
-                    Match.Charge = row.Charge
-                    Match.MQScore = row.MQScore
-                    Match.DeltaScore = row.DeltaScore
-                    Match.Peptide = GetPeptideFromModdedName(row.Annotation[2:-2])
-                    Match.ProteinName = row.ProteinName
-                except:
-                    continue
-                LineCount += 1
-                Spectrum = (row.SpectrumFile, row.ScanNumber)
-                if Spectrum != OldSpectrum:
-                    self.WriteMatchesForSpectrum( MatchesForSpectrum,
-                            inspectParser.mirrorOutHandle
-                            )
-                    MatchesForSpectrum = []
-                OldSpectrum = Spectrum
-                MatchesForSpectrum.append(Match)
-            # Finish the last spectrum:
-            self.WriteMatchesForSpectrum( MatchesForSpectrum,
-                            inspectParser.mirrorOutHandle
-                            )
+            for (FileName, Rows) in inspectParser.iterFiles():
+                OldSpectrum = None
+                MatchesForSpectrum = []
+                for row in Rows:
+                    Match = Bag()
+                    try:
+                        Match.Bits = row
+                        Match.Charge = row.Charge
+                        Match.MQScore = row.MQScore
+                        Match.DeltaScore = row.DeltaScore
+                        Match.Peptide = GetPeptideFromModdedName(row.Annotation[2:-2])
+                        Match.ProteinName = row.ProteinName
+                    except:
+                        continue
+                    LineCount += 1
+                    Spectrum = (row.SpectrumFile, row.ScanNumber)
+                    if Spectrum != OldSpectrum:
+                        self.WriteMatchesForSpectrum( MatchesForSpectrum,
+                                inspectParser.mirrorOutHandle
+                                )
+                        MatchesForSpectrum = []
+                    OldSpectrum = Spectrum
+                    MatchesForSpectrum.append(Match)
+                # Finish the last spectrum of the file, before the parser
+                # closes its output and checkpoints it:
+                self.WriteMatchesForSpectrum( MatchesForSpectrum,
+                                inspectParser.mirrorOutHandle
+                                )
             print "%s\t%s\t%s\t"%(Path, LineCount, self.LinesAcceptedCount)
             self.TotalLinesAcceptedCount += self.LinesAcceptedCount
             self.TotalLinesSecondPass += LineCount
@@ -871,7 +1017,7 @@ class PValueParser():
                 print "* Skipping this line:", FileLine
             self.ClusterSizes[(Bits[0], ScanNumber)] = ClusterSize
     def ParseCommandLine(self, Arguments):
-        (Options, Args) = getopt.getopt(Arguments, "l:s:r:w:m:bp:vixzd:a1S:HX:")
+        (Options, Args) = getopt.getopt(Arguments, "l:s:r:w:m:bp:vixzd:a1S:HX:C:RM:A:")
         OptionsSeen = {}
         self.SaveDistributionPath = "PValues.txt" # default
         self.ReadScoresPath = None
@@ -898,6 +1044,14 @@ class PValueParser():
                 self.ReadScoresPath  = Value
             elif Option == "-w":
                 self.WriteScoresPath = Value
+            elif Option == "-C":
+                self.CheckpointPath = Value
+            elif Option == "-R":
+                self.CacheScoresFlag = 0
+            elif Option == "-M":
+                self.WriteScoreCachePath = Value
+            elif Option == "-A":
+                self.ReadScoreCachePath = Value
             elif Option == "-m":
                 global MAX_RESULTS_FILES_TO_PARSE
                 MAX_RESULTS_FILES_TO_PARSE = int(Value)
@@ -945,9 +1099,19 @@ Parameters:
     model to these results).  If the option value is a directory, we'll read
     all the results-files from the directory.
  -w [FILENAME] Write re-scored results to a file.
+ -C [FILENAME] Checkpoint file for -w.  The results files written out are
+    recorded in it, and a rerun with the same checkpoint skips them, so an
+    interrupted run picks up at the file where it stopped.
  -l [FILENAME] Load p-value distribution from a file (written out earlier
     with -s option)
 
+The distribution can be fit in steps, to spread the work over many jobs:
+ -M [FILENAME] Map: read the results (-r) and write their scores to FILENAME
+    (a .pvs file), then stop.
+ -A [FILENAME] Reduce: fit the distribution to the scores in a .pvs file,
+    or in all the .pvs files of a directory, in place of -r.  Save it with
+    -s, then apply it to each results file with -l, -r and -w.
+
 Protein selection can be performed, replacing the protein identification
 with a parsimonious set of protein IDs (using a simple iterative
 approach).  The following options are required for protein selection:
@@ -968,6 +1132,8 @@ Other options:
  -x If the -x flag is passed, even "bad" matches are written out (no p-value
     filtering is performed)
  -1 Write only the top hit for each spectrum, even if "good" runners-up exist
+ -R Re-read the results to build the score histogram, rather than keeping
+    the scores of the first pass in memory (about 22 bytes per spectrum)
 
 Internal use only:
  -v Verbose output (for debugging)
@@ -989,12 +1155,25 @@ def Main(Parser = None):
     if Parser.DBPath and Parser.PerformProteinSelection:
         Parser.ProteinPicker = SelectProteins.ProteinSelector()
         Parser.ProteinPicker.LoadMultipleDB(Parser.DBPath)
+    if Parser.WriteScoreCachePath:
+        if not Parser.ReadScoresPath:
+            print "** -M needs results to read (-r)"
+            sys.exit(1)
+        print "Write scores from %s to %s..."%(Parser.ReadScoresPath, Parser.WriteScoreCachePath)
+        Parser.CacheScoresFlag = 1
+        Parser.ReadDeltaScoreDistribution(Parser.ReadScoresPath)
+        Parser.ScoreCache.Save(Parser.WriteScoreCachePath)
+        return
     if Parser.LoadDistributionPath:
         print "Load p-value distribution from %s..."%Parser.LoadDistributionPath
-        Parser.LoadPValueDistribution(Parser.LoadDistributionPath)
-    elif Parser.ReadScoresPath:
-        print "Read scores from search results at %s..."%Parser.ReadScoresPath
-        Parser.ReadDeltaScoreDistribution(Parser.ReadScoresPath)
+        Parser.LoadPValueDistribution(Parser.LoadDistributionPath, 0)
+        Parser.LoadPValueDistribution(Parser.LoadDistributionPath, 1)
+    elif Parser.ReadScoresPath or Parser.ReadScoreCachePath:
+        if Parser.ReadScoreCachePath:
+            Parser.ReadScoreCaches(Parser.ReadScoreCachePath)
+        else:
+            print "Read scores from search results at %s..."%Parser.ReadScoresPath
+            Parser.ReadDeltaScoreDistribution(Parser.ReadScoresPath)
         Parser.SetOutputDistributionPath(Parser.SaveDistributionPath)
         ##############################
         # Loop for F-score methods
@@ -1007,7 +1186,7 @@ def Main(Parser = None):
             Result = Parser.FitMixtureModel()
             if not Result:
                 sys.exit(1)
-        if Parser.PerformProteinSelection:
+        if Parser.PerformProteinSelection and Parser.ReadScoresPath:
             Parser.SelectProteins(Parser.PValueCutoff, Parser.ReadScoresPath)
         print "Write p-value distribution to %s..."%Parser.SaveDistributionPath
         (Stub, Extension) = os.path.splitext(Parser.SaveDistributionPath)
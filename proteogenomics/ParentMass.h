@@ -92,6 +92,7 @@ typedef struct PMCInfo
 } PMCInfo;
 
 void PerformPMC(PMCSpectrumInfo* SpectrumInfo);
+int LoadPMCSVM();
 void FreePMCSpectrumInfo(PMCSpectrumInfo* SpectrumInfo);
 void ComputePMCFeatures(PMCSpectrumInfo* SpectrumInfo);
 PMCSpectrumInfo* GetPMCSpectrumInfo(MSSpectrum* Spectrum);
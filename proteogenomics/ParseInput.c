@@ -912,6 +912,18 @@ int ParseInputMultiCharge(char* CommandValue)
     GlobalOptions->MultiChargeMode = atoi(CommandValue);
     return 1;
 }
+int ParseInputMassIndex(char* CommandValue)
+{
+    GlobalOptions->MassIndexFlag = atoi(CommandValue);
+    return 1;
+}
+
+int ParseInputTrieMemory(char* CommandValue)
+{
+    GlobalOptions->TrieMemory = max(0, atoi(CommandValue));
+    return 1;
+}
+
 int ParseInputXMLStrict(char* CommandValue)
 {
     GlobalOptions->XMLStrictFlag = atoi(CommandValue);
@@ -1192,6 +1204,7 @@ static const InputParameter InputParameters[] =
     {"FreeMods", ParseInputFreeMods, INPUT_VALUE_TYPE_INT},
     {"Instrument", ParseInputInstrument, INPUT_VALUE_TYPE_STRING},
     {"IonTolerance", ParseInputIonTolerance, INPUT_VALUE_TYPE_STRING},
+    {"MassIndex", ParseInputMassIndex, INPUT_VALUE_TYPE_INT},
     {"MaxPTMSize", ParseInputMaxPTMSize, INPUT_VALUE_TYPE_INT},
     {"Mod", ParseInputMod, INPUT_VALUE_TYPE_STRING},
     {"Mods", ParseInputMods, INPUT_VALUE_TYPE_INT},
@@ -1213,6 +1226,7 @@ static const InputParameter InputParameters[] =
     {"TAGModel", ParseInputTAGModel, INPUT_VALUE_TYPE_STRING},
     {"Tagless", ParseInputTagless, INPUT_VALUE_TYPE_INT},
     {"TagsOnly", ParseInputTagsOnly, INPUT_VALUE_TYPE_NONE},
+    {"TrieMemory", ParseInputTrieMemory, INPUT_VALUE_TYPE_INT},
     {"XMLStrict", ParseInputXMLStrict, INPUT_VALUE_TYPE_INT},
 
 
@@ -9,6 +9,10 @@ import xml.sax
 import xml.sax.handler
 import base64
 import MSSpectrum
+try:
+    import numpy
+except ImportError:
+    numpy = None # peaks are decoded with struct, into PeakClass objects
 
 if hasattr(base64, "b64decode"):
     B64Decode = base64.b64decode
@@ -17,6 +21,26 @@ else:
     B64Decode = base64.decodestring
     B64Encode = base64.encodestring
 
+def DecodeFloats(Buffer, ByteOrder, Precision):
+    """
+    Decode a base64 string of 32 or 64 bit floats in "little" or "big"
+    (network) byte order.  Returns a numpy float64 array, or a list if
+    numpy isn't available.
+    """
+    Decoded = B64Decode(Buffer)
+    if int(Precision) == 64:
+        Format = "d"
+    else:
+        Format = "f"
+    if ByteOrder == "little":
+        Format = "<" + Format
+    else:
+        Format = ">" + Format
+    Count = len(Decoded) / struct.calcsize(Format)
+    if numpy:
+        return numpy.frombuffer(Decoded, numpy.dtype(Format), Count).astype(numpy.float64)
+    return list(struct.unpack("%s%d%s"%(Format[0], Count, Format[1]), Decoded[:Count * struct.calcsize(Format)]))
+
 def GetSpectrumPeaksMZXML(Spectrum, File):
     Spectrum.Peaks = []
     SAXParser = xml.sax.make_parser()
@@ -28,7 +52,7 @@ def GetSpectrumPeaksMZXML(Spectrum, File):
     except xml.sax.SAXException, XMLException:
         Message = XMLException.getMessage()
         # If there are no peaks, then all exceptions are raised:
-        if not len(Spectrum.Peaks):
+        if not Spectrum.GetPeakCount():
             raise
         # If we did succeed in getting peaks, then the error likely arose
         # after the end of the peaks tag.
@@ -128,6 +152,7 @@ class MZXMLPeakParser(XMLDictionaryHandler):
             return
         self.State = MZXMLParseStates.Peaks
         self.PeakBuffer = ""
+        self.Precision = Attributes.get("precision", "32")
         ByteOrder = Attributes.get("byteOrder", "network")
         if ByteOrder == "little" or ByteOrder == "little-endian":
             self.ByteOrder = "little"
@@ -138,19 +163,13 @@ class MZXMLPeakParser(XMLDictionaryHandler):
     def EndPeaks(self):
         if self.State == MZXMLParseStates.SpectrumComplete:
             return
-        DecodedPeaks = B64Decode(self.PeakBuffer)
-        StringPos = 0
-        self.Peaks = []
-        while StringPos < len(DecodedPeaks):
-            if self.ByteOrder == sys.byteorder:
-                Mass = struct.unpack("f", DecodedPeaks[StringPos:StringPos+4])[0]
-                Intensity = struct.unpack("f", DecodedPeaks[StringPos+4:StringPos+8])[0]                
-            else:
-                Mass = struct.unpack("!f", DecodedPeaks[StringPos:StringPos+4])[0]
-                Intensity = struct.unpack("!f", DecodedPeaks[StringPos+4:StringPos+8])[0]
-            Peak = MSSpectrum.PeakClass(Mass, Intensity)
-            StringPos += 8
-            #print Peak.Mass, Peak.Intensity
+        # Peaks are (mass, intensity) pairs:
+        Values = DecodeFloats(self.PeakBuffer, self.ByteOrder, self.Precision)
+        if numpy:
+            self.Spectrum.SetPeakArrays(Values[0::2].copy(), Values[1::2].copy())
+            return
+        for ValueIndex in range(0, len(Values) - 1, 2):
+            Peak = MSSpectrum.PeakClass(Values[ValueIndex], Values[ValueIndex + 1])
             self.Spectrum.Peaks.append(Peak)
 
 class MZDataParseStates:
@@ -193,29 +212,7 @@ class MZDataPeakParser(XMLDictionaryHandler):
             self.PeakBuffer += String
     def EndData(self):
         if self.State in (MZDataParseStates.MZArrayData, MZDataParseStates.IntensityArrayData):
-            # Parse the float array:
-            FloatList = []
-            DecodedPeaks = B64Decode(self.PeakBuffer)
-            StringPos = 0
-            while StringPos < len(DecodedPeaks):
-                if self.ByteOrder == sys.byteorder:
-                    if self.Precision == 64:
-                        Value = struct.unpack("d", DecodedPeaks[StringPos:StringPos + 8])[0]
-                    else:
-                        Value = struct.unpack("f", DecodedPeaks[StringPos:StringPos + 4])[0]
-                else:
-                    if self.Precision == 64:
-                        Value  = struct.unpack("!d", DecodedPeaks[StringPos:StringPos + 8])[0]
-                    else:
-                        Value = struct.unpack("!f", DecodedPeaks[StringPos:StringPos + 4])[0]
-                #Peak = MSSpectrum.PeakClass(Mass, Intensity)
-                FloatList.append(Value)
-                if self.Precision == 64:
-                    StringPos += 8
-                else:
-                    StringPos += 4
-                #print Peak.Mass, Peak.Intensity
-                #self.Spectrum.Peaks.append(Peak)
+            FloatList = DecodeFloats(self.PeakBuffer, self.ByteOrder, self.Precision)
             if self.State == MZDataParseStates.MZArrayData:
                 self.MZList = FloatList
             else:
@@ -241,6 +238,9 @@ class MZDataPeakParser(XMLDictionaryHandler):
     def EndSpectrum(self):
         if self.State != MZXMLParseStates.SpectrumComplete:
             self.State = MZXMLParseStates.SpectrumComplete
+            if numpy:
+                self.Spectrum.SetPeakArrays(self.MZList, self.IntensityList)
+                return
             for PeakIndex in range(len(self.MZList)):
                 Mass = self.MZList[PeakIndex]
                 Intensity = self.IntensityList[PeakIndex]
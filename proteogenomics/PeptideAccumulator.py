@@ -0,0 +1,105 @@
+"""
+PeptideAccumulator.py
+Collects the peptide/spectrum matches of a search into one entry per amino
+acid string: the best p-value, and the spectra it was seen in.  Each match
+is a dictionary lookup, so collecting is linear in the number of matches.
+
+The spectra of a peptide are kept as a SourceList, (file id, scan number)
+pairs in an int array with one shared table of file names, rather than a
+list of (file name, scan) tuples.  A SourceList iterates as those tuples,
+so it can go anywhere the list went (e.g. LocatedPeptide.AppendMSMSSource).
+"""
+import os
+import array
+from Utils import GetPeptideFromModdedName
+
+
+class SourceList(object):
+    "The (file name, scan number) spectra of a peptide, two ints per spectrum."
+    __slots__ = ("Files", "Pairs")
+
+    def __init__(self, Files):
+        self.Files = Files # the file name table, shared by all lists of an accumulator
+        self.Pairs = array.array("l") # file id, scan, file id, scan, ...
+
+    def __getstate__(self):
+        return (self.Files, self.Pairs)
+
+    def __setstate__(self, State):
+        (self.Files, self.Pairs) = State
+
+    def Add(self, FileID, Scan):
+        self.Pairs.append(FileID)
+        self.Pairs.append(Scan)
+
+    def __len__(self):
+        return len(self.Pairs) / 2
+
+    def __iter__(self):
+        Files = self.Files
+        Pairs = self.Pairs
+        for Index in xrange(0, len(Pairs), 2):
+            yield (Files[Pairs[Index]], Pairs[Index + 1])
+
+    def __getitem__(self, Index):
+        if Index < 0:
+            Index += len(self)
+        if Index < 0 or Index >= len(self):
+            raise IndexError("SourceList index out of range")
+        return (self.Files[self.Pairs[2 * Index]], self.Pairs[2 * Index + 1])
+
+
+class PeptideAccumulator:
+    """
+    Variables:
+        self.BestPValue: aminos -> best p-value of the target peptides
+        self.Sources: aminos -> SourceList of the target peptides
+        self.DecoyAminos: set of the aminos of the decoy (XXX) matches
+        self.SpectrumCount: matches passed to AddMatch and AddDecoy
+    GetAminos remembers up to CacheSize annotations, then starts over.
+    """
+    def __init__(self, CacheSize = 100000):
+        self.BestPValue = {}
+        self.Sources = {}
+        self.DecoyAminos = set()
+        self.SpectrumCount = 0
+        self.Files = [] # file id -> file name
+        self.FileIDs = {} # file path -> file id
+        self.CacheSize = CacheSize
+        self.AminosCache = {} # annotation -> aminos
+
+    def GetAminos(self, Annotation):
+        """Parameters: an annotation like "K.ATphosQR.G"
+        Return: the aminos of the annotation, as GetPeptideFromModdedName gives them
+        """
+        Aminos = self.AminosCache.get(Annotation)
+        if Aminos == None:
+            Aminos = GetPeptideFromModdedName(Annotation).Aminos
+            if len(self.AminosCache) >= self.CacheSize:
+                self.AminosCache.clear()
+            self.AminosCache[Annotation] = Aminos
+        return Aminos
+
+    def GetFileID(self, FilePath):
+        "The id of a spectrum file; the table keeps only the file name, not the directory."
+        FileID = self.FileIDs.get(FilePath)
+        if FileID == None:
+            FileID = len(self.Files)
+            self.Files.append(os.path.split(FilePath)[1])
+            self.FileIDs[FilePath] = FileID
+        return FileID
+
+    def AddDecoy(self, Aminos):
+        self.SpectrumCount += 1
+        self.DecoyAminos.add(Aminos)
+
+    def AddMatch(self, Aminos, PValue, FilePath, Scan):
+        self.SpectrumCount += 1
+        Sources = self.Sources.get(Aminos)
+        if Sources == None:
+            Sources = SourceList(self.Files)
+            self.Sources[Aminos] = Sources
+            self.BestPValue[Aminos] = PValue
+        elif PValue < self.BestPValue[Aminos]:
+            self.BestPValue[Aminos] = PValue
+        Sources.Add(self.GetFileID(FilePath), Scan)
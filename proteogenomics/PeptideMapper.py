@@ -27,9 +27,10 @@ This auxiliary set of classes/functions is to be used in mapping peptides to
 their genomic location.  hopefully, this will be the central place that we 
 do all of this activity, regardless of the genome.
 
-Usage: You can call the following two methods.  nothing else.
+Usage: You can call the following methods.  nothing else.
 LoadDatabases(DBPaths)
-MapMe(AminoAcidSequence)
+FindPeptideLocations(AminoAcidSequenceList)
+MapPeptide(AminoAcidSequence, ...)
 
 NOTE: because this is genomic mapping, the database must have the standard
 notion of a genomic context. you can get this by using the SixFrameFasta.py
@@ -50,6 +51,7 @@ class PeptideMappingClass:
         self.DatabasePaths = [] #possibly multiple
         self.CurrentAminos = ""
         self.UniquePeptideCount =0
+        self.PeptideStore = None # a PGPeptide.PeptideStore to keep the mapped peptides in, if set
 
     def LoadDatabases(self, DBPaths):
         """
@@ -62,9 +64,20 @@ class PeptideMappingClass:
         self.orfIndex = bioseq.QGramIndex( DBPaths )
         self.orfIndex.index()
 
-    def MapPeptide(self, Aminos, PValue, MSMSSources, WarnNoMatch = 0):
+    def FindPeptideLocations(self, AminosList):
         """
-        Parameters: an amino acid string, the best score (pvalue)
+        Parameters: a list of amino acid strings
+        Return: a list with the ORF database locations of every peptide
+        Description: look up many peptides with one call into the index, 
+        rather than one per peptide.  The result items are what MapPeptide
+        accepts as LocationsInORFDB.
+        """
+        return self.orfIndex.accessionsWhereSeqsFound(AminosList)
+
+    def MapPeptide(self, Aminos, PValue, MSMSSources, WarnNoMatch = 0, LocationsInORFDB = None):
+        """
+        Parameters: an amino acid string, the best score (pvalue), optionally
+        the locations of the aminos already found with FindPeptideLocations
         Return: a list of LocatedPeptide objects (possible list of len 1)
         Description: This is the method that takes amino acids and maps
         them into dna sequence space.  I have tried very hard to label
@@ -74,7 +87,8 @@ class PeptideMappingClass:
         ReturnList = [] # the list of PGPeptide.LocatedPeptide objects
         self.CurrentAminos = Aminos #only used for printing in case or error
         #1. First find the location(s) of the aminos in the ORF database
-        LocationsInORFDB = self.orfIndex.accessionsWhereSeqFound(Aminos)
+        if LocationsInORFDB == None:
+            LocationsInORFDB = self.orfIndex.accessionsWhereSeqFound(Aminos)
         if (len(LocationsInORFDB) < 1) and WarnNoMatch:
             #sometimes we don't care that there's no match.  Like for trypsin.  it's 
             #not part of our 6frame bacteria, but it was in the inspect search
@@ -86,7 +100,10 @@ class PeptideMappingClass:
             ParsedORFInfo = PGPeptide.ORFFastaHeader(ORFFastaLine)
             SimpleLocation = self.MapNucleotideLocation(ParsedORFInfo, PeptideStartAA, len(Aminos))
             #now that we have a Location, let's get our Located Peptide Object up and running
-            Peptide = PGPeptide.LocatedPeptide(Aminos, SimpleLocation)
+            if self.PeptideStore != None:
+                Peptide = self.PeptideStore.AddPeptide(Aminos, SimpleLocation)
+            else:
+                Peptide = PGPeptide.LocatedPeptide(Aminos, SimpleLocation)
             Peptide.bestScore = PValue
             Peptide.ORFName = ParsedORFInfo.ORFName
             Peptide.name = "Peptide%s"%self.UniquePeptideCount
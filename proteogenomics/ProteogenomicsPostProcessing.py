@@ -52,6 +52,15 @@ Additional Parameters
  -G [FileName] write out the peptide mappings in GFF format
  -W    Flag to print out warnings (as opposed to the verbose program progress)
 
+Processing many genomes at once
+ -L [FileName] Genome list, in place of -b, -o, -G and -w.  One genome per
+     line, tab separated: genbank file, ORF database (6frame trie), peptide
+     GFF output file, output file.  The results (-r) are parsed only once,
+     the peptides are split up by the genome they map to, and the genomes
+     are processed in parallel.
+ -n [int] Number of processes for -L (default is the number of CPUs).  Also
+     decompresses and parses the results (-r) in that many processes.
+
 """
 
 
@@ -60,6 +69,7 @@ import traceback
 import InspectResults
 import GenomicLocations
 import PeptideMapper
+import PeptideAccumulator
 import PGPeptide
 import PGORFFilters
 import PGPrimaryStructure
@@ -68,6 +78,9 @@ import GFFIO
 from Utils import *
 Initialize()
 from itertools import combinations # for the combinations of double for loops
+import copy
+import multiprocessing
+import bioseq
 
 class FinderClass():
     def __init__(self):
@@ -78,10 +91,10 @@ class FinderClass():
         self.ProteomeDatabasePaths = [] #possibly multiple
         self.ORFDatabasePaths = [] #possibly multiple
         self.AllPeptides = {} # AminoSequence -> best pvalue, nulled out in MapAllPeptides
-        self.PeptideSources = {} #aminosequence->[(file,spectrum), (file,spectrum), ...]
+        self.PeptideSources = {} #aminosequence->PeptideAccumulator.SourceList of (file,spectrum)
         self.AllLocatedPeptides = [] #list of PeptideMapper.GenomicLocationForPeptide
         self.AllPredictedProteins = {} #predictedProteinName ->GenomicLocationForPeptide Object, used in CreateORFs
-        self.ProteomicallyObservedORFs = [] # this is populated when peptides are mapped, and deleted after ORF Objects are created
+        self.ProteomicallyObservedORFs = set() # this is populated when peptides are mapped, and deleted after ORF Objects are created
         self.UniquenessFlag = 0
         self.InterPeptideDistanceMax = 1000 # sensible default
         self.PValueLimit = 0.05 #pvalues are 0.00 (good) to 1.0 (bad) 
@@ -91,9 +104,98 @@ class FinderClass():
         self.SearchForCleavage = 1
         self.OutputPeptidesToGFF = 0
         self.GFFOutputPath = "RenameYourOutput.gff"
+        self.GenomeListPath = None # -L, many genomes in one run
+        self.Processes = None # for -L, None is one per cpu
         self.Report = PGPReport()
 
     def Main(self):
+        if self.GenomeListPath:
+            self.ProcessAllGenomes()
+            return
+        if self.InspectResultsPath:
+            self.ParseInspect( self.InspectResultsPath )
+        self.ProcessGenome()
+
+    def ProcessAllGenomes(self):
+        """Parameters: None
+        Return: None
+        Description: do the work of many single genome runs, but parse the
+        results only once.  We find out which genome each peptide maps to, 
+        and give every genome task only its own peptides.  The tasks then
+        run in a process pool.
+        """
+        Genomes = self.ReadGenomeList(self.GenomeListPath)
+        self.ParseInspect( self.InspectResultsPath )
+        ORFDatabasePaths = [ORFDatabasePath for (GenbankPath, ORFDatabasePath, GFFPath, OutputPath) in Genomes]
+        PeptidesByGenome = self.PartitionPeptides(ORFDatabasePaths)
+        Tasks = []
+        for ((GenbankPath, ORFDatabasePath, GFFPath, OutputPath), AminosList) in zip(Genomes, PeptidesByGenome):
+            Task = copy.copy(self)
+            Task.GenomeListPath = None
+            Task.GenbankPath = GenbankPath
+            Task.ORFDatabasePaths = [ORFDatabasePath]
+            Task.OutputPeptidesToGFF = 1
+            Task.GFFOutputPath = GFFPath
+            Task.OutputPath = OutputPath
+            Task.AllPeptides = {}
+            Task.PeptideSources = {}
+            for Aminos in AminosList:
+                Task.AllPeptides[Aminos] = self.AllPeptides[Aminos]
+                Task.PeptideSources[Aminos] = self.PeptideSources[Aminos]
+            Task.AllLocatedPeptides = []
+            Task.ProteomicallyObservedORFs = set()
+            Task.Report = copy.deepcopy(self.Report)
+            Tasks.append(Task)
+        self.AllPeptides = {} # the tasks have their own copies now
+        self.PeptideSources = {}
+        if self.Verbose:
+            print "ProteogenomicsPostProcessing.py:ProcessAllGenomes - %s genomes"%len(Tasks)
+        Pool = multiprocessing.Pool(self.Processes)
+        try:
+            Pool.map(ProcessGenomeTask, Tasks, 1) # chunks of 1, genome sizes differ a lot
+        finally:
+            Pool.close()
+            Pool.join()
+
+    def ReadGenomeList(self, FilePath):
+        """Parameters: path of the -L genome list file
+        Return: list of (genbank, orf database, gff output, output) tuples
+        """
+        Genomes = []
+        Handle = open(FilePath, "r")
+        for Line in Handle:
+            Line = Line.strip()
+            if not Line or Line[0] == "#":
+                continue
+            Bits = Line.split("\t")
+            if len(Bits) != 4:
+                raise ValueError("Genome list line needs 4 tab separated fields: %s"%Line)
+            Genomes.append(tuple(Bits))
+        Handle.close()
+        return Genomes
+
+    def PartitionPeptides(self, ORFDatabasePaths):
+        """Parameters: list of ORF databases, one per genome
+        Return: a list (for each database) of the peptides that map to it
+        Description: peptides mapping to no database are in none of the lists,
+        the ones that map to several are in each of those lists.
+        """
+        AllAminos = self.AllPeptides.keys()
+        PeptidesByGenome = []
+        for ORFDatabasePath in ORFDatabasePaths:
+            ORFIndex = bioseq.QGramIndex(ORFDatabasePath)
+            ORFIndex.index()
+            AllLocations = ORFIndex.accessionsWhereSeqsFound(AllAminos)
+            PeptidesByGenome.append([Aminos for (Aminos, Locations) in zip(AllAminos, AllLocations) if Locations])
+            del ORFIndex
+        return PeptidesByGenome
+
+    def ProcessGenome(self):
+        """Parameters: None
+        Return: None
+        Description: all the analyses for the one genome in self.GenbankPath.
+        Results from Inspect have to be parsed into self.AllPeptides already
+        """
         chromReader = PGPeptide.GenbankGenomeReader(self.GenbankPath, self.ORFDatabasePaths)
         genome = chromReader.makeGenomeWithProteinORFs()
         self.Report.SetValue("MappedProteins", genome.numOrfs('Simple'))
@@ -101,7 +203,6 @@ class FinderClass():
         self.Report.SetValue("UnmappedProteinsSNAFU", genome.numOrfs('Other'))
         #1. we map peptides, either from Inspect, or from pre-mapped GFFs
         if self.InspectResultsPath:
-            self.ParseInspect( self.InspectResultsPath )
             self.MapAllPeptides(genome) # modify to add too genome/chromsome
 
         else :
@@ -413,8 +514,7 @@ class FinderClass():
             Location = GenomicLocations.GenomicLocationForPeptide()
             Location.FillFromGFF(Dictionary)
             MappedORF = Location.ProteinName
-            if not MappedORF in self.ProteomicallyObservedORFs:
-                self.ProteomicallyObservedORFs.append(MappedORF)
+            self.ProteomicallyObservedORFs.add(MappedORF)
             self.AllLocatedPeptides.append(Location)
 
     def WritePeptideGFFFile(self, genome):
@@ -490,13 +590,19 @@ class FinderClass():
         MappingCount = 0 #those that do map to our databases
         ORFPeptideMapper = PeptideMapper.PeptideMappingClass()
         ORFPeptideMapper.LoadDatabases(self.ORFDatabasePaths) #a handle for the 6frame translations db (called ORF)
-        for (Aminos, PValue) in self.AllPeptides.items():
+        ORFPeptideMapper.PeptideStore = genome.peptides
+        AllAminos = self.AllPeptides.keys()
+        #look them all up in one go, the index does this much faster than one at a time
+        AllLocations = ORFPeptideMapper.FindPeptideLocations(AllAminos)
+        for (Aminos, LocationsInORFDB) in zip(AllAminos, AllLocations):
+            PValue = self.AllPeptides[Aminos]
             Count += 1
             if (Count %1000) == 0 and self.Verbose:
                 print "Mapped %s / %s peptides"%(Count, len(self.AllPeptides))
             #print Aminos
             MSMSSources = self.PeptideSources[Aminos] #the are all the spectra that are for a amino acid string
-            LocatedPeptides = ORFPeptideMapper.MapPeptide(Aminos, PValue, MSMSSources)
+            LocatedPeptides = ORFPeptideMapper.MapPeptide(Aminos, PValue, MSMSSources,
+                                                          LocationsInORFDB = LocationsInORFDB)
             
             if len(LocatedPeptides) == 0:
                 #this peptide sequence did not map to the database.  That might mean that
@@ -525,8 +631,7 @@ class FinderClass():
                     genome.addOrf( orf, 'PepOnly' )
                     orf.addLocatedPeptide( Location )
 
-                if not Location.ORFName in self.ProteomicallyObservedORFs:
-                    self.ProteomicallyObservedORFs.append(Location.ORFName)
+                self.ProteomicallyObservedORFs.add(Location.ORFName)
 
         genome.addSeqToPepOnlyOrfs( self.ORFDatabasePaths )
 
@@ -548,20 +653,15 @@ class FinderClass():
         """Here I parse out Inspect Results to get peptide annotations, 
         Putting them in a hash for safe keeping
         """
-        FalseAminos = []
-        SpectrumCount = 0
-        inspectParser = InspectResults.Parser( FilePath )
+        Accumulator = PeptideAccumulator.PeptideAccumulator()
+        inspectParser = InspectResults.Parser( FilePath, Workers = self.Processes )
         for result in inspectParser:
             try:
-                Annotation = result.Annotation
-                Peptide = GetPeptideFromModdedName(Annotation)
-                Aminos = Peptide.Aminos
+                Aminos = Accumulator.GetAminos(result.Annotation)
                 PValue = result.PValue
                 InspectMappedProtein = result.ProteinName
                 FilePath = result.SpectrumFile
                 Spectrum = result.ScanNumber
-                (Path, File) = os.path.split(FilePath)
-                SourceTuple = (File,Spectrum)
             except:
                 traceback.print_exc()
                 continue # SNAFU
@@ -576,30 +676,22 @@ class FinderClass():
                 if LFDR > self.PValueLimit:
                     continue
             #everybody passed this line gets a cookie (you passed pvalue cutoff)
-            SpectrumCount += 1
             #just a little damage control here.  We want to count the number of false positive peptides
             if InspectMappedProtein[:3] == "XXX":
                 #this is a true negative.  let's count them
-                if not Aminos in FalseAminos:
-                    FalseAminos.append(Aminos)
+                Accumulator.AddDecoy(Aminos)
                 continue
+            Accumulator.AddMatch(Aminos, PValue, FilePath, Spectrum)
 
-            if not self.AllPeptides.has_key(Aminos):
-                self.AllPeptides[Aminos] = PValue
-                self.PeptideSources[Aminos] = []
-                self.PeptideSources[Aminos].append(SourceTuple)
-            else:
-                self.PeptideSources[Aminos].append(SourceTuple)
-                if PValue <  self.AllPeptides[Aminos]:
-                    self.AllPeptides[Aminos] = PValue
-
-        print "I got %s truedb peptides, and %s decoy peptides (%s spectra)"%(len(self.AllPeptides), len(FalseAminos), SpectrumCount)
+        self.AllPeptides = Accumulator.BestPValue
+        self.PeptideSources = Accumulator.Sources
+        print "I got %s truedb peptides, and %s decoy peptides (%s spectra)"%(len(self.AllPeptides), len(Accumulator.DecoyAminos), Accumulator.SpectrumCount)
         self.Report.SetValue("TruePeptides", len(self.AllPeptides))
-        self.Report.SetValue("DecoyPeptides", len(FalseAminos))
-        self.Report.SetValue("SpectraProcessed", SpectrumCount)
+        self.Report.SetValue("DecoyPeptides", len(Accumulator.DecoyAminos))
+        self.Report.SetValue("SpectraProcessed", Accumulator.SpectrumCount)
 
     def ParseCommandLine(self,Arguments):
-        (Options, Args) = getopt.getopt(Arguments, "b:r:g:d:w:uvi:o:p:CMG:W")
+        (Options, Args) = getopt.getopt(Arguments, "b:r:g:d:w:uvi:o:p:CMG:WL:n:")
         OptionsSeen = {}
         #set our report
         self.Report.SetValue("CommandLine", Arguments)
@@ -655,6 +747,20 @@ class FinderClass():
                 self.GFFOutputPath = Value
             if Option == "-W":
                 self.VerboseWarnings =1
+            if Option == "-L":
+                if not os.path.exists(Value):
+                    print "** Error: couldn't find genome list file '%s'\n\n"%Value
+                    print UsageInfo
+                    sys.exit(1)
+                self.GenomeListPath = Value
+            if Option == "-n":
+                self.Processes = int(Value)
+        if OptionsSeen.has_key("-L"):
+            #the genome list replaces the single genome options, and needs the results
+            if not OptionsSeen.has_key("-r"):
+                print UsageInfo
+                sys.exit(1)
+            return
         #if not OptionsSeen.has_key("-w") or not OptionsSeen.has_key("-d") or not OptionsSeen.has_key("-o"):
         if not OptionsSeen.has_key("-w") or not OptionsSeen.has_key("-o"):
             print UsageInfo
@@ -664,6 +770,19 @@ class FinderClass():
             sys.exit(1)
 
 
+def ProcessGenomeTask(Finder):
+    """Process pool entry point for ProcessAllGenomes.  Finder is a 
+    FinderClass set up for one genome, with its peptides already parsed.
+    """
+    try:
+        Finder.ProcessGenome()
+    except:
+        #the pool only passes the exception on, so show where it happened
+        traceback.print_exc()
+        raise
+    return Finder.GenbankPath
+
+
 class PGPReport():
     """Takes information about the data run and formats it so that you can
     have a pretty report for later.
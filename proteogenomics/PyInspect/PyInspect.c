@@ -3,6 +3,7 @@
 #include "Trie.h"
 #include "Score.h"
 #include "PySpectrum.h"
+#include "PySearch.h"
 #include "BN.h"
 #include "PyUtils.h"
 #include "Errors.h"
@@ -549,6 +550,8 @@ static PyMethodDef PyInspectMethods[] =
     {"GetBNFeatureNames", PyGetBNFeatureNames, 1, "Return a list of names of nodes in the bayesian network"},
     {"ComputeMutualInformation", PyComputeMutualInformation, 1, "Compute MutualInformation for nodes and their parents"},
     {"ReloadPMC", PyReloadPMC, 1, "Reset PMC / CC models"},
+    {"LoadSearch", PyLoadSearch, 1, "Load search options and databases from an Inspect input file"},
+    {"Search", PySearch, 1, "Search a list of spectra against the loaded databases; return their matches"},
     //{"erf", PyErrorFunction, METH_VARARGS, "return the error function erf(x)"},
     //{"GammaIncomplete", PyGammaIncomplete, METH_VARARGS, "return the incomplete gamma function g(a, x)"},
     //{"foo", ex_foo, 1, "foo() doc string"},
@@ -558,6 +561,7 @@ static PyMethodDef PyInspectMethods[] =
 // Cleanup, called by Python when unloading.  Deallocate memory:
 void PyInspectCleanup(void)
 {
+    FreeSearch();
     FreeMassDeltaByMass();
     FreeMassDeltas();
     FreeIsSubDecoration();
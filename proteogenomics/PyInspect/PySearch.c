@@ -0,0 +1,353 @@
+// PySearch: Run Inspect searches from Python, without starting an inspect process per job.
+// LoadSearch() reads an input file and opens its databases once; Search() then searches
+// batches of spectra and returns their matches as dictionaries.
+#include "CMemLeak.h"
+#include "PySearch.h"
+#include "PyUtils.h"
+#include "Trie.h"
+#include "Score.h"
+#include "Spectrum.h"
+#include "FreeMod.h"
+#include "Tagger.h"
+#include "Mods.h"
+#include "ParseInput.h"
+#include "Run.h"
+#include "Errors.h"
+#include "IonScoring.h"
+#include "SVM.h"
+#include "LDA.h"
+
+// Set once LoadSearch has succeeded:
+int SearchLoaded = 0;
+
+// Load search options (and databases) from an Inspect input file.  The spectra listed
+// in the input file (if any) are ignored; spectra are passed to Search() instead.
+PyObject* PyLoadSearch(PyObject* self, PyObject* args)
+{
+    char* InputFileName;
+    char* ResourceDir = NULL;
+    char Path[2048];
+    DatabaseFile* DB;
+    //
+    if (!PyArg_ParseTuple(args, "s|s", &InputFileName, &ResourceDir))
+    {
+        return NULL;
+    }
+    if (SearchLoaded)
+    {
+        sprintf(PythonErrorString, "A search is loaded already");
+        ReportPythonError();
+        return NULL;
+    }
+    if (ResourceDir)
+    {
+        strncpy(GlobalOptions->ResourceDir, ResourceDir, MAX_FILENAME_LEN - 2);
+        if (*(GlobalOptions->ResourceDir + strlen(GlobalOptions->ResourceDir) - 1) != SEPARATOR)
+        {
+            strcat(GlobalOptions->ResourceDir, SEPARATOR_STRING);
+        }
+    }
+    // Start over from the standard amino acid masses, rather than the interactive
+    // defaults.  (The input file's fixed modifications are applied to these)
+    sprintf(Path, "%s%s", GlobalOptions->ResourceDir, GlobalOptions->AminoFileName);
+    if (!LoadPeptideMasses(Path))
+    {
+        sprintf(PythonErrorString, "Unable to load amino acid masses from '%s'", Path);
+        ReportPythonError();
+        return NULL;
+    }
+    sprintf(Path, "%s%s", GlobalOptions->ResourceDir, FILENAME_MASS_DELTAS);
+    LoadMassDeltas(Path, 0);
+    GlobalOptions->RunMode = RUN_MODE_DEFAULT;
+    strncpy(GlobalOptions->InputFileName, InputFileName, MAX_FILENAME_LEN - 1);
+    // Only errors in the input file itself count against it:
+    GlobalOptions->ErrorCount = 0;
+    if (!ParseInputFile())
+    {
+        sprintf(PythonErrorString, "Unable to parse input file '%s'", InputFileName);
+        ReportPythonError();
+        return NULL;
+    }
+    if (GlobalOptions->ExternalTagger || (GlobalOptions->RunMode & ~RUN_MODE_VERBOSE))
+    {
+        sprintf(PythonErrorString, "Only standard (tag-based) searches can be run from Python");
+        ReportPythonError();
+        return NULL;
+    }
+    if (!GlobalOptions->FirstDatabase)
+    {
+        REPORT_ERROR(11);
+        sprintf(PythonErrorString, "No database given in input file '%s'", InputFileName);
+        ReportPythonError();
+        return NULL;
+    }
+    InitStats();
+    InitBayesianModels();
+    if (ResourceDir)
+    {
+        // Tag skew scores were read (or defaulted) from the old resource directory:
+        FreeTagSkewScores();
+    }
+    SetTagSkewScores();
+    InitMassDeltaByMass();
+    PopulateJumpingHash();
+#ifdef MQSCORE_USE_SVM
+    InitPValueSVM();
+#else
+    InitPValueLDA();
+#endif
+    OpenSearchDatabases();
+    for (DB = GlobalOptions->FirstDatabase; DB; DB = DB->Next)
+    {
+        if (!DB->DBFile)
+        {
+            CloseSearchDatabases();
+            sprintf(PythonErrorString, "Unable to open database '%s'", DB->FileName);
+            ReportPythonError();
+            return NULL;
+        }
+    }
+    BuildDecorations();
+    SearchLoaded = 1;
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+void FreeSearchSpectrumNodes(SpectrumNode* FirstNode)
+{
+    SpectrumNode* Node;
+    SpectrumNode* NextNode;
+    //
+    for (Node = FirstNode; Node; Node = NextNode)
+    {
+        NextNode = Node->Next;
+        FreeMatchList(Node);
+        SafeFree(Node->InputFile);
+        FreeSpectrumNode(Node);
+    }
+}
+
+// Build a SpectrumNode for one entry of the list passed to Search(): either a tuple
+// (FilePath, FilePos) or a tuple (PrecursorMZ, Charge, Peaks).  Returns NULL (and sets
+// a Python exception) for an invalid entry.  If the spectrum can't be loaded, the
+// node has no Spectrum.
+SpectrumNode* GetSearchSpectrumNode(PyObject* Entry)
+{
+    SpectrumNode* Node;
+    char* FilePath;
+    int FilePosition;
+    float MZ;
+    int Charge;
+    PyObject* PeakList;
+    PyObject* PeakTuple;
+    int PeakIndex;
+    float Mass;
+    float Intensity;
+    FILE* SpectrumFile;
+    int LoadResult = 0;
+    //
+    Node = (SpectrumNode*)calloc(1, sizeof(SpectrumNode));
+    Node->InputFile = (InputFileNode*)calloc(1, sizeof(InputFileNode));
+    Node->Spectrum = (MSSpectrum*)calloc(1, sizeof(MSSpectrum));
+    Node->Spectrum->Node = Node;
+    if (PyTuple_Check(Entry) && PyTuple_Size(Entry) == 2 && PyArg_ParseTuple(Entry, "si", &FilePath, &FilePosition))
+    {
+        Node->FilePosition = FilePosition;
+        strncpy(Node->InputFile->FileName, FilePath, MAX_FILENAME_LEN - 1);
+        Node->InputFile->Format = GuessSpectrumFormatFromExtension(FilePath);
+        if (Node->InputFile->Format == SPECTRUM_FORMAT_MS2_COLONS)
+        {
+            Node->InputFile->Format = GuessSpectrumFormatFromHeader(FilePath, Node->Spectrum);
+        }
+        SpectrumFile = fopen(FilePath, "rb");
+        if (SpectrumFile)
+        {
+            fseek(SpectrumFile, FilePosition, 0);
+            LoadResult = SpectrumLoadFromFile(Node->Spectrum, SpectrumFile);
+            fclose(SpectrumFile);
+        }
+    }
+    else if (PyTuple_Check(Entry) && PyTuple_Size(Entry) == 3 && PyArg_ParseTuple(Entry, "fiO", &MZ, &Charge, &PeakList))
+    {
+        ROUND_MASS(MZ, Node->Spectrum->MZ);
+        if (Charge > 0 && Charge < 6)
+        {
+            Node->Spectrum->Charge = Charge;
+            Node->Spectrum->FileCharge[Charge] = 1;
+            Node->Spectrum->FileChargeFlag = 1;
+            Node->Spectrum->ParentMass = Node->Spectrum->MZ * Charge - (HYDROGEN_MASS * (Charge - 1));
+        }
+        else if (Charge)
+        {
+            FreeSearchSpectrumNodes(Node);
+            sprintf(PythonErrorString, "Invalid charge %d", Charge);
+            ReportPythonError();
+            return NULL;
+        }
+        LoadResult = PyList_Check(PeakList);
+        for (PeakIndex = 0; LoadResult && PeakIndex < PyList_Size(PeakList); PeakIndex++)
+        {
+            PeakTuple = PyList_GetItem(PeakList, PeakIndex);
+            if (!PyTuple_Check(PeakTuple) || !PyArg_ParseTuple(PeakTuple, "ff", &Mass, &Intensity))
+            {
+                PyErr_Clear();
+                FreeSearchSpectrumNodes(Node);
+                sprintf(PythonErrorString, "Peaks must be (Mass, Intensity) tuples");
+                ReportPythonError();
+                return NULL;
+            }
+            LoadResult = SpectrumAddPeak(Node->Spectrum, Mass, Intensity);
+        }
+        if (LoadResult)
+        {
+            SpectrumComputeParentMass(Node->Spectrum);
+        }
+    }
+    else
+    {
+        PyErr_Clear();
+        FreeSearchSpectrumNodes(Node);
+        sprintf(PythonErrorString, "Search() takes a list of (FilePath, FilePos) or (PrecursorMZ, Charge, Peaks) tuples");
+        ReportPythonError();
+        return NULL;
+    }
+    if (!LoadResult || !Node->Spectrum->PeakCount)
+    {
+        FreeSpectrum(Node->Spectrum);
+        Node->Spectrum = NULL;
+    }
+    return Node;
+}
+
+void SetMatchItem(PyObject* MatchDict, char* Key, PyObject* Value)
+{
+    PyDict_SetItemString(MatchDict, Key, Value);
+    Py_DECREF(Value);
+}
+
+// The names of a match's score features, as in the columns of Inspect's output:
+static char* MatchFeatureNames[MQ_FEATURE_COUNT] = {"Length", "TotalPRMScore", "MedianPRMScore",
+    "FractionY", "FractionB", "Intensity", "NTT"};
+
+// Return a list of the top-scoring matches for a searched spectrum.  Each match is a
+// dictionary keyed by the column names of Inspect's output (p-values are not computed,
+// since they are fit over a whole search run).
+PyObject* GetSpectrumMatchList(SpectrumNode* Node)
+{
+    PyObject* MatchList;
+    PyObject* MatchDict;
+    Peptide* Match;
+    char Annotation[256];
+    char ProteinName[256];
+    int MatchNumber = 0;
+    int FeatureIndex;
+    //
+    MatchList = PyList_New(0);
+    SetMatchDeltaCN(Node);
+    for (Match = Node->FirstMatch; Match && MatchNumber < GlobalOptions->ReportMatchCount; Match = Match->Next, MatchNumber++)
+    {
+        ProteinName[0] = '\0';
+        GetProteinID(Match->RecordNumber, Match->DB, ProteinName);
+        WriteMatchToString(Match, Annotation, 1);
+        MatchDict = PyDict_New();
+        SetMatchItem(MatchDict, "Annotation", PyString_FromString(Annotation));
+        SetMatchItem(MatchDict, "Protein", PyString_FromString(ProteinName));
+        SetMatchItem(MatchDict, "Charge", PyInt_FromLong(Match->Tweak->Charge));
+        SetMatchItem(MatchDict, "MQScore", PyFloat_FromDouble(Match->MatchQualityScore));
+        for (FeatureIndex = 0; FeatureIndex < MQ_FEATURE_COUNT; FeatureIndex++)
+        {
+            SetMatchItem(MatchDict, MatchFeatureNames[FeatureIndex], PyFloat_FromDouble(Match->ScoreFeatures[FeatureIndex]));
+        }
+        SetMatchItem(MatchDict, "DeltaScore", PyFloat_FromDouble(Match->DeltaCN));
+        SetMatchItem(MatchDict, "DeltaScoreOther", PyFloat_FromDouble(Match->DeltaCNOther));
+        SetMatchItem(MatchDict, "RecordNumber", PyInt_FromLong(Match->RecordNumber));
+        SetMatchItem(MatchDict, "DBFilePos", PyInt_FromLong(Match->FilePos));
+        PyList_Append(MatchList, MatchDict);
+        Py_DECREF(MatchDict);
+    }
+    return MatchList;
+}
+
+// Search a list of spectra against the loaded databases.  Returns a list with one entry
+// per spectrum: its list of matches, or None if the spectrum couldn't be loaded.
+PyObject* PySearch(PyObject* self, PyObject* args)
+{
+    PyObject* SpectrumList;
+    PyObject* ReturnList;
+    PyObject* MatchList;
+    SpectrumNode* FirstNode = NULL;
+    SpectrumNode* LastNode = NULL;
+    SpectrumNode* Node;
+    SpectrumNode* FirstBlockNode;
+    SpectrumNode* LastBlockNode;
+    int SpectrumIndex;
+    int BlockSize;
+    //
+    if (!PyArg_ParseTuple(args, "O!", &PyList_Type, &SpectrumList))
+    {
+        return NULL;
+    }
+    if (!SearchLoaded)
+    {
+        sprintf(PythonErrorString, "Call LoadSearch() before Search()");
+        ReportPythonError();
+        return NULL;
+    }
+    for (SpectrumIndex = 0; SpectrumIndex < PyList_Size(SpectrumList); SpectrumIndex++)
+    {
+        Node = GetSearchSpectrumNode(PyList_GetItem(SpectrumList, SpectrumIndex));
+        if (!Node)
+        {
+            FreeSearchSpectrumNodes(FirstNode);
+            return NULL;
+        }
+        if (LastNode)
+        {
+            LastNode->Next = Node;
+        }
+        else
+        {
+            FirstNode = Node;
+        }
+        LastNode = Node;
+    }
+    // Search one block of spectra (one scan of each database) at a time:
+    FirstBlockNode = FirstNode;
+    while (FirstBlockNode)
+    {
+        LastBlockNode = FirstBlockNode;
+        for (BlockSize = 0; LastBlockNode && BlockSize < GlobalOptions->TrieBlockSize; BlockSize++)
+        {
+            LastBlockNode = LastBlockNode->Next;
+        }
+        SearchSpectrumBlock(FirstBlockNode, LastBlockNode);
+        FirstBlockNode = LastBlockNode;
+    }
+    ReturnList = PyList_New(0);
+    for (Node = FirstNode; Node; Node = Node->Next)
+    {
+        if (Node->Spectrum)
+        {
+            MatchList = GetSpectrumMatchList(Node);
+        }
+        else
+        {
+            Py_INCREF(Py_None);
+            MatchList = Py_None;
+        }
+        PyList_Append(ReturnList, MatchList);
+        Py_DECREF(MatchList);
+    }
+    FreeSearchSpectrumNodes(FirstNode);
+    return ReturnList;
+}
+
+// Release the databases opened by LoadSearch.  Called when PyInspect is unloaded.
+void FreeSearch()
+{
+    if (SearchLoaded)
+    {
+        CloseSearchDatabases();
+        SearchLoaded = 0;
+    }
+}
@@ -0,0 +1,11 @@
+#ifndef PY_SEARCH_H
+#define PY_SEARCH_H
+// PySearch: Database searches, run from Python.
+#include "Python.h"
+#include "Utils.h"
+
+PyObject* PyLoadSearch(PyObject* self, PyObject* args);
+PyObject* PySearch(PyObject* self, PyObject* args);
+void FreeSearch();
+
+#endif // PY_SEARCH_H
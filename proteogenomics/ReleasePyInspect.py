@@ -7,7 +7,8 @@ import os
 import distutils.core
 
 PyInspectFileNames = [
-    "PyInspect/PyInspect.c", "PyInspect/PySpectrum.c", "PyInspect/PyUtils.c",
+    "PyInspect/PyInspect.c", "PyInspect/PySearch.c", "PyInspect/PySpectrum.c",
+    "PyInspect/PyUtils.c",
     "base64.c", "BN.c", "BuildMS2DB.c", "ChargeState.c", "CMemLeak.c",
     "Errors.c", "ExonGraphAlign.c", "FreeMod.c", "IonScoring.c", "LDA.c",
     "Mods.c", "MS2DB.c", "ParentMass.c", "ParseInput.c", "ParseXML.c", "PValue.c",
@@ -47,8 +47,15 @@
 #include "MS2DB.h"
 #include "IonScoring.h"
 
-extern float g_CutScores[];
-extern PRMBayesianModel* PRMModelCharge2;
+#ifdef _WIN32
+#include <windows.h>
+#include <process.h>
+#else
+#include <pthread.h>
+#endif
+
+extern THREAD_LOCAL float g_CutScores[];
+extern THREAD_LOCAL PRMBayesianModel* PRMModelCharge2;
 
 // Forward Declaration
 void DebugPrintBlindTagExtensions(SearchInfo* Info);
@@ -190,7 +197,7 @@ void MutationModeSearch(SearchInfo* Info)
         {
             continue;
         }
-        fseek(Info->DB->DBFile, 0, 0);
+        fseek(Info->DBFile, 0, 0);
         // *** PRM scores now *** 
         Spectrum->Charge = Node->Tweaks[TweakIndex].Charge;
         Spectrum->ParentMass = Node->Tweaks[TweakIndex].ParentMass;
@@ -905,7 +912,7 @@ int SearchSpectrumBlockTrie(SearchInfo* Info, SpectrumNode* FirstBlockSpectrum,
         InitializeTrieFailureNodes(Info->Root, Info->Root, TagBuffer);
         //printf("Scan file with trie...\n");
         fflush(stdout);
-        fseek(Info->DB->DBFile, 0, 0);
+        fseek(Info->DBFile, 0, 0);
         switch (DB->Type)
         {
         case evDBTypeMS2DB:
@@ -924,13 +931,15 @@ int SearchSpectrumBlockTrie(SearchInfo* Info, SpectrumNode* FirstBlockSpectrum,
     return SpectraSearched;
 }
 // Return number of spectra searched
-int SearchSpectrumBlockAgainstDB(SpectrumNode* FirstBlockSpectrum, SpectrumNode* LastBlockSpectrum, DatabaseFile* DB)
+// DBFile is the caller's handle on DB, which isn't shared with any other search thread.
+int SearchSpectrumBlockAgainstDB(SpectrumNode* FirstBlockSpectrum, SpectrumNode* LastBlockSpectrum, DatabaseFile* DB, FILE* DBFile)
 {
     SearchInfo* Info;
     int SpectraSearched;
     //
     Info = (SearchInfo*)calloc(1, sizeof(SearchInfo));
     Info->DB = DB;
+    Info->DBFile = DBFile;
 
     // MutationMode search is 'unrestricted, but not blind' mode.
     if (GlobalOptions->RunMode & (RUN_MODE_MUTATION | RUN_MODE_BLIND))
@@ -1073,27 +1082,92 @@ void FindDatabaseIndexFile(DatabaseFile* DB)
     return;
 }
 
-// Search all our SpectrumNodes, one block at a time.
-// Once the search is complete, compute p-values and output search results.
-void RunSearch() 
+// A SearchBlockJob is one search thread's share of a round: a block of spectra, 
+// to be searched against every database.
+typedef struct SearchBlockJob
 {
-    int BlockSize;
     SpectrumNode* FirstBlockSpectrum;
     SpectrumNode* LastBlockSpectrum;
-    SpectrumNode* BlockSpectrum;
-    FILE* SpectrumFile;
-    int Result;
-    TrieNode* Root = NULL;
-    int SpectraSearched = 0;
-    int ThisBlockSpectraSearched;
+    // The thread's own handles on the databases, in the order of GlobalOptions->FirstDatabase:
+    FILE** DBFiles;
+    // The thread's own copies of the Bayesian scoring models (see CopyBayesianModels):
+    PRMBayesianModel* Models[BAYESIAN_MODEL_COUNT];
+    int SpectraSearched;
+} SearchBlockJob;
+
+void SearchBlockJobAgainstDBs(SearchBlockJob* Job)
+{
     DatabaseFile* DB;
+    int DBIndex = 0;
+    //
+    Job->SpectraSearched = 0;
+    for (DB = GlobalOptions->FirstDatabase; DB; DB = DB->Next)
+    {
+        Job->SpectraSearched = SearchSpectrumBlockAgainstDB(Job->FirstBlockSpectrum, Job->LastBlockSpectrum, DB, Job->DBFiles[DBIndex]);
+        DBIndex++;
+    }
+}
 
-    // Find index filenames:
+// Entry point for the extra search threads:
+#ifdef _WIN32
+unsigned __stdcall SearchThreadMain(void* Job)
+{
+    SetBayesianModels(((SearchBlockJob*)Job)->Models);
+    SearchBlockJobAgainstDBs((SearchBlockJob*)Job);
+    FreeTagBuffer();
+    return 0;
+}
+#else
+void* SearchThreadMain(void* Job)
+{
+    SetBayesianModels(((SearchBlockJob*)Job)->Models);
+    SearchBlockJobAgainstDBs((SearchBlockJob*)Job);
+    FreeTagBuffer();
+    return NULL;
+}
+#endif
+
+// Search the blocks of one round, at the same time.  The first block is searched 
+// on the calling thread.  Returns once every block has been searched.
+void SearchBlockJobs(SearchBlockJob* Jobs, int JobCount)
+{
+    int JobIndex;
+#ifdef _WIN32
+    HANDLE Threads[MAX_SEARCH_THREADS];
+#else
+    pthread_t Threads[MAX_SEARCH_THREADS];
+#endif
+    //
+    for (JobIndex = 1; JobIndex < JobCount; JobIndex++)
+    {
+#ifdef _WIN32
+        Threads[JobIndex] = (HANDLE)_beginthreadex(NULL, 0, SearchThreadMain, Jobs + JobIndex, 0, NULL);
+#else
+        pthread_create(Threads + JobIndex, NULL, SearchThreadMain, Jobs + JobIndex);
+#endif
+    }
+    SearchBlockJobAgainstDBs(Jobs);
+    for (JobIndex = 1; JobIndex < JobCount; JobIndex++)
+    {
+#ifdef _WIN32
+        WaitForSingleObject(Threads[JobIndex], INFINITE);
+        CloseHandle(Threads[JobIndex]);
+#else
+        pthread_join(Threads[JobIndex], NULL);
+#endif
+    }
+}
+
+// Find the index files of our databases, and open the databases.  Trie databases are scanned
+// once per spectrum block, so we map them into memory once, for all blocks and search threads.
+void OpenSearchDatabases()
+{
+    DatabaseFile* DB;
+    //
     for (DB = GlobalOptions->FirstDatabase; DB; DB = DB->Next)
     {
         FindDatabaseIndexFile(DB);
     }
-    // Open database files:
     for (DB = GlobalOptions->FirstDatabase; DB; DB = DB->Next)
     {
         if (!DB->DBFile)
@@ -1104,26 +1178,191 @@ void RunSearch()
         {
             DB->IndexFile = fopen(DB->IndexFileName, "rb");
         }
+        if (DB->Type == evDBTypeTrie && !DB->MappedData)
+        {
+            MapDatabaseFile(DB);
+        }
+        if (GlobalOptions->MassIndexFlag && !DB->PrefixMasses && !(GlobalOptions->RunMode & (RUN_MODE_MUTATION | RUN_MODE_BLIND)))
+        {
+            BuildDatabaseMassIndex(DB);
+        }
+    }
+}
+
+void CloseSearchDatabases()
+{
+    DatabaseFile* DB;
+    //
+    for (DB = GlobalOptions->FirstDatabase; DB; DB = DB->Next)
+    {
+        FreeDatabaseMassIndex(DB);
+        UnmapDatabaseFile(DB);
+        if (DB->DBFile)
+        {
+            fclose(DB->DBFile);
+            DB->DBFile = NULL;
+        }
+        if (DB->IndexFile)
+        {
+            fclose(DB->IndexFile);
+            DB->IndexFile = NULL;
+        }
     }
+}
+
+// Search one block of (loaded) spectra against all our databases, on the calling thread.
+// For callers that manage their own spectra, such as PyInspect.  Returns the number of spectra searched.
+int SearchSpectrumBlock(SpectrumNode* FirstBlockSpectrum, SpectrumNode* LastBlockSpectrum)
+{
+    SearchBlockJob Job;
+    DatabaseFile* DB;
+    int DBCount = 0;
+    //
+    memset(&Job, 0, sizeof(SearchBlockJob));
+    for (DB = GlobalOptions->FirstDatabase; DB; DB = DB->Next)
+    {
+        DBCount++;
+    }
+    Job.DBFiles = (FILE**)calloc(max(1, DBCount), sizeof(FILE*));
+    DBCount = 0;
+    for (DB = GlobalOptions->FirstDatabase; DB; DB = DB->Next)
+    {
+        Job.DBFiles[DBCount++] = DB->DBFile;
+    }
+    Job.FirstBlockSpectrum = FirstBlockSpectrum;
+    Job.LastBlockSpectrum = LastBlockSpectrum;
+    SearchBlockJobAgainstDBs(&Job);
+    SafeFree(Job.DBFiles);
+    return Job.SpectraSearched;
+}
 
+// Decide how many spectrum blocks to search at once.  Only the standard tag-based search 
+// of .trie databases keeps its scratch state per-thread; other search modes use one thread.
+int GetSearchThreadCount()
+{
+    DatabaseFile* DB;
+    int ThreadCount;
+    //
+    ThreadCount = min(MAX_SEARCH_THREADS, max(1, GlobalOptions->ThreadCount));
+    if (ThreadCount == 1)
+    {
+        return 1;
+    }
+    if (GlobalOptions->ExternalTagger || (GlobalOptions->RunMode & (RUN_MODE_MUTATION | RUN_MODE_BLIND | RUN_MODE_BLINDTAG | RUN_MODE_TAGS_ONLY)))
+    {
+        printf("Note: This search mode runs on one thread only.\n");
+        return 1;
+    }
+    for (DB = GlobalOptions->FirstDatabase; DB; DB = DB->Next)
+    {
+        if (DB->Type != evDBTypeTrie)
+        {
+            printf("Note: Database '%s' can only be searched on one thread.\n", DB->FileName);
+            return 1;
+        }
+    }
+    return ThreadCount;
+}
+
+// Estimate the memory (in bytes) that searching a spectrum takes: its peaks, the tags
+// generated for each of its parent mass tweaks, and its list of stored matches.  (The trie
+// nodes are shared between spectra, and there are only so many of them.)
+size_t EstimateSpectrumSearchMemory(MSSpectrum* Spectrum)
+{
+    size_t Bytes;
+    //
+    Bytes = sizeof(MSSpectrum) + Spectrum->PeakCount * sizeof(SpectralPeak);
+    Bytes += TWEAK_COUNT * GlobalOptions->GenerateTagCount * (sizeof(TrieTag) + sizeof(TrieTagHanger));
+    Bytes += GlobalOptions->StoreMatchCount * sizeof(Peptide);
+    return Bytes;
+}
+
+// Search all our SpectrumNodes, one block at a time.  With several threads, each round 
+// loads one block per thread and searches them at once; matches are still written out 
+// in spectrum order once the round is done.  If GlobalOptions->TrieMemory is set, each 
+// round instead loads as many spectra as fit in that budget, so that large spectrum sets 
+// are searched in few passes over the database.
+// Once the search is complete, compute p-values and output search results.
+void RunSearch() 
+{
+    int BlockSize;
+    SpectrumNode* FirstBlockSpectrum;
+    SpectrumNode* LastBlockSpectrum;
+    SpectrumNode* BlockSpectrum;
+    FILE* SpectrumFile;
+    int Result;
+    TrieNode* Root = NULL;
+    int SpectraSearched = 0;
+    int ThisBlockSpectraSearched;
+    DatabaseFile* DB;
+    int DBCount = 0;
+    int DBIndex;
+    int ThreadCount;
+    int JobCount;
+    int JobIndex;
+    int JobSize;
+    int JobSpectrumCount;
+    int ModelIndex;
+    size_t BlockMemory;
+    size_t MemoryBudget = 0;
+    SearchBlockJob Jobs[MAX_SEARCH_THREADS];
+
+    OpenSearchDatabases();
     if (GlobalOptions->RunMode & (RUN_MODE_MUTATION | RUN_MODE_BLIND))
     {
         GlobalOptions->TrieBlockSize = 5;  
         GlobalOptions->StoreMatchCount = 100; 
         GlobalOptions->ReportMatchCount = 10; // in production report at MOST 20 even in blind mode
     }
+    else if (GlobalOptions->TrieMemory)
+    {
+        MemoryBudget = (size_t)GlobalOptions->TrieMemory * 1024 * 1024;
+    }
     BuildDecorations();
 
+    // Each search thread gets its own handles on the databases, and its own copies of
+    // the (small) Bayesian scoring models:
+    ThreadCount = GetSearchThreadCount();
+    for (DB = GlobalOptions->FirstDatabase; DB; DB = DB->Next)
+    {
+        DBCount++;
+    }
+    for (JobIndex = 0; JobIndex < ThreadCount; JobIndex++)
+    {
+        Jobs[JobIndex].DBFiles = (FILE**)calloc(max(1, DBCount), sizeof(FILE*));
+        DBIndex = 0;
+        for (DB = GlobalOptions->FirstDatabase; DB; DB = DB->Next)
+        {
+            Jobs[JobIndex].DBFiles[DBIndex] = JobIndex ? fopen(DB->FileName, "rb") : DB->DBFile;
+            DBIndex++;
+        }
+        if (JobIndex)
+        {
+            CopyBayesianModels(Jobs[JobIndex].Models);
+        }
+    }
+    if (ThreadCount > 1)
+    {
+        printf("Searching %d spectrum blocks at a time.\n", ThreadCount);
+        LoadTweakModels();
+    }
+
     FirstBlockSpectrum = GlobalOptions->FirstSpectrum;
     while (FirstBlockSpectrum)
     {
         fflush(stdout);
 
-        // Load one block of spectrum objects:
+        // Load one round of spectrum objects (one block per thread), either TrieBlockSize
+        // spectra per block or enough spectra to fill the memory budget:
         BlockSize = 0;
+        BlockMemory = 0;
         LastBlockSpectrum = FirstBlockSpectrum;
-        for (BlockSize = 0; BlockSize < GlobalOptions->TrieBlockSize; BlockSize++)
+        for (BlockSize = 0; BlockSize < GlobalOptions->TrieBlockSize * ThreadCount || MemoryBudget; BlockSize++)
         {
+            if (MemoryBudget && BlockMemory >= MemoryBudget && BlockSize >= ThreadCount)
+            {
+                break;
+            }
             fflush(stdout);
     
             SpectrumFile = fopen(LastBlockSpectrum->InputFile->FileName, "rb");
@@ -1140,6 +1379,10 @@ void RunSearch()
                     SafeFree(LastBlockSpectrum->Spectrum);
                     LastBlockSpectrum->Spectrum = NULL;
                 }
+                else
+                {
+                    BlockMemory += EstimateSpectrumSearchMemory(LastBlockSpectrum->Spectrum);
+                }
             }
             LastBlockSpectrum = LastBlockSpectrum->Next;
             if (!LastBlockSpectrum)
@@ -1148,18 +1391,33 @@ void RunSearch()
                 break;
             }
         }
-        printf("Search block of %d spectra starting with %s:%d\n", BlockSize, FirstBlockSpectrum->InputFile->FileName, FirstBlockSpectrum->ScanNumber);
+        // Split the round into blocks of (nearly) equal size:
+        JobSize = (BlockSize + ThreadCount - 1) / ThreadCount;
+        JobCount = 0;
+        BlockSpectrum = FirstBlockSpectrum;
+        while (BlockSpectrum != LastBlockSpectrum)
+        {
+            Jobs[JobCount].FirstBlockSpectrum = BlockSpectrum;
+            for (JobSpectrumCount = 0; JobSpectrumCount < JobSize && BlockSpectrum != LastBlockSpectrum; JobSpectrumCount++)
+            {
+                BlockSpectrum = BlockSpectrum->Next;
+            }
+            Jobs[JobCount].LastBlockSpectrum = BlockSpectrum;
+            printf("Search block of %d spectra starting with %s:%d\n", JobSpectrumCount, Jobs[JobCount].FirstBlockSpectrum->InputFile->FileName, Jobs[JobCount].FirstBlockSpectrum->ScanNumber);
+            JobCount++;
+        }
         fflush(stdout);
+        SearchBlockJobs(Jobs, JobCount);
         ThisBlockSpectraSearched = 0;
-        for (DB = GlobalOptions->FirstDatabase; DB; DB = DB->Next)
+        for (JobIndex = 0; JobIndex < JobCount; JobIndex++)
         {
-            ThisBlockSpectraSearched = SearchSpectrumBlockAgainstDB(FirstBlockSpectrum, LastBlockSpectrum, DB);
+            ThisBlockSpectraSearched += Jobs[JobIndex].SpectraSearched;
         }
         SpectraSearched += ThisBlockSpectraSearched;
         printf("Search progress: %d / %d (%.2f%%)\n", SpectraSearched, GlobalOptions->SpectrumCount, 100 * SpectraSearched / (float)max(1, GlobalOptions->SpectrumCount));
         fflush(stdout);
 
-        // Clean up this block, and move to the next:
+        // Write out this round's matches in spectrum order, clean up, and move to the next:
         fflush(stdout);
         for (BlockSpectrum = FirstBlockSpectrum; BlockSpectrum != LastBlockSpectrum; BlockSpectrum = BlockSpectrum->Next)
         {
@@ -1193,20 +1451,23 @@ void RunSearch()
         CalculatePValues(GlobalOptions->OutputFileName, GlobalOptions->FinalOutputFileName);
     }
 
-    // Close database files:
-    for (DB = GlobalOptions->FirstDatabase; DB; DB = DB->Next)
+    // Close the extra threads' database handles and free their models, then close the database files:
+    for (JobIndex = 0; JobIndex < ThreadCount; JobIndex++)
     {
-        if (DB->DBFile)
+        for (DBIndex = 0; DBIndex < DBCount; DBIndex++)
         {
-            fclose(DB->DBFile);
-            DB->DBFile = NULL;
+            if (JobIndex && Jobs[JobIndex].DBFiles[DBIndex])
+            {
+                fclose(Jobs[JobIndex].DBFiles[DBIndex]);
+            }
         }
-        if (DB->IndexFile)
+        SafeFree(Jobs[JobIndex].DBFiles);
+        for (ModelIndex = 0; JobIndex && ModelIndex < BAYESIAN_MODEL_COUNT; ModelIndex++)
         {
-            fclose(DB->IndexFile);
-            DB->IndexFile = NULL;
+            FreePRMBayesianModel(Jobs[JobIndex].Models[ModelIndex]);
         }
     }
+    CloseSearchDatabases();
 }
 
 // Special run mode: Perform parent mass correction on our input spectra.  Output the
@@ -30,7 +30,13 @@
 #ifndef RUN_H
 #define RUN_H
 
+// Upper limit for the -threads option:
+#define MAX_SEARCH_THREADS 64
+
 void RunSearch();
+void OpenSearchDatabases();
+void CloseSearchDatabases();
+int SearchSpectrumBlock(SpectrumNode* FirstBlockSpectrum, SpectrumNode* LastBlockSpectrum);
 void PerformSpectrumTweakage();
 void PerformTagGeneration();
 
@@ -53,7 +53,7 @@
 float LDAClassify(float* Features);
 
 // Global variables:
-extern PRMBayesianModel* PRMModelCharge2;
+extern THREAD_LOCAL PRMBayesianModel* PRMModelCharge2;
 
 SVMModel* PValueSVM = NULL;
 float g_SVMToPValueMin;
@@ -68,13 +68,13 @@ SVMModel* MQModel3SVM = NULL;
 
 
 //SVMModel* PValueSVM = NULL;
-extern float g_CutScores[];
-extern float g_BAbsSkew[];
-extern float g_YAbsSkew[];
-extern float g_BSkew[];
-extern float g_YSkew[];
-extern float g_BIntensity[];
-extern float g_YIntensity[];
+extern THREAD_LOCAL float g_CutScores[];
+extern THREAD_LOCAL float g_BAbsSkew[];
+extern THREAD_LOCAL float g_YAbsSkew[];
+extern THREAD_LOCAL float g_BSkew[];
+extern THREAD_LOCAL float g_YSkew[];
+extern THREAD_LOCAL float g_BIntensity[];
+extern THREAD_LOCAL float g_YIntensity[];
 
 float GetPValue(float MQScore) 
 {
@@ -47,13 +47,13 @@
 #define MAX_PEPTIDE_LENGTH 256
 #define INTENSITY_LEVEL_COUNT 4
 
-int g_CutFeatures[MAX_PEPTIDE_LENGTH * CUT_FEATURE_COUNT];
-float g_VerboseCutFeatures[MAX_PEPTIDE_LENGTH * CUT_FEATURE_COUNT];
-int g_PRMFeatures[PRM_FEATURE_COUNT];
+THREAD_LOCAL int g_CutFeatures[MAX_PEPTIDE_LENGTH * CUT_FEATURE_COUNT];
+THREAD_LOCAL float g_VerboseCutFeatures[MAX_PEPTIDE_LENGTH * CUT_FEATURE_COUNT];
+THREAD_LOCAL int g_PRMFeatures[PRM_FEATURE_COUNT];
 //float g_PRMBScore; // hax
 //float g_PRMYScore; // hax
-float g_CutScores[MAX_PEPTIDE_LENGTH];
-extern PRMBayesianModel* PRMModelCharge2;
+THREAD_LOCAL float g_CutScores[MAX_PEPTIDE_LENGTH];
+extern THREAD_LOCAL PRMBayesianModel* PRMModelCharge2;
 
 int SeizePeaks(MSSpectrum* Spectrum, int TargetMass, int IonType, int AminoIndex, float* pIntensity, float* pSkew, float* pAbsSkew);
 
@@ -525,12 +525,12 @@ float GetPRMFeatures(MSSpectrum* Spectrum, SpectrumTweak* Tweak, BayesianModel*
     return Score;
 }
 
-float g_BIntensity[MAX_PEPTIDE_LENGTH];
-float g_YIntensity[MAX_PEPTIDE_LENGTH];
-float g_BSkew[MAX_PEPTIDE_LENGTH];
-float g_YSkew[MAX_PEPTIDE_LENGTH];
-float g_BAbsSkew[MAX_PEPTIDE_LENGTH];
-float g_YAbsSkew[MAX_PEPTIDE_LENGTH];
+THREAD_LOCAL float g_BIntensity[MAX_PEPTIDE_LENGTH];
+THREAD_LOCAL float g_YIntensity[MAX_PEPTIDE_LENGTH];
+THREAD_LOCAL float g_BSkew[MAX_PEPTIDE_LENGTH];
+THREAD_LOCAL float g_YSkew[MAX_PEPTIDE_LENGTH];
+THREAD_LOCAL float g_BAbsSkew[MAX_PEPTIDE_LENGTH];
+THREAD_LOCAL float g_YAbsSkew[MAX_PEPTIDE_LENGTH];
 
 #define FRAGMENTATION_NORMAL 0
 #define FRAGMENTATION_PHOSPHO 1
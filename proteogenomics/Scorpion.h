@@ -40,7 +40,7 @@
 
 #define CUT_FEATURE_COUNT 32
 
-extern int g_CutFeatures[];
+extern THREAD_LOCAL int g_CutFeatures[];
 
 // Features used in scoring of cut points
 typedef enum ScorpIons
@@ -8,6 +8,7 @@ import sys
 import traceback
 import struct
 import InspectResults
+import bioseq
 from Utils import *
 Initialize()
 
@@ -78,32 +79,14 @@ class ProteinSelector():
             print "*** WARNING: Peptide '%s' not found in the database."%Aminos
         return LocationList
     def LoadDB(self, DBPath):
-        DBFile = open(DBPath, "rb")
-        self.DB = DBFile.read()
-        DBFile.close()
-        IndexPath = os.path.splitext(DBPath)[0] + ".index"
-        IndexFile = open(IndexPath, "rb")
-        BlockSize = struct.calcsize("<qi80s")
-        ID = 0
-        PrevID = None
-        self.ProteinPos = []
-        while (1):
-            Block = IndexFile.read(BlockSize)
-            if not Block:
-                break
-            Info = struct.unpack("<qi80s", Block)
-            Name = Info[2]
-            NullPos = Name.find("\0")
-            if NullPos !=- 1:
-                Name = Name[:NullPos]
-            self.ProteinNames[ID]= Name
-            StartPos = Info[1]
-            self.ProteinPos.append(StartPos)
-            if PrevID != None:
-                self.ProteinSequences[PrevID] = self.DB[self.ProteinPos[PrevID]:StartPos - 1]
-            PrevID = ID
-            ID += 1
-        self.ProteinSequences[PrevID] = self.DB[self.ProteinPos[PrevID]:]
+        """ Map the DB read-only; sequences are sliced out of it on demand """
+        Reader = bioseq.TrieReader(DBPath)
+        (Names, self.ProteinPos) = Reader.readIndex()
+        self.DB = Reader.mapTrie()
+        Reader.close()
+        for (ID, Name) in enumerate(Names):
+            self.ProteinNames[ID] = Name
+        self.ProteinSequences = bioseq.TrieSeqs(self.DB, self.ProteinPos)
     def LoadMultipleDB(self, DBPathList):
         """" Given a list of DB pathnames, load all the corresponding DB """
         ID = 0
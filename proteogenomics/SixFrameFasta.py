@@ -15,6 +15,10 @@ import getopt
 import sys
 
 import bioseq
+try:
+    import numpy
+except ImportError:
+    numpy = None # frames are translated codon by codon through ProteinTranslationClass.Table
 
 class ProteinTranslationClass:
     def __init__(self):
@@ -86,6 +90,27 @@ class ProteinTranslationClass:
         self.Table["TAG"] = "*" 
         self.Table["TGA"] = "*" 
 
+    def BuildCodonArrays(self):
+        """Lookup arrays for translating with numpy.  Nucleotides are coded 0-3 for
+        A, C, G, T and 4 for anything else, so a codon is 25*First + 5*Second + Third,
+        and any codon with a 4 in it (like NNN) translates to a stop, as in Table.
+        ComplementCodes gives the code of each base's complement; as in
+        ReverseTranscribeChromosome, lower case bases are upper-cased but not complemented.
+        """
+        Bases = "ACGT"
+        self.NucleotideCodes = numpy.empty(256, numpy.uint8)
+        self.NucleotideCodes.fill(4)
+        self.ComplementCodes = self.NucleotideCodes.copy()
+        for (Code, Base) in enumerate(Bases):
+            self.NucleotideCodes[ord(Base)] = Code
+            self.ComplementCodes[ord(Base)] = 3 - Code
+            self.ComplementCodes[ord(Base.lower())] = Code
+        self.CodonAminos = numpy.empty(125, numpy.uint8)
+        self.CodonAminos.fill(ord("*"))
+        for (Codon, AminoAcid) in self.Table.items():
+            Index = 25 * Bases.index(Codon[0]) + 5 * Bases.index(Codon[1]) + Bases.index(Codon[2])
+            self.CodonAminos[Index] = ord(AminoAcid)
+
 
 class AbacusClass(ProteinTranslationClass):
     def __init__(self):
@@ -104,10 +129,66 @@ class AbacusClass(ProteinTranslationClass):
     def Main(self):
         self.OutHandle = bioseq.FastaOut( self.OutputFile )
         self.OutHandle.linesize = 100000
-        self.TranslateChromosome(self.InputFile)
-        self.ReverseTranscribeChromosome(self.InputFile)
-        self.TranslateChromosomeOnReverse(self.TempRTFileName)
+        if numpy:
+            self.TranslateSixFrames(self.InputFile)
+        else:
+            self.TranslateChromosome(self.InputFile)
+            self.ReverseTranscribeChromosome(self.InputFile)
+            self.TranslateChromosomeOnReverse(self.TempRTFileName)
         self.OutHandle.close()
+
+    def TranslateSixFrames(self, FileName):
+        """Translate all six frames in memory with numpy, rather than codon by codon, and
+        with no temporary reverse strand file.  The output is the same as
+        TranslateChromosome followed by TranslateChromosomeOnReverse.
+        """
+        Handle = open(FileName, "rb")
+        Lines = []
+        for Line in Handle.xreadlines():
+            Line = Line.strip()
+            if not Line or Line[0] == ">":
+                continue
+            Lines.append(Line)
+        Handle.close()
+        DNA = numpy.frombuffer("".join(Lines), numpy.uint8)
+        self.BuildCodonArrays()
+        self.TranslateStrandArray(self.NucleotideCodes[DNA], '+')
+        self.TranslateStrandArray(self.ComplementCodes[DNA[::-1]], '-')
+
+    def TranslateStrandArray(self, Codes, Strand):
+        """Translate the three frames of one strand, given as an array of nucleotide codes
+        (see BuildCodonArrays), and write out their ORFs.  ORFs come out in the order of
+        the codon by codon translation: each one when its frame reaches a stop codon,
+        then the ones still open at the end of the strand, by frame.
+        """
+        DNALength = len(Codes)
+        if DNALength < 3:
+            return
+        Aminos = self.CodonAminos[Codes[:-2] * 25 + Codes[1:-1] * 5 + Codes[2:]]
+        Stops = numpy.flatnonzero(Aminos == ord("*"))
+        Frames = Stops % 3
+        # The ORF ended by each stop starts just after the previous stop in its frame:
+        Starts = numpy.empty(len(Stops), Stops.dtype)
+        OpenStarts = []
+        for Frame in range(3):
+            InFrame = (Frames == Frame)
+            FrameStarts = numpy.concatenate(([Frame], Stops[InFrame] + 3))
+            Starts[InFrame] = FrameStarts[:-1]
+            OpenStarts.append(FrameStarts[-1])
+        # ...then come the ORFs still open at the end of each frame:
+        Starts = numpy.concatenate((Starts, OpenStarts))
+        Stops = numpy.concatenate((Stops, [len(Aminos)] * 3))
+        Frames = Starts % 3
+        Keep = (Stops - Starts + 2) // 3 >= self.MinProteinLength
+        FrameAminos = [Aminos[Frame::3].tostring() for Frame in range(3)]
+        for (Start, Stop, Frame) in zip(Starts[Keep].tolist(), Stops[Keep].tolist(), Frames[Keep].tolist()):
+            self.FrameStrings[Frame] = FrameAminos[Frame][Start // 3:(Stop - Frame + 2) // 3]
+            if Strand == '+':
+                self.FrameStarts[Frame] = Start + 1
+            else:
+                self.FrameStarts[Frame] = DNALength - Start
+            self.outputFrame(Strand, Frame + 1)
+        self.FrameStrings = ['','','']
         
     def ReverseTranscribeChromosome2(self, FileName):
         """Here's my attempt to do this smartly if there is a cache overload
@@ -143,6 +143,8 @@ void WindowFilterPeaks(MSSpectrum* Spectrum, float WindowWidth, int KeepCount);
 void SpectrumAssignIsotopeNeighbors(MSSpectrum* Spectrum);
 void IntensityRankPeaks();
 MSSpectrum* NewSpectrum();
+int SpectrumAddPeak(MSSpectrum* Spectrum, float Mass, float Intensity);
+void SpectrumComputeParentMass(MSSpectrum* Spectrum);
 void FreeSpectrum(MSSpectrum* Spectrum);
 int SpectrumLoadFromFile(MSSpectrum* Spectrum, FILE* DTAFile);
 void SpectrumCorrectParentMass(MSSpectrum* Spectrum);
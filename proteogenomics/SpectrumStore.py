@@ -0,0 +1,329 @@
+###############################################################################
+#                                                                             # 
+#       Copyright (c) 2009 J. Craig Venter Institute.                         #     
+#       All rights reserved.                                                  #
+#                                                                             #
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+#                                                                             #
+###############################################################################
+
+
+"""
+SpectrumStore.py
+Per-file scan index (scan number -> byte offset, length, msLevel, precursor
+m/z, charge, peak count) for .mzXML and .mgf files, and a store that keeps
+spectrum files memory mapped and recently decoded spectra in memory, so that
+spectra can be read by byte offset or scan number without reopening and
+reparsing the file each time.
+
+The index of Foo.mzXML is written next to it, as Foo.mzXML.scanidx.  Scan
+numbers are the mzXML scan num attributes, and for .mgf files the ordinal
+of the spectrum in the file (as in CountScans and Inspect results).
+"""
+import os
+import re
+import mmap
+import MSSpectrum
+from collections import OrderedDict
+
+SCAN_INDEX_EXTENSION = ".scanidx"
+SCAN_INDEX_VERSION = 1
+
+MEG = 1024 * 1024
+
+class ScanIndexEntry:
+    "Where one scan is in its spectrum file, and a summary of its header"
+    Fields = ("ScanNumber", "ByteOffset", "Length", "MSLevel", "PrecursorMZ",
+              "Charge", "PeakCount")
+    def __init__(self, ScanNumber, ByteOffset, Length, MSLevel = 2,
+                 PrecursorMZ = 0.0, Charge = 0, PeakCount = 0):
+        self.ScanNumber = ScanNumber
+        self.ByteOffset = ByteOffset
+        self.Length = Length
+        self.MSLevel = MSLevel
+        self.PrecursorMZ = PrecursorMZ
+        self.Charge = Charge
+        self.PeakCount = PeakCount
+    def __str__(self):
+        return "\t".join([str(getattr(self, Field)) for Field in self.Fields])
+
+ScanStartPattern = re.compile(r"<scan\s")
+ScanNumPattern = re.compile(r'\snum\s*=\s*"(\d+)"')
+MSLevelPattern = re.compile(r'\smsLevel\s*=\s*"(\d+)"')
+PeaksCountPattern = re.compile(r'\speaksCount\s*=\s*"(\d+)"')
+PrecursorPattern = re.compile(r"<precursorMz([^>]*)>\s*([^<\s]+)\s*</precursorMz>")
+PrecursorChargePattern = re.compile(r'precursorCharge\s*=\s*"(\d+)"')
+
+def ParseMZXMLScan(Text, ByteOffset):
+    "Returns the ScanIndexEntry for the text of one <scan> element"
+    Tag = Text[:Text.find(">")]
+    Entry = ScanIndexEntry(int(ScanNumPattern.search(Tag).group(1)), ByteOffset, len(Text))
+    Match = MSLevelPattern.search(Tag)
+    if Match:
+        Entry.MSLevel = int(Match.group(1))
+    Match = PeaksCountPattern.search(Tag)
+    if Match:
+        Entry.PeakCount = int(Match.group(1))
+    Match = PrecursorPattern.search(Text)
+    if Match:
+        Entry.PrecursorMZ = float(Match.group(2))
+        ChargeMatch = PrecursorChargePattern.search(Match.group(1))
+        if ChargeMatch:
+            Entry.Charge = int(ChargeMatch.group(1))
+    return Entry
+
+def BuildScanIndexMZXML(FilePath):
+    """Scan an .mzXML file a block at a time for <scan> elements.  A scan
+    runs up to the start of the next one (so an MS1 scan stops where the
+    first MS2 scan nested in it begins), the last one up to </msRun>.
+    """
+    Entries = []
+    File = open(FilePath, "rb")
+    Text = ""
+    TextOffset = 0 # file offset of Text[0]
+    ScanPos = None # position in Text of the scan being read
+    while 1:
+        Block = File.read(MEG)
+        Text += Block
+        while 1:
+            if ScanPos == None:
+                Match = ScanStartPattern.search(Text)
+                if not Match:
+                    break
+                ScanPos = Match.start()
+            Match = ScanStartPattern.search(Text, ScanPos + 1)
+            if Match:
+                Entries.append(ParseMZXMLScan(Text[ScanPos:Match.start()], TextOffset + ScanPos))
+                ScanPos = Match.start()
+                continue
+            if not Block:
+                End = Text.find("</msRun>", ScanPos)
+                if End == -1:
+                    End = len(Text)
+                Entries.append(ParseMZXMLScan(Text[ScanPos:End], TextOffset + ScanPos))
+                ScanPos = None
+            break
+        if not Block:
+            break
+        # Keep the scan being read, or a tail that may hold part of a tag:
+        if ScanPos == None:
+            Keep = max(0, len(Text) - 10)
+        else:
+            Keep = ScanPos
+            ScanPos = 0
+        Text = Text[Keep:]
+        TextOffset += Keep
+    File.close()
+    return Entries
+
+def BuildScanIndexMGF(FilePath):
+    "Index the BEGIN IONS..END IONS blocks of an .mgf file"
+    Entries = []
+    File = open(FilePath, "rb")
+    Offset = 0
+    Entry = None
+    for FileLine in File:
+        if FileLine[:10] == "BEGIN IONS":
+            Entry = ScanIndexEntry(len(Entries), Offset, 0)
+        elif Entry:
+            if FileLine[:8] == "END IONS":
+                Entry.Length = Offset + len(FileLine) - Entry.ByteOffset
+                Entries.append(Entry)
+                Entry = None
+            elif FileLine[:7] == "PEPMASS":
+                Entry.PrecursorMZ = float(FileLine[8:].split()[0])
+            elif FileLine[:6] == "CHARGE":
+                try:
+                    Entry.Charge = int(FileLine[7:].strip().split()[0].replace("+", ""))
+                except ValueError:
+                    pass # "2+ and 3+"
+            elif FileLine[:1].isdigit():
+                Entry.PeakCount += 1
+        Offset += len(FileLine)
+    File.close()
+    return Entries
+
+def BuildScanIndex(FilePath):
+    "List of ScanIndexEntry for an .mzXML or .mgf file; None for other files."
+    Extension = os.path.splitext(FilePath)[1].lower()
+    if Extension == ".mzxml":
+        return BuildScanIndexMZXML(FilePath)
+    if Extension == ".mgf":
+        return BuildScanIndexMGF(FilePath)
+    return None
+
+def ScanIndexPath(FilePath):
+    return FilePath + SCAN_INDEX_EXTENSION
+
+def SaveScanIndex(FilePath, Entries):
+    """Write the index of FilePath next to it.  The size and time stamp of the
+    spectrum file are recorded, so that a stale index is not used."""
+    Stat = os.stat(FilePath)
+    IndexPath = ScanIndexPath(FilePath)
+    File = open(IndexPath + ".tmp", "wb")
+    File.write("#ScanIndex\t%s\t%s\t%s\n"%(SCAN_INDEX_VERSION, Stat.st_size, int(Stat.st_mtime)))
+    File.write("#%s\n"%"\t".join(ScanIndexEntry.Fields))
+    for Entry in Entries:
+        File.write("%s\n"%Entry)
+    File.close()
+    os.rename(IndexPath + ".tmp", IndexPath)
+
+def LoadScanIndex(FilePath):
+    "The saved index of FilePath, or None if there is none or it is stale."
+    IndexPath = ScanIndexPath(FilePath)
+    if not os.path.exists(IndexPath):
+        return None
+    Stat = os.stat(FilePath)
+    File = open(IndexPath, "rb")
+    Bits = File.readline().rstrip("\n").split("\t")
+    if len(Bits) < 4 or Bits[0] != "#ScanIndex" or int(Bits[1]) != SCAN_INDEX_VERSION \
+       or int(Bits[2]) != Stat.st_size or int(Bits[3]) != int(Stat.st_mtime):
+        File.close()
+        return None
+    Entries = []
+    for FileLine in File:
+        if FileLine[0] == "#":
+            continue
+        Bits = FileLine.split("\t")
+        Entries.append(ScanIndexEntry(int(Bits[0]), int(Bits[1]), int(Bits[2]),
+                       int(Bits[3]), float(Bits[4]), int(Bits[5]), int(Bits[6])))
+    File.close()
+    return Entries
+
+def GetScanIndex(FilePath, Save = 0):
+    """The index of FilePath: the saved one if it is current, else a new one
+    (saved next to the file if Save is set)."""
+    Entries = LoadScanIndex(FilePath)
+    if Entries == None:
+        Entries = BuildScanIndex(FilePath)
+        if Save and Entries != None:
+            SaveScanIndex(FilePath, Entries)
+    return Entries
+
+class MappedSpectrumFile:
+    """A read-only file object over a memory mapped spectrum file, starting at
+    a byte offset.  Many can share one mapping; close() leaves it open."""
+    def __init__(self, Map, Pos = 0):
+        self.Map = Map
+        self.Pos = Pos
+    def read(self, Size = -1):
+        if Size < 0:
+            End = len(self.Map)
+        else:
+            End = min(len(self.Map), self.Pos + Size)
+        Text = self.Map[self.Pos:End]
+        self.Pos = End
+        return Text
+    def readline(self):
+        End = self.Map.find("\n", self.Pos)
+        if End == -1:
+            End = len(self.Map)
+        else:
+            End += 1
+        Text = self.Map[self.Pos:End]
+        self.Pos = End
+        return Text
+    def __iter__(self):
+        while 1:
+            FileLine = self.readline()
+            if not FileLine:
+                return
+            yield FileLine
+    def xreadlines(self):
+        return iter(self)
+    def seek(self, Pos, Whence = 0):
+        if Whence == 1:
+            Pos += self.Pos
+        elif Whence == 2:
+            Pos += len(self.Map)
+        self.Pos = Pos
+    def tell(self):
+        return self.Pos
+    def close(self):
+        pass
+
+def CopySpectrum(Spectrum):
+    "A new SpectrumClass with the same header and its own copy of the peaks"
+    Copy = MSSpectrum.SpectrumClass()
+    Copy.__dict__.update(Spectrum.__dict__)
+    if Spectrum.PeakMasses is not None:
+        # Peak arrays are never changed in place, so they can be shared:
+        Copy.SetPeakArrays(Spectrum.PeakMasses, Spectrum.PeakIntensities)
+        Copy.PeakIntensityRanks = Spectrum.PeakIntensityRanks
+    else:
+        Copy.Peaks = [MSSpectrum.PeakClass(Peak.Mass, Peak.Intensity) for Peak in Spectrum.Peaks]
+    return Copy
+
+class SpectrumStore:
+    """
+    Reads spectra by (file, byte offset) or (file, scan number).  Files stay
+    mapped (up to MaxOpenFiles of them) and the last CacheSize spectra read
+    are kept decoded.  Each call returns a fresh SpectrumClass, so callers
+    can change it (SetCharge, filtering) without touching the cached one.
+    """
+    def __init__(self, CacheSize = 1000, MaxOpenFiles = 16):
+        self.CacheSize = CacheSize
+        self.MaxOpenFiles = MaxOpenFiles
+        self.Spectra = OrderedDict() # (path, byte offset) -> SpectrumClass
+        self.Maps = OrderedDict() # path -> (file, mmap)
+        self.Indexes = {} # path -> scan number -> ScanIndexEntry
+        self.Hits = 0
+        self.Misses = 0
+    def GetMap(self, FilePath):
+        if self.Maps.has_key(FilePath):
+            Entry = self.Maps.pop(FilePath)
+        else:
+            File = open(FilePath, "rb")
+            Entry = (File, mmap.mmap(File.fileno(), 0, access = mmap.ACCESS_READ))
+            while len(self.Maps) >= self.MaxOpenFiles:
+                (OldFile, OldMap) = self.Maps.popitem(last = False)[1]
+                OldMap.close()
+                OldFile.close()
+        self.Maps[FilePath] = Entry
+        return Entry[1]
+    def GetScanIndex(self, FilePath):
+        "Dictionary scan number -> ScanIndexEntry for FilePath"
+        if not self.Indexes.has_key(FilePath):
+            Entries = GetScanIndex(FilePath) or []
+            self.Indexes[FilePath] = dict([(Entry.ScanNumber, Entry) for Entry in Entries])
+        return self.Indexes[FilePath]
+    def GetSpectrum(self, FilePath, ByteOffset):
+        Key = (FilePath, ByteOffset)
+        Spectrum = self.Spectra.pop(Key, None)
+        if Spectrum:
+            self.Hits += 1
+        else:
+            self.Misses += 1
+            Spectrum = MSSpectrum.SpectrumClass()
+            Spectrum.ReadPeaksFromFile(MappedSpectrumFile(self.GetMap(FilePath), ByteOffset), FilePath)
+            Spectrum.FilePath = FilePath
+            Spectrum.FilePos = ByteOffset
+            if len(self.Spectra) >= self.CacheSize:
+                self.Spectra.popitem(last = False)
+        self.Spectra[Key] = Spectrum
+        return CopySpectrum(Spectrum)
+    def GetSpectrumByScan(self, FilePath, ScanNumber):
+        "The spectrum with this scan number, or None if it's not in the file"
+        Entry = self.GetScanIndex(FilePath).get(ScanNumber, None)
+        if not Entry:
+            return None
+        return self.GetSpectrum(FilePath, Entry.ByteOffset)
+    def close(self):
+        for (File, Map) in self.Maps.values():
+            Map.close()
+            File.close()
+        self.Maps.clear()
+        self.Spectra.clear()
@@ -1913,7 +1913,7 @@ void SearchSplicableGenes(SearchInfo* Info)
     //
     AllocSpliceStructures();
 
-    File = Info->DB->DBFile;
+    File = Info->DBFile;
     if (!File)
     {
         printf("** Erorr: Unable to open gene database '%s'.  No search performed.\n", Info->DB->FileName);
@@ -893,7 +893,15 @@ void SetTagSkewScores()
     fclose(TagSkewFile);
 }
 
-static TrieTag* AllTags = NULL;
+static THREAD_LOCAL TrieTag* AllTags = NULL;
+
+// Free this thread's tag buffer.  (Search threads call this on their way out)
+void FreeTagBuffer()
+{
+    SafeFree(AllTags);
+    AllTags = NULL;
+}
+
 //// New tag generation function: Generates tags of a (more-or-less) arbitrary length!
 //TrieTag* TagGraphGenerateTagsOld(TagGraph* Graph, MSSpectrum* Spectrum, int* TagCount, 
 //    int MaximumTagCount, SpectrumTweak* Tweak, float TagEdgeScoreMultiplier)
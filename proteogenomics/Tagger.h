@@ -192,5 +192,6 @@ int CompareTagScores(const TrieTag* TagA, const TrieTag* TagB);
 TrieNode* BuildTrieFromTags(TrieTag* AllTags, int TagCount, TrieNode* Root, int MaximumTagCount);
 void SetTagSkewScores();
 void FreeTagSkewScores();
+void FreeTagBuffer();
 // declaration of TagGraphGenerateTags moved out, since it uses PRMBayesianModel
 #endif // TAGGER_H
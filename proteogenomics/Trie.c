@@ -166,6 +166,7 @@ void InitOptions()
     GlobalOptions->DynamicRangeMin = 105 * DALTON; 
     GlobalOptions->DynamicRangeMax = 2000 * DALTON; 
     GlobalOptions->TrieBlockSize = 100;
+    GlobalOptions->ThreadCount = 1;
     GlobalOptions->TagPTMMode = 2;
     strcpy(GlobalOptions->AminoFileName, FILENAME_AMINO_ACID_MASSES);
     sprintf(GlobalOptions->InputFileName, "Input.txt");
@@ -924,16 +925,124 @@ int CheckForPTAttachmentPoints(int DecorationMassIndex, char* Buffer, int Start,
 // (For instance: The preceding aminos may match with no PTMs, or we may be able to match
 // with one fewer amino and a PTM)
 #define MAX_SIDE_MODS 10
-int LeftMatchPos[MAX_SIDE_MODS];
-int LeftMatchDecoration[MAX_SIDE_MODS];
-int RightMatchPos[MAX_SIDE_MODS];
-int RightMatchDecoration[MAX_SIDE_MODS];
+THREAD_LOCAL int LeftMatchPos[MAX_SIDE_MODS];
+THREAD_LOCAL int LeftMatchDecoration[MAX_SIDE_MODS];
+THREAD_LOCAL int RightMatchPos[MAX_SIDE_MODS];
+THREAD_LOCAL int RightMatchDecoration[MAX_SIDE_MODS];
+
+// In a database mass index, residues which can't be part of a peptide (record boundaries and
+// unknown characters) add this much mass, more than any flanking mass we look for.  Searching the
+// index for a flanking mass therefore always stops at such a residue.
+#define MASS_INDEX_STOP_MASS (1 << 24)
+
+// Index masses are unsigned and wrap around; differences are exact for spans of up to this many residues:
+#define MASS_INDEX_MAX_SPAN 200
+
+// The lightest residue in the mass index:
+int MassIndexMinResidueMass = MASS_INDEX_STOP_MASS;
+
+// Build DB->PrefixMasses for a memory-mapped database.  Entry i is the total mass of the
+// residues before position i, so the mass of any stretch of residues is a difference of
+// two entries.  Residue masses include fixed modifications, so we build the index when a
+// search starts (once, for all spectrum blocks) rather than when the database is prepared.
+int BuildDatabaseMassIndex(DatabaseFile* DB)
+{
+    unsigned int* PrefixMasses;
+    int Pos;
+    int Mass;
+    int Amino;
+    //
+    if (!DB->MappedData)
+    {
+        return 0;
+    }
+    PrefixMasses = (unsigned int*)malloc(sizeof(unsigned int) * (DB->MappedSize + 1));
+    if (!PrefixMasses)
+    {
+        REPORT_ERROR_I(49, sizeof(unsigned int) * (DB->MappedSize + 1));
+        return 0;
+    }
+    for (Amino = 0; Amino < 256; Amino++)
+    {
+        if (Amino != '>' && Amino != '*' && PeptideMass[Amino] > 0)
+        {
+            MassIndexMinResidueMass = min(MassIndexMinResidueMass, PeptideMass[Amino]);
+        }
+    }
+    PrefixMasses[0] = 0;
+    for (Pos = 0; Pos < DB->MappedSize; Pos++)
+    {
+        Amino = DB->MappedData[Pos];
+        Mass = 0;
+        if (Amino >= 0 && Amino != '>' && Amino != '*')
+        {
+            Mass = PeptideMass[Amino];
+        }
+        PrefixMasses[Pos + 1] = PrefixMasses[Pos] + (Mass > 0 ? Mass : MASS_INDEX_STOP_MASS);
+    }
+    DB->PrefixMasses = PrefixMasses;
+    return 1;
+}
+
+void FreeDatabaseMassIndex(DatabaseFile* DB)
+{
+    SafeFree(DB->PrefixMasses);
+    DB->PrefixMasses = NULL;
+}
+
+// The mass of the Length residues starting at StartPos and moving in direction BufferDir:
+#define INDEXED_FLANKING_MASS(PrefixMasses, StartPos, BufferDir, Length) \
+    ((BufferDir) > 0 ? (PrefixMasses)[(StartPos) + (Length)] - (PrefixMasses)[StartPos] : \
+    (PrefixMasses)[(StartPos) + 1] - (PrefixMasses)[(StartPos) + 1 - (Length)])
+
+// Helper for MatchFlankingMass: Moving from Pos away from StartPos, find the first position where
+// the flanking mass (of the residues from StartPos through that position) exceeds MinFlankingMass.
+// Returns -1 if the buffer ends first.  If the answer is too far away to look up safely, returns
+// Pos, and the caller just takes one step.
+int SkipToFlankingMass(unsigned int* PrefixMasses, int StartPos, int Pos, int BufferDir, int BufferEnd, int MinFlankingMass)
+{
+    int Low;
+    int High;
+    int Mid;
+    //
+    if (MinFlankingMass < 0 || MinFlankingMass >= MASS_INDEX_STOP_MASS)
+    {
+        return Pos;
+    }
+    // Low and High are lengths of flanking sequence.  Any flanking sequence of length High is
+    // heavier than MinFlankingMass, unless the buffer runs out first:
+    High = MinFlankingMass / MassIndexMinResidueMass + 1;
+    if (High > MASS_INDEX_MAX_SPAN)
+    {
+        return Pos;
+    }
+    High = min(High, BufferDir > 0 ? BufferEnd - StartPos : StartPos + 1);
+    Low = (Pos - StartPos) * BufferDir + 1;
+    if (Low > High || INDEXED_FLANKING_MASS(PrefixMasses, StartPos, BufferDir, High) <= (unsigned int)MinFlankingMass)
+    {
+        return -1;
+    }
+    while (Low < High)
+    {
+        Mid = (Low + High) / 2;
+        if (INDEXED_FLANKING_MASS(PrefixMasses, StartPos, BufferDir, Mid) > (unsigned int)MinFlankingMass)
+        {
+            High = Mid;
+        }
+        else
+        {
+            Low = Mid + 1;
+        }
+    }
+    return StartPos + BufferDir * (Low - 1);
+}
 
 // MatchFlankingMass is called when we matched a trie tag, and we are checking whether the
 // flanking amino acids match our prefix or suffix mass.
 // WARNING: If there are two or more decorations with the same mass, this method will FAIL, because we'll only
 // consider ONE such decoration.
-int MatchFlankingMass(MSSpectrum* Spectrum, TrieTag* Tag, char* Buffer, int StartPos, int BufferDir, int BufferEnd, int MatchMass, int ModsRemaining)
+// If PrefixMasses is set (it indexes Buffer), we skip over residues where nothing can match.
+int MatchFlankingMass(MSSpectrum* Spectrum, TrieTag* Tag, char* Buffer, unsigned int* PrefixMasses, int StartPos, int BufferDir, int BufferEnd, int MatchMass, int ModsRemaining)
 {
     int MatchCount = 0;
     int Pos;
@@ -981,6 +1090,16 @@ int MatchFlankingMass(MSSpectrum* Spectrum, TrieTag* Tag, char* Buffer, int Star
     FlankingMass = 0;
     for (Pos = StartPos; Pos >= 0; Pos += BufferDir)
     {
+        if (PrefixMasses)
+        {
+            // Until the flanking mass reaches our current decoration, there's nothing to check,
+            // so jump straight there:
+            Pos = SkipToFlankingMass(PrefixMasses, StartPos, Pos, BufferDir, BufferEnd, MinMatchMass - AllDecorations[DecorationMassIndex].Mass);
+            if (Pos < 0)
+            {
+                break;
+            }
+        }
         if (Pos >= BufferEnd)
         {
             break;
@@ -995,7 +1114,14 @@ int MatchFlankingMass(MSSpectrum* Spectrum, TrieTag* Tag, char* Buffer, int Star
             // Invalid peptide!
             break;
         }
-        FlankingMass += Mass;
+        if (PrefixMasses)
+        {
+            FlankingMass = INDEXED_FLANKING_MASS(PrefixMasses, StartPos, BufferDir, (Pos - StartPos) * BufferDir + 1);
+        }
+        else
+        {
+            FlankingMass += Mass;
+        }
         Diff = MatchMass  - (FlankingMass + AllDecorations[DecorationMassIndex].Mass);
         AbsDiff = abs(Diff);
         if (AbsDiff < GlobalOptions->FlankingMassEpsilon)
@@ -1088,15 +1214,15 @@ void GetMatches(SearchInfo* Info, TrieNode* Node, char* Buffer, int BufferPos, i
     int RightMatchIndex;
     int ModIndex;
     int UsedTooMany;
-    static int PTMLimit[MAX_PT_MODTYPE];
+    static THREAD_LOCAL int PTMLimit[MAX_PT_MODTYPE];
     // To avoid repeated scoring:
     int ExtensionIndex = 0;
     int ExtensionCount = 0;
-    static int StartingPoints[512];
-    static int EndingPoints[512];
-    static int ExtensionLeftDecorations[512]; 
-    static int ExtensionRightDecorations[512];
-    static MSSpectrum* ExtensionSpectra[512];
+    static THREAD_LOCAL int StartingPoints[512];
+    static THREAD_LOCAL int EndingPoints[512];
+    static THREAD_LOCAL int ExtensionLeftDecorations[512];
+    static THREAD_LOCAL int ExtensionRightDecorations[512];
+    static THREAD_LOCAL MSSpectrum* ExtensionSpectra[512];
     int ExtensionFound;
     MSSpectrum* Spectrum;
     //
@@ -1125,12 +1251,12 @@ void GetMatches(SearchInfo* Info, TrieNode* Node, char* Buffer, int BufferPos, i
         {
             continue;
         }
-        LeftMatchCount = MatchFlankingMass(Spectrum, TagNode->Tag, Buffer, BufferPos - TagNode->Tag->TagLength, -1, BufferEnd, TagNode->Tag->PrefixMass, ModsRemaining);
+        LeftMatchCount = MatchFlankingMass(Spectrum, TagNode->Tag, Buffer, Info->PrefixMasses, BufferPos - TagNode->Tag->TagLength, -1, BufferEnd, TagNode->Tag->PrefixMass, ModsRemaining);
         if (LeftMatchCount == 0)
         {
             continue;
         }
-        RightMatchCount = MatchFlankingMass(Spectrum, TagNode->Tag, Buffer, BufferPos + 1, 1, BufferEnd, TagNode->Tag->SuffixMass, ModsRemaining);
+        RightMatchCount = MatchFlankingMass(Spectrum, TagNode->Tag, Buffer, Info->PrefixMasses, BufferPos + 1, 1, BufferEnd, TagNode->Tag->SuffixMass, ModsRemaining);
         if (RightMatchCount == 0)
         {
             continue;
@@ -1220,8 +1346,8 @@ int ExtendTagMatchBlind(SearchInfo* Info, TrieNode* Node, char* Buffer, int Buff
         Info->Spectrum = Spectrum;
         //by virtue of getting here, we know that this TAG (tripeptide) has matched the database
         Hanger->Tag->DBTagMatches++;
-        LeftMatchCount = MatchFlankingMass(Spectrum, Hanger->Tag, Buffer, BufferPos - Hanger->Tag->TagLength, -1, BufferEnd, Hanger->Tag->PrefixMass, ModsRemaining);
-        RightMatchCount = MatchFlankingMass(Spectrum, Hanger->Tag, Buffer, BufferPos + 1, 1, BufferEnd, Hanger->Tag->SuffixMass, ModsRemaining);
+        LeftMatchCount = MatchFlankingMass(Spectrum, Hanger->Tag, Buffer, Info->PrefixMasses, BufferPos - Hanger->Tag->TagLength, -1, BufferEnd, Hanger->Tag->PrefixMass, ModsRemaining);
+        RightMatchCount = MatchFlankingMass(Spectrum, Hanger->Tag, Buffer, Info->PrefixMasses, BufferPos + 1, 1, BufferEnd, Hanger->Tag->SuffixMass, ModsRemaining);
         if (LeftMatchCount + RightMatchCount == 1)
         {
             //set up the BlindTagMatchObject, representing this match.
@@ -2162,9 +2288,10 @@ int ScanFileWithTrie(SearchInfo* Info)
     int BytesRead;
     int OldPos;
     int PaddingDistance = 50;
+    int IsMapped = 0;
     //
     Info->RecordNumber = 0;
-    File = Info->DB->DBFile;
+    File = Info->DBFile;
     if (!File)
     {
         return 0;
@@ -2174,7 +2301,18 @@ int ScanFileWithTrie(SearchInfo* Info)
     {
         return 0;
     }
-    Buffer = (char*)calloc(SCAN_BUFFER_SIZE, sizeof(char));
+    if (Info->DB && Info->DB->MappedData)
+    {
+        // The whole database is mapped into memory: scan it in place.
+        Buffer = Info->DB->MappedData;
+        BufferEnd = Info->DB->MappedSize;
+        Info->PrefixMasses = Info->DB->PrefixMasses;
+        IsMapped = 1;
+    }
+    else
+    {
+        Buffer = (char*)calloc(SCAN_BUFFER_SIZE, sizeof(char));
+    }
     Node = Info->Root;
     // We'll scan in chunks of the file, and scan across them.  We try to always keep a buffer of 50 characters
     // before and after the current position, so that we can look forward and back to get masses.  (When we match
@@ -2183,7 +2321,7 @@ int ScanFileWithTrie(SearchInfo* Info)
     {
         //printf("Anc%d Buf%d BufEnd%d F%d Char%c\n", AnchorPos, BufferPos, BufferEnd, FilePos, Buffer[BufferPos]);
         // Periodically shunt data toward the front of the buffer:
-        if (BufferPos > SCAN_BUFFER_A && AnchorPos==-1)
+        if (BufferPos > SCAN_BUFFER_A && AnchorPos==-1 && !IsMapped)
         {
             // ......ppppBbbbbbbbbbE... <- diagram (p = pad, B = buffer start, E = buffer end)
             // ppppBbbbbbbbbbE....      <- after move
@@ -2193,7 +2331,7 @@ int ScanFileWithTrie(SearchInfo* Info)
         }
 
         // Read more data, if we have room and we can:
-        if (BufferEnd < SCAN_BUFFER_B && !IsEOF)
+        if (BufferEnd < SCAN_BUFFER_B && !IsEOF && !IsMapped)
         {
             BytesRead = ReadBinary(Buffer + BufferEnd, sizeof(char), SCAN_BUFFER_SIZE - BufferEnd, File);
             if (!BytesRead)
@@ -2206,7 +2344,7 @@ int ScanFileWithTrie(SearchInfo* Info)
         if (AnchorPos!=-1)
         {
             // If we're anchored: Attempt to extend the current match.
-            if (Buffer[BufferPos] >= 'A' && Buffer[BufferPos] <= 'Z')
+            if (BufferPos < BufferEnd && Buffer[BufferPos] >= 'A' && Buffer[BufferPos] <= 'Z')
             {
                 NextNode = Node->Children[Buffer[BufferPos] - 'A'];
             }
@@ -2325,8 +2463,10 @@ int ScanFileWithTrie(SearchInfo* Info)
         } // if not anchored
     } // Master while-loop
 
-    SafeFree(Buffer);
-    
+    if (!IsMapped)
+    {
+        SafeFree(Buffer);
+    }
     return Info->RecordNumber + 1;
 }
 
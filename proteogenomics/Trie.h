@@ -201,6 +201,8 @@ typedef float (*ScoringFunction)(MSSpectrum* Spectrum, Peptide* Match, int Verbo
 typedef struct SearchInfo
 {
     DatabaseFile* DB;
+    FILE* DBFile; // our own handle on DB, so that search threads don't share a file position
+    unsigned int* PrefixMasses; // DB->PrefixMasses, if we're scanning the mapped database
     int RecordNumber;
     //ScoringFunction Scorer;
     MSSpectrum* Spectrum;
@@ -284,6 +286,9 @@ void InitStats();
 // Important main method: Use a trie to search a data-file.
 int ScanFileWithTrie(SearchInfo* Info);
 
+int BuildDatabaseMassIndex(DatabaseFile* DB);
+void FreeDatabaseMassIndex(DatabaseFile* DB);
+
 int GetMaxTagRank(TrieNode* Root);
 //int ComparePeptideScores(const Peptide* A, const Peptide* B);
 void PrintMatch(Peptide* Match, FILE* IndexFile);
@@ -28,12 +28,32 @@
 //MERCHANTABILITY OR FITNESS FOR A PARTICULAR PURPOSE, OR THAT THE USE OF 
 //THE SOFTWARE WILL NOT INFRINGE ANY PATENT, TRADEMARK OR OTHER RIGHTS.
 
+// MapDatabaseFile uses mmap's MAP_ANONYMOUS and fileno(), which -std=c99
+// hides unless we ask for them (_BSD_SOURCE for older glibc):
+#ifndef _WIN32
+#ifndef _DEFAULT_SOURCE
+#define _DEFAULT_SOURCE
+#endif
+#ifndef _BSD_SOURCE
+#define _BSD_SOURCE
+#endif
+#endif
+
 #include "CMemLeak.h"
 #include "Utils.h"
 #include <stdlib.h>
 #include <stdio.h>
 #include <ctype.h>
 #include <stdarg.h>
+#include <limits.h>
+
+#ifdef _WIN32
+#include <windows.h>
+#include <io.h>
+#else
+#include <unistd.h>
+#include <sys/mman.h>
+#endif
 
 // From high to low
 int CompareFloats(const float* a, const float* b)
@@ -677,3 +697,97 @@ float GetMedian(float* Values, int ValueCount)
         return (Values[ValueCount / 2] + Values[(ValueCount / 2) - 1]) / (float)2.0;
     }
 }
+
+#ifndef _WIN32
+// The length of a database's mapping: the file, rounded up past at least one page of zeros.
+static size_t GetMappedLength(int FileSize)
+{
+    size_t PageSize = (size_t)sysconf(_SC_PAGESIZE);
+    return (FileSize / PageSize + 1) * PageSize;
+}
+#endif
+
+// Map a database file read-only into memory, so that searches can scan it in place
+// (and share it between spectrum blocks and search threads) instead of re-reading it
+// through a buffer.  The mapping is followed by zero bytes, since the scan may peek one
+// character past the end of the last record.  Returns 1 on success; on failure,
+// DB->MappedData is left NULL and callers fall back to reading DB->DBFile.
+int MapDatabaseFile(DatabaseFile* DB)
+{
+    long FileSize;
+    void* Data;
+#ifdef _WIN32
+    SYSTEM_INFO SystemInfo;
+    HANDLE Mapping;
+#else
+    void* Reserved;
+    size_t MappedLength;
+#endif
+    //
+    DB->MappedData = NULL;
+    DB->MappedSize = 0;
+    if (!DB->DBFile)
+    {
+        return 0;
+    }
+    fseek(DB->DBFile, 0, SEEK_END);
+    FileSize = ftell(DB->DBFile);
+    fseek(DB->DBFile, 0, 0);
+    // File positions are ints throughout the search code:
+    if (FileSize <= 0 || FileSize >= INT_MAX)
+    {
+        return 0;
+    }
+#ifdef _WIN32
+    // The rest of the last page of a view reads as zeros, but there's no room
+    // for a trailing zero if the file fills its last page exactly:
+    GetSystemInfo(&SystemInfo);
+    if (FileSize % SystemInfo.dwPageSize == 0)
+    {
+        return 0;
+    }
+    Mapping = CreateFileMapping((HANDLE)_get_osfhandle(_fileno(DB->DBFile)), NULL, PAGE_READONLY, 0, 0, NULL);
+    if (!Mapping)
+    {
+        return 0;
+    }
+    Data = MapViewOfFile(Mapping, FILE_MAP_READ, 0, 0, 0);
+    CloseHandle(Mapping); // The view keeps the mapping alive
+    if (!Data)
+    {
+        return 0;
+    }
+#else
+    // Reserve zero-filled pages, then map the file over the front of them:
+    MappedLength = GetMappedLength((int)FileSize);
+    Reserved = mmap(NULL, MappedLength, PROT_READ, MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+    if (Reserved == MAP_FAILED)
+    {
+        return 0;
+    }
+    Data = mmap(Reserved, (size_t)FileSize, PROT_READ, MAP_PRIVATE | MAP_FIXED, fileno(DB->DBFile), 0);
+    if (Data == MAP_FAILED)
+    {
+        munmap(Reserved, MappedLength);
+        return 0;
+    }
+#endif
+    DB->MappedData = (char*)Data;
+    DB->MappedSize = (int)FileSize;
+    return 1;
+}
+
+void UnmapDatabaseFile(DatabaseFile* DB)
+{
+    if (!DB->MappedData)
+    {
+        return;
+    }
+#ifdef _WIN32
+    UnmapViewOfFile(DB->MappedData);
+#else
+    munmap(DB->MappedData, GetMappedLength(DB->MappedSize));
+#endif
+    DB->MappedData = NULL;
+    DB->MappedSize = 0;
+}
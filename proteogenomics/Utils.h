@@ -48,6 +48,14 @@
 #define SEPARATOR_STRING "/"
 #endif
 
+// Scratch globals used while searching a spectrum block get one copy per
+// search thread (see the -threads option):
+#ifdef _WIN32
+#define THREAD_LOCAL __declspec(thread)
+#else
+#define THREAD_LOCAL __thread
+#endif
+
 // We don't like compiler warnings.  Therefore, we cast all our 
 // qsort comparison callbacks, in order to avoid this:
 // Warning: "passing arg 4 of `qsort' from incompatible pointer type"
@@ -151,6 +159,11 @@ typedef struct DatabaseFile
     struct DatabaseFile* Next;
     FILE* DBFile;
     FILE* IndexFile;
+    // The database contents, mapped read-only into memory (NULL if unmapped):
+    char* MappedData;
+    int MappedSize;
+    // Cumulative residue masses of the mapped database (NULL if not built; see BuildDatabaseMassIndex)
+    unsigned int* PrefixMasses;
 } DatabaseFile;
 
 typedef struct StringNode
@@ -260,6 +273,13 @@ typedef struct Options
     int MultiChargeMode; // if 1, try multiple parent charge states.
 
     int TrieBlockSize;
+    // If nonzero, the memory (in megabytes) to spend on each batch of spectra searched
+    // in one pass over the database.  Batches are then sized by this budget, not TrieBlockSize.
+    int TrieMemory;
+    // If set, build a cumulative mass index of each (memory-mapped) database, to speed up
+    // matching the flanking masses of tags.  Costs four bytes of memory per residue.
+    int MassIndexFlag;
+    int ThreadCount; // number of spectrum blocks searched at once
     int InstrumentType;
     // Options for unrestrictive PTM search:
     // DeltaBinCount is the number of mass bins in the range [MinPTMDelta, MaxPTMDelta], 
@@ -299,6 +319,8 @@ int CompareStrings(const char* StringA, const char* StringB);
 char TranslateCodon(char* DNA);
 void WriteReverseComplement(char* Source, char* Destination);
 void ReverseString(char* String);
+int MapDatabaseFile(DatabaseFile* DB);
+void UnmapDatabaseFile(DatabaseFile* DB);
 
 #ifdef __ppc__
 size_t ReadBinary(void* Buffer, size_t ItemSize, size_t ItemCount, FILE* stream);
@@ -29,7 +29,7 @@ A generic sequence class for passing sequences around.
 Also support classes for doing sequence IO.
 '''
 
-import os, re, fileinput, struct, bisect
+import os, re, fileinput, struct, bisect, array, mmap
 import gzip, bz2
 
 from StringIO import StringIO
@@ -100,29 +100,119 @@ class FlatFileIO(object):
     def write(self,data):
         self.io.write(data)
 
-class TrieReader(FlatFileIO):
+try:
+    import numpy
+    # Layout of a record in the .index file written by PrepDB: the
+    # position in the source fasta, the position in the trie and the name
+    TrieIndexRecord = numpy.dtype([('filePos', '<i8'), ('triePos', '<i4'), ('name', 'S80')])
+except ImportError:
+    numpy = None
+
+def readTrieIndex(indexPath):
+    '''Returns the lists of sequence names and trie begin positions
+    stored in a .index file.
+    '''
+    if numpy:
+        records = numpy.fromfile(indexPath, dtype=TrieIndexRecord)
+        names = [ name.split("\0",1)[0] for name in records['name'].tolist() ]
+        return (names, records['triePos'].tolist())
+
+    names = []
+    positions = []
+    IndexFile = open(indexPath, "rb")
+    BlockSize = struct.calcsize("<qi80s")
+    while (1):
+        Block = IndexFile.read(BlockSize)
+        if not Block:
+            break
+        Info = struct.unpack("<qi80s", Block)
+        names.append( Info[2].split("\0",1)[0] )
+        positions.append( Info[1] )
+    IndexFile.close()
+    return (names, positions)
+
+class TrieSeqs(object):
+    '''
+    Read-only view of the sequences of a trie, indexed by sequence number.
+    Only the begin positions are kept, a sequence is sliced out of the
+    trie buffer (usually a mmap) when it is asked for.
+    Supports both the list and the dict protocol.
+    '''
+    def __init__(self, trie, positions):
+        self.trie = trie
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.positions)
+        begin = self.positions[i] # raises the IndexError for us
+        if i + 1 < len(self.positions):
+            end = self.positions[i+1] - 1 # the * between sequences
+        else:
+            end = len(self.trie)
+            if end > begin and self.trie[end-1] == '*':
+                end -= 1
+        return self.trie[begin:end]
+
     def __iter__(self):
-        seqs = self.io.read().split('*')
-        self.close()
+        for i in xrange(len(self.positions)):
+            yield self[i]
+
+    def keys(self):
+        return range(len(self.positions))
+
+    def values(self):
+        return list(self)
+
+    def items(self):
+        return list(enumerate(self))
+
+class TrieSequence(Sequence):
+    '''
+    A Sequence from a trie, whose residues are only sliced out of the
+    trie when seq is used.
+    '''
+    def __init__(self,acc,seqs,i,desc=''):
+        self.acc = acc
+        self.desc = desc
+        self.seqs = seqs
+        self.i = i
+
+    def getSeq(self):
+        return self.seqs[self.i]
+
+    def setSeq(self,seq):
+        self.seqs = [seq]
+        self.i = 0
 
+    seq = property(getSeq, setSeq)
+
+class TrieReader(FlatFileIO):
+    def mapTrie(self):
+        '''Returns the trie contents, memory mapped read-only when it is a
+        plain file, so that processes reading the same trie share its pages.
+        '''
+        if hasattr(self.io, 'fileno') and not isinstance(self.io, bz2.BZ2File):
+            if os.fstat(self.io.fileno()).st_size == 0:
+                return ''
+            return mmap.mmap(self.io.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.io.read()
+
+    def readIndex(self):
+        '''Returns the sequence names and trie positions from the .index'''
         IndexPath = os.path.splitext(self.name)[0] + ".index"
-        IndexFile = open(IndexPath, "rb")
-        BlockSize = struct.calcsize("<qi80s")
-        i = 0
-        while (1):
-            Block = IndexFile.read(BlockSize)
-            if not Block:
-                break
-            Info = struct.unpack("<qi80s", Block)
-            Name = Info[2]
-            NullPos = Name.find("\0")
-            if NullPos != -1:
-                Name = Name[:NullPos]
-            seq = Sequence( Name, seqs[i], Info[1] )
-            yield seq
-            i += 1
+        return readTrieIndex(IndexPath)
 
-        IndexFile.close()
+    def __iter__(self):
+        (names, positions) = self.readIndex()
+        seqs = TrieSeqs(self.mapTrie(), positions)
+        self.close()
+
+        for i in xrange(len(names)):
+            yield TrieSequence( names[i], seqs, i, positions[i] )
 
 class TrieIndexSeqs(object):
     def __init__(self,trieFile):
@@ -133,15 +223,12 @@ class TrieIndexSeqs(object):
         self.trie = ''
 
     def index(self):
-        offset = 0
-        for seq in self.reader:
-            self.ids.append( seq.acc )
-            self.seqs.append( seq.seq )
-            # Store begin of sequence
-            self.positions.append( offset );
-            offset += len(seq.seq) + 1 # extra 1 for the * in the trie
-
-        self.trie = '*'.join( self.seqs )
+        '''Reads the sequence names and positions from the .index, the
+        sequences themselves stay in the mapped trie.'''
+        (self.ids, self.positions) = self.reader.readIndex()
+        self.trie = self.reader.mapTrie()
+        self.seqs = TrieSeqs(self.trie, self.positions)
+        self.reader.close()
 
     def indexAtOffset(self, beginInTrie):
         # bisect right will always give us the sequence after 
@@ -166,12 +253,70 @@ class TrieIndexSeqs(object):
 
         return accIndexPairs
 
+    def accessionsWhereSeqsFound( self, seqsToFind):
+        '''Batch form of accessionsWhereSeqFound. Returns a list with the
+        list of location tuples of each sequence, in the order given.
+        '''
+        return [ self.accessionsWhereSeqFound(seq) for seq in seqsToFind ]
+
 import IndexSearch
 
 class QGramIndex(TrieIndexSeqs):
+    '''TrieIndexSeqs searched through the SeqAn q-gram index.
+    Building the q-gram index is slow for large six frame databases, so
+    prepare() saves it next to the .trie, and index() memory maps the saved
+    files instead of rebuilding whenever they are not older than the trie
+    and its .index.
+    '''
     def index(self):
         TrieIndexSeqs.index(self)
-        self.search = IndexSearch.IndexSearch( self.trie )
+        triePath = getattr(self.reader, 'name', None)
+        if triePath and QGramIndex.isCacheCurrent( triePath ):
+            self.search = IndexSearch.IndexSearch.open( QGramIndex.cachePrefix(triePath) )
+        else:
+            # IndexSearch needs a real string to build from
+            self.search = IndexSearch.IndexSearch( self.trie[:] )
+
+    @staticmethod
+    def cachePrefix(triePath):
+        'Prefix of the files holding the saved q-gram index of a trie.'
+        return os.path.splitext(triePath)[0] + ".qgram"
+
+    @staticmethod
+    def trieStamp(triePath):
+        '''Size and mtime of the trie and of its .index, used to detect a
+        stale saved index.'''
+        stamps = []
+        for path in (triePath, os.path.splitext(triePath)[0] + ".index"):
+            stat = os.stat(path)
+            stamps.append( "%d %d" % (stat.st_size, int(stat.st_mtime)) )
+        return " ".join(stamps)
+
+    @staticmethod
+    def isCacheCurrent(triePath):
+        stampPath = QGramIndex.cachePrefix(triePath) + ".stamp"
+        if not os.path.exists(stampPath):
+            return False
+        stampFile = open(stampPath)
+        stamp = stampFile.read().strip()
+        stampFile.close()
+        return stamp == QGramIndex.trieStamp(triePath)
+
+    @staticmethod
+    def prepare(triePath):
+        '''Build the q-gram index of the trie and save it for later index()
+        calls. The stamp is written last, so an interrupted save is stale.
+        '''
+        if QGramIndex.isCacheCurrent(triePath):
+            return
+        prefix = QGramIndex.cachePrefix(triePath)
+        trieIndex = TrieIndexSeqs(triePath)
+        trieIndex.index()
+        IndexSearch.IndexSearch( trieIndex.trie[:] ).save( prefix )
+        stampFile = open(prefix + ".stamp.tmp", "w")
+        stampFile.write(QGramIndex.trieStamp(triePath) + "\n")
+        stampFile.close()
+        os.rename(prefix + ".stamp.tmp", prefix + ".stamp")
 
     def accessionsWhereSeqFound( self, seqToFind):
         accIndexPairs = []
@@ -182,6 +327,24 @@ class QGramIndex(TrieIndexSeqs):
 
         return accIndexPairs
 
+    def accessionsWhereSeqsFound( self, seqsToFind):
+        '''Search all the sequences in a single call into the index, which
+        also resolves the hit offsets to sequence indices.
+        '''
+        if not hasattr(self, 'positionsArray'):
+            self.positionsArray = array.array('l', self.positions)
+        (offsets, bounds, seqIds) = self.search.find_many( seqsToFind, self.positionsArray )
+        allPairs = []
+        for i in xrange(len(seqsToFind)):
+            accIndexPairs = []
+            for hit in xrange(bounds[i], bounds[i+1]):
+                index = seqIds[hit]
+                offsetInSeq = offsets[hit] - self.positions[ index ]
+                accIndexPairs.append( (self.ids[index], index, offsetInSeq) )
+            allPairs.append( accIndexPairs )
+
+        return allPairs
+
 
 class FastaReader(FlatFileIO):
     '''
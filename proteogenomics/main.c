@@ -100,6 +100,8 @@ void PrintUsageInfo()
     printf("          or warnings reported, this file will be erased at end of run.\n");
     printf(" -r ResourceDir: Directory for resource files (such \n");
     printf("     as AminoAcidMasses.txt).  Defaults to current directory. \n");
+    printf(" -threads N: Search N blocks of spectra at once, within one process.\n");
+    printf("     Defaults to 1.\n");
     printf("  Consult the documentation (Inspect.html) for further details.\n");
 }
 
@@ -287,6 +289,20 @@ int ReadCommandLineArgs(int argc, char** argv)
             printf("Resource directory is: '%s'\n", GlobalOptions->ResourceDir);
             Index += 2;
             break;
+        case 't': // -threads N: Search N spectrum blocks at once
+            if (!MoreArgs)
+            {
+                REPORT_ERROR_S(19, "-threads");
+                return 0;
+            }
+            GlobalOptions->ThreadCount = atoi(argv[Index + 1]);
+            if (GlobalOptions->ThreadCount < 1 || GlobalOptions->ThreadCount > MAX_SEARCH_THREADS)
+            {
+                printf("Error: -threads must be between 1 and %d, not '%s'.\n", MAX_SEARCH_THREADS, argv[Index + 1]);
+                return 0;
+            }
+            Index += 2;
+            break;
         case 'v':
             GlobalOptions->VerboseFlag = 1;
             Index++;
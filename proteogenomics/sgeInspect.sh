@@ -10,7 +10,10 @@ set -o errexit
 
 inspectIn=jobs/$SGE_TASK_ID.in
 
-$exe_path/inspect -i $inspectIn -o ResultsX/$SGE_TASK_ID.txt -r $exe_path
+# The log's "Elapsed time" is read back by ClusterSub.py to predict job run times
+inspectLog=ResultsX/$SGE_TASK_ID.log
+$exe_path/inspect -i $inspectIn -o ResultsX/$SGE_TASK_ID.txt -r $exe_path > $inspectLog
+cat $inspectLog
 
 rundir=$PWD
 results=$rundir/ResultsX
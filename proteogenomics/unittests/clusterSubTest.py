@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+'''
+Unit tests for the job building of ClusterSub
+'''
+import unittest
+import os
+import shutil
+import tempfile
+
+import ClusterSub
+import ClusterUtils
+
+class Test(unittest.TestCase):
+
+    SpectrumFileName = "a.mzXML"
+    ScanCount = 250
+
+    def setUp(self):
+        self.ScratchDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.ScratchDir)
+
+    def MakeMongler(self, SecondsPerSpectrum):
+        Mongler = ClusterSub.ScriptMongler()
+        Mongler.gridEnv = ClusterUtils.JCVIGridEnv(self.ScratchDir)
+        Mongler.gridEnv.MakeGridDirectories()
+        Stub = os.path.splitext(os.path.join(Mongler.gridEnv.MZXMLDir, self.SpectrumFileName))[0]
+        Mongler.ScanCounts[Stub] = self.ScanCount
+        Mongler.SecondsPerSpectrum = SecondsPerSpectrum
+        Mongler.JobSeconds = 100
+        Mongler.GetAlreadySearchedDict()
+        return Mongler
+
+    def FlagBlocks(self, Name, Blocks):
+        "Write the done flags GridRunner writes for a job searching these blocks"
+        MasterJob = ClusterSub.JobClass()
+        MasterJob.SubJobs = []
+        for (Seconds, SpectrumFileName, FirstScan, LastScan) in Blocks:
+            MainJob = ClusterSub.JobClass()
+            MainJob.SpectrumFileName = SpectrumFileName
+            MainJob.BlockNumber = FirstScan or 0
+            MainJob.FirstScan = FirstScan
+            MainJob.LastScan = LastScan
+            MasterJob.SubJobs.append(MainJob)
+        DoneDir = os.path.join(self.ScratchDir, "Done")
+        FlagFile = open(os.path.join(DoneDir, "%s.subbed"%Name), "wb")
+        MasterJob.FlagRunningJob(Name, FlagFile)
+        FlagFile.close()
+
+    def GetScans(self, Blocks):
+        "Scan numbers searched by these blocks (scan numbers start at 1)"
+        Scans = []
+        for (Seconds, SpectrumFileName, FirstScan, LastScan) in Blocks:
+            if FirstScan == None:
+                (FirstScan, LastScan) = (0, -1)
+            if LastScan < 0:
+                LastScan = self.ScanCount
+            Scans.extend(range(max(FirstScan, 1), LastScan + 1))
+        return Scans
+
+    def Resume(self, Name, SecondsPerSpectrum, Searched):
+        """
+        Build the blocks of a resumed run, check they search no scan that
+        is in Searched (the blocks flagged so far), and flag them as job Name
+        """
+        Blocks = self.MakeMongler(SecondsPerSpectrum).GetSearchBlocks([self.SpectrumFileName])
+        Scans = self.GetScans(Blocks)
+        self.assertEqual(len(Scans), len(set(Scans)))
+        self.assertEqual([], [Scan for Scan in self.GetScans(Searched) if Scan in Scans])
+        if Blocks:
+            self.FlagBlocks(Name, Blocks)
+        return Blocks
+
+    def testResumeSameRate(self):
+        "Blocks with done flags are skipped when resuming at the same rate"
+        Blocks = self.MakeMongler(1.0).GetSearchBlocks([self.SpectrumFileName])
+        self.assertEqual(3, len(Blocks))
+        self.FlagBlocks("1", Blocks[:2])
+        Left = self.Resume("2", 1.0, Blocks[:2])
+        self.assertEqual(Blocks[2:], Left)
+        self.assertEqual([], self.Resume("3", 1.0, Blocks))
+
+    def testResumeChangedRate(self):
+        "A resumed run whose seconds per spectrum changed schedules no scan twice"
+        Blocks = self.MakeMongler(1.0).GetSearchBlocks([self.SpectrumFileName])
+        self.assertEqual([(0, 84), (85, 168), (169, -1)], [Block[2:] for Block in Blocks])
+        # Only the first and last blocks were submitted:
+        Searched = [Blocks[0], Blocks[2]]
+        self.FlagBlocks("1", Searched)
+        # Faster now, but only the middle scans are left:
+        Left = self.Resume("2", 0.5, Searched)
+        self.assertEqual([(85, 168)], [Block[2:] for Block in Left])
+        Searched.extend(Left)
+        self.assertEqual(range(1, self.ScanCount + 1), sorted(self.GetScans(Searched)))
+        self.assertEqual([], self.Resume("3", 1.0, Searched))
+
+    def testResumeSlowerRate(self):
+        "Scans left by a faster run are split into the blocks of the slower one"
+        Blocks = self.MakeMongler(0.5).GetSearchBlocks([self.SpectrumFileName])
+        self.assertEqual([(0, 125), (126, -1)], [Block[2:] for Block in Blocks])
+        Searched = Blocks[:1]
+        self.FlagBlocks("1", Searched)
+        Left = self.Resume("2", 1.0, Searched)
+        self.assertEqual([(126, 188), (189, -1)], [Block[2:] for Block in Left])
+        Searched.extend(Left)
+        self.assertEqual(range(1, self.ScanCount + 1), sorted(self.GetScans(Searched)))
+
+    def testWholeFileFlag(self):
+        "A whole-file done flag covers every block of the file"
+        Blocks = self.MakeMongler(0.1).GetSearchBlocks([self.SpectrumFileName])
+        self.assertEqual([(None, None)], [Block[2:] for Block in Blocks])
+        self.FlagBlocks("1", Blocks)
+        self.assertEqual([], self.Resume("2", 0.1, Blocks))
+        self.assertEqual([], self.Resume("3", 1.0, Blocks))
+
+if __name__ == "__main__":
+    unittest.main()
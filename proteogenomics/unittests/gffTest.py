@@ -9,6 +9,10 @@ Some unit tests for the gff code
 '''
 import unittest
 import os
+import gzip
+import random
+import shutil
+import tempfile
 import StringIO
 
 import GFFIO
@@ -85,5 +89,73 @@ class Test(unittest.TestCase):
 
         os.remove( OUT )
 
+    def testGFFColumns(self):
+        "Records written in a batch or as columns come out as written one at a time."
+        gffs = list( GFFIO.File( open(self.IN) ) )
+        one = StringIO.StringIO()
+        gffout = GFFIO.File(one)
+        for gff in gffs:
+            gffout.write( gff )
+        batch = StringIO.StringIO()
+        batchout = GFFIO.File(batch)
+        batchout.writeRecords( gffs )
+        self.assertEqual( one.getvalue(), batch.getvalue() )
+
+        columns = StringIO.StringIO()
+        columnsout = GFFIO.File(columns)
+        columnsout.writeColumns( 'ctg1', '.', 'polypeptide', [5, 10], [20, 40], [0.5, None],
+                                 ['+', '-'], '.', [('ID', ['p1', 'p2']), ('Parent', 'orf1')] )
+        self.assertEqual( "ctg1\t.\tpolypeptide\t5\t20\t0.5\t+\t.\tID=p1;Parent=orf1\n"
+                          "ctg1\t.\tpolypeptide\t10\t40\tNone\t-\t.\tID=p2;Parent=orf1\n",
+                          columns.getvalue() )
+
+    def testGFFRegionQuery(self):
+        "Region queries of indexed plain and bgzip GFF files find the overlapping records."
+        tmpDir = tempfile.mkdtemp()
+        try:
+            rand = random.Random(7)
+            seqids = ['chr1', 'chr2', 'plasmid']
+            starts = {}
+            for seqid in seqids:
+                starts[seqid] = sorted([rand.randint(1, 100000) for i in range(3000)])
+            paths = [os.path.join(tmpDir, name) for name in ('out.gff', 'out.gff.gz')]
+            for path in paths:
+                gffout = GFFIO.File( path, 'w', saveIndex=1 )
+                for seqid in seqids:
+                    gffout.writeColumns( seqid, 'Proteomics', 'polypeptide', starts[seqid],
+                                         [start + 29 for start in starts[seqid]], 0.01, '+', '.',
+                                         {'ID': ['%s.%d' % (seqid, i) for i in range(3000)]} )
+                gffout.close()
+                self.assertTrue( os.path.exists( GFFIO.GFFIndexPath(path) ) )
+            lines = open(paths[0]).read()
+            self.assertEqual( lines, gzip.open(paths[1]).read() )
+            self.assertTrue( len( GFFIO.LoadGFFIndex(paths[1])[0] ) > 3 ) # several blocks
+
+            allGffs = list( GFFIO.File(paths[0]) )
+            for region in ('chr2:5000-5100', 'plasmid:1-40', 'chr1:99990-200000', 'chr2', 'chr3:1-10'):
+                (seqid, start, end) = GFFIO.parseRegion(region)
+                expected = [gff.attributes['ID'] for gff in allGffs if gff.seqid == seqid and
+                            (start == None or (gff.start <= end and gff.end >= start))]
+                for path in paths:
+                    gffin = GFFIO.File(path)
+                    found = [gff.attributes['ID'] for gff in gffin.query(region)]
+                    self.assertEqual( expected, found )
+                # an index made from the plain file, and no index at all
+                gffin = GFFIO.File( StringIO.StringIO(lines) )
+                self.assertEqual( expected, [gff.attributes['ID'] for gff in gffin.query(region)] )
+            # the index is only saved when asked for
+            plain = os.path.join(tmpDir, 'noindex.gff')
+            gffout = GFFIO.File( plain, 'w' )
+            gffout.writeRecords( allGffs[:10] )
+            gffout.close()
+            self.assertFalse( os.path.exists( GFFIO.GFFIndexPath(plain) ) )
+            self.assertEqual( 0, len([name for name in os.listdir(tmpDir) if name.startswith('tmp')]) )
+
+            built = GFFIO.BuildGFFIndex( paths[0] )
+            self.assertEqual( [str(entry) for entry in GFFIO.LoadGFFIndex(paths[0])[0]],
+                              [str(entry) for entry in built] )
+        finally:
+            shutil.rmtree(tmpDir)
+
 if __name__ == "__main__":
     unittest.main()
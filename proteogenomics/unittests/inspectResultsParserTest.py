@@ -8,6 +8,9 @@ Created on Oct 8, 2009
 Some unit tests for the InspectResults Parser class.
 '''
 import unittest
+import os
+import shutil
+import tempfile
 
 import InspectResults
 
@@ -58,5 +61,109 @@ class Test(unittest.TestCase):
 
         self.assertEqual( 9, i)
 
+    def testBatches(self):
+        "Batches hold the same values as the rows, split at BatchSize."
+        batches = list(InspectResults.Parser( self.IN ).iterBatches(4))
+        self.assertEqual( [4, 4, 1], [len(b['Annotation']) for b in batches] )
+        rows = list(InspectResults.Parser( self.IN ))
+        self.assertEqual( [str(row) for row in rows],
+            [str(row) for b in batches for row in InspectResults.RowsFromBatch(b)] )
+        self.assertEqual( self.PVAL, [p for b in batches for p in b['PValue'].tolist()] )
+
+    def testColumnarRoundTrip(self):
+        "Rows read back from the columnar format equal the text rows."
+        tmpDir = tempfile.mkdtemp()
+        colPath = os.path.join(tmpDir, 'inspect' + InspectResults.COLUMNAR_EXTENSION)
+        txtPath = os.path.join(tmpDir, 'inspect.txt')
+        InspectResults.ConvertResults( self.IN, colPath )
+        InspectResults.ConvertResults( colPath, txtPath )
+
+        textRows = [ str(result) for result in InspectResults.Parser( self.IN ) ]
+        colRows = [ str(result) for result in InspectResults.Parser( colPath ) ]
+        self.assertEqual( 9, len(colRows) )
+        self.assertEqual( textRows, colRows )
+        self.assertEqual( textRows, [ str(result) for result in InspectResults.Parser( txtPath ) ] )
+
+        reader = InspectResults.ColumnarReader( colPath )
+        batches = list(reader.iterBatches())
+        reader.close()
+        self.assertEqual( 1, len(batches) )
+        self.assertEqual( self.ANNO, list(batches[0]['Annotation']) )
+        self.assertEqual( self.PVAL, list(batches[0]['PValue']) )
+
+        # blank lines written as text are skipped, not an error
+        blankPath = os.path.join(tmpDir, 'blank' + InspectResults.COLUMNAR_EXTENSION)
+        writer = InspectResults.ColumnarWriter( blankPath )
+        writer.write( "\n" )
+        writer.write( "%s\n  \n\n%s\n" % (textRows[0], textRows[1]) )
+        writer.close()
+        self.assertEqual( textRows[:2], [ str(result) for result in InspectResults.Parser( blankPath ) ] )
+        shutil.rmtree(tmpDir)
+
+    def testWorkers(self):
+        "Parsing a dir in worker processes gives the rows of a serial parse."
+        tmpDir = tempfile.mkdtemp()
+        for name in ('inspect.txt.bz2', 'inspect2.txt.bz2'):
+            shutil.copy( name, tmpDir )
+        InspectResults.ConvertResults( self.IN, os.path.join(tmpDir, 'inspect3.txt') )
+
+        serialRows = [ str(result) for result in InspectResults.Parser( tmpDir ) ]
+        orderedRows = [ str(result) for result in InspectResults.Parser( tmpDir, Workers=2, ReadAhead=1 ) ]
+        self.assertEqual( serialRows, orderedRows )
+        anyOrder = InspectResults.Parser( tmpDir, Workers=2, Ordered=False ).iterBatches(4)
+        anyOrderRows = [ str(row) for b in anyOrder for row in InspectResults.RowsFromBatch(b) ]
+        self.assertEqual( sorted(serialRows), sorted(anyOrderRows) )
+        shutil.rmtree(tmpDir)
+
+    def testCheckpoint(self):
+        "Files are read by name, and files in the checkpoint are skipped."
+        tmpDir = tempfile.mkdtemp()
+        inDir = os.path.join(tmpDir, 'in')
+        os.mkdir(inDir)
+        for name in ('inspect2.txt.bz2', 'inspect.txt.bz2'):
+            shutil.copy( name, inDir )
+        checkpoint = os.path.join(tmpDir, 'checkpoint')
+        mirror = os.path.join(tmpDir, 'out')
+
+        parser = InspectResults.Parser( inDir, Checkpoint=checkpoint, inputMirrorTo=mirror )
+        files = parser.iterFiles()
+        (fileName, rows) = files.next()
+        self.assertEqual( os.path.join(inDir, 'inspect.txt.bz2'), fileName )
+        firstRows = [ str(row) for row in rows ]
+        self.assertEqual( 9, len(firstRows) )
+        for row in firstRows:
+            parser.mirrorOutHandle.write(row)
+        self.assertEqual( {}, InspectResults.ReadCheckpoint(checkpoint) )
+        (fileName, rows) = files.next() # interrupted in the second file
+        self.assertEqual( [os.path.join(inDir, 'inspect.txt.bz2')],
+                          InspectResults.ReadCheckpoint(checkpoint).keys() )
+        self.assertEqual( firstRows, [ str(row) for row in InspectResults.Parser( 
+                          os.path.join(mirror, 'inspect.txt.bz2') ) ] )
+
+        resumed = InspectResults.Parser( inDir, Checkpoint=checkpoint )
+        self.assertEqual( [ str(row) for row in InspectResults.Parser( fileName ) ],
+                          [ str(row) for row in resumed ] )
+        self.assertEqual( 2, resumed.FileCount )
+        self.assertEqual( 2, len(InspectResults.ReadCheckpoint(checkpoint)) )
+        self.assertEqual( [], list(InspectResults.Parser( inDir, Checkpoint=checkpoint )) )
+        shutil.rmtree(tmpDir)
+
+    def testMaxFiles(self):
+        "MaxFilesToParse reads files spread over the whole dir, not its first ones."
+        tmpDir = tempfile.mkdtemp()
+        names = [ 'run%02d.txt.bz2' % index for index in range(10) ]
+        for name in names:
+            shutil.copy( self.IN, os.path.join(tmpDir, name) )
+        open( os.path.join(tmpDir, 'notes.log'), 'w' ).close()
+
+        parser = InspectResults.Parser( tmpDir, MaxFilesToParse=4, QuietFlag=1 )
+        fileNames = [ os.path.basename(fileName) for (fileName, rows) in parser.iterFiles() ]
+        self.assertEqual( ['run00.txt.bz2', 'run02.txt.bz2', 'run04.txt.bz2',
+                           'run06.txt.bz2', 'run08.txt.bz2'], fileNames )
+        workers = InspectResults.Parser( tmpDir, MaxFilesToParse=4, QuietFlag=1, Workers=2 )
+        self.assertEqual( fileNames, [ os.path.basename(fileName) 
+                                       for (fileName, rows) in workers.iterFiles() ] )
+        shutil.rmtree(tmpDir)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+'''
+Some unit tests for the peak arrays of MSSpectrum.SpectrumClass
+'''
+import unittest
+import struct
+import random
+
+import MSSpectrum
+import ParseXML
+import SpectrumStore
+
+class Test(unittest.TestCase):
+
+    MZXML = '../TestSuite/DictySmall.mzXML'
+
+    def getSpectra(self):
+        "Pairs of the same spectrum, one with peak arrays and one with a peak list."
+        pairs = []
+        for entry in SpectrumStore.BuildScanIndex(self.MZXML):
+            spectrum = MSSpectrum.SpectrumClass()
+            spectrum.ReadPeaks(self.MZXML, entry.ByteOffset)
+            self.assertTrue( spectrum.PeakMasses is not None )
+            legacy = SpectrumStore.CopySpectrum(spectrum)
+            legacy.Peaks = [MSSpectrum.PeakClass(p.Mass, p.Intensity) for p in
+                            SpectrumStore.CopySpectrum(spectrum).Peaks]
+            self.assertEqual( None, legacy.PeakMasses )
+            pairs.append((spectrum, legacy))
+        return pairs
+
+    def peakTuples(self, spectrum):
+        return [(p.Mass, p.Intensity, p.IntensityRank) for p in spectrum.Peaks]
+
+    def testDecode(self):
+        "Both byte orders and precisions decode to the values struct reads."
+        values = [random.uniform(100, 2000) for i in range(10)]
+        for (byteOrder, code) in (("little", "<"), ("big", ">")):
+            for (precision, format) in (("32", "f"), ("64", "d")):
+                packed = struct.pack("%s%d%s"%(code, len(values), format), *values)
+                expected = list(struct.unpack("%s%d%s"%(code, len(values), format), packed))
+                decoded = ParseXML.DecodeFloats(ParseXML.B64Encode(packed), byteOrder, precision)
+                self.assertEqual( expected, list(decoded) )
+
+    def testPeaks(self):
+        "The peak list built from the arrays matches the mzXML peaks."
+        for (spectrum, legacy) in self.getSpectra():
+            self.assertEqual( len(spectrum.PeakMasses), spectrum.GetPeakCount() )
+            peak = spectrum.GetPeak(spectrum.PeakMasses[3])
+            self.assertEqual( self.peakTuples(legacy), self.peakTuples(spectrum) )
+            # The peak handed out is the one in the list:
+            self.assertTrue( peak is spectrum.Peaks[3] )
+            self.assertEqual( None, spectrum.PeakMasses )
+
+    def testLookups(self):
+        "GetPeak and GetBestPeak find the same peaks as the list versions."
+        for (spectrum, legacy) in self.getSpectra():
+            for mass in [legacy.Peaks[0].Mass - 2, legacy.Peaks[-1].Mass + 2] + \
+                    [random.uniform(legacy.Peaks[0].Mass, legacy.Peaks[-1].Mass) for i in range(50)]:
+                for epsilon in (0.1, 0.5, 1.0):
+                    self.assertEqual( legacy.GetPeak(mass, epsilon), spectrum.GetPeak(mass, epsilon) )
+                    for maxIntensity in (None, 0, 500):
+                        (peak, error) = spectrum.GetBestPeak(mass, maxIntensity, epsilon)
+                        (legacyPeak, legacyError) = legacy.GetBestPeak(mass, maxIntensity, epsilon)
+                        self.assertEqual( legacyError, error )
+                        if peak:
+                            self.assertEqual( (legacyPeak.Mass, legacyPeak.Intensity),
+                                              (peak.Mass, peak.Intensity) )
+            self.assertTrue( spectrum.PeakMasses is not None )
+
+    def testFilterAndRank(self):
+        "FilterPeaks and RankPeaksByIntensity keep and rank the same peaks."
+        for (spectrum, legacy) in self.getSpectra():
+            spectrum.RankPeaksByIntensity()
+            legacy.RankPeaksByIntensity()
+            spectrum.ParentMass = legacy.ParentMass = 1500.0
+            self.assertEqual( legacy.ApplyWindowFilter([0.3, 0.7], (40, 50, 60), 5),
+                              spectrum.ApplyWindowFilter([0.3, 0.7], (40, 50, 60), 5) )
+            spectrum.FilterPeaks()
+            legacy.FilterPeaks()
+            self.assertTrue( spectrum.PeakMasses is not None )
+            self.assertEqual( self.peakTuples(legacy), self.peakTuples(spectrum) )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+'''
+Some unit tests for collecting peptides from search results with the PeptideAccumulator
+'''
+import unittest
+import os
+import pickle
+
+import InspectResults
+import PeptideAccumulator
+import ProteogenomicsPostProcessing
+from Utils import GetPeptideFromModdedName
+
+class Test(unittest.TestCase):
+
+    IN = ('inspect.txt.bz2', 'inspect2.txt.bz2')
+
+    def testSourceList(self):
+        "A SourceList reads back as the (file, scan) tuples it was given."
+        Accumulator = PeptideAccumulator.PeptideAccumulator(CacheSize = 2)
+        Accumulator.AddMatch("PEPTIDE", 0.01, "/data/a.mzXML", 5)
+        Accumulator.AddMatch("PEPTIDE", 0.001, "b.mzXML", 7)
+        Accumulator.AddMatch("PEPTIDE", 0.1, "/data/a.mzXML", 9)
+        Accumulator.AddDecoy("EDITPEP")
+        Sources = Accumulator.Sources["PEPTIDE"]
+        Expected = [("a.mzXML", 5), ("b.mzXML", 7), ("a.mzXML", 9)]
+        self.assertEqual( Expected, list(Sources) )
+        self.assertEqual( (3, ("a.mzXML", 9)), (len(Sources), Sources[-1]) )
+        self.assertEqual( Expected, list(pickle.loads(pickle.dumps(Sources))) )
+        self.assertEqual( (0.001, 4), (Accumulator.BestPValue["PEPTIDE"], Accumulator.SpectrumCount) )
+        for Annotation in ("K.PEPTphosIDE.R", "R.AAA.G", "-.M+16EEK.-", "K.PEPTphosIDE.R"):
+            self.assertEqual( GetPeptideFromModdedName(Annotation).Aminos, Accumulator.GetAminos(Annotation) )
+        self.assertTrue( len(Accumulator.AminosCache) <= 2 )
+
+    def testParseInspect(self):
+        "ParseInspect collects the same peptides as the list based version did."
+        for Path in self.IN:
+            Finder = ProteogenomicsPostProcessing.FinderClass()
+            Finder.PValueLimit = 1.0
+            Finder.ParseInspect(Path)
+            AllPeptides = {}
+            PeptideSources = {}
+            FalseAminos = []
+            for Result in InspectResults.Parser(Path):
+                Aminos = GetPeptideFromModdedName(Result.Annotation).Aminos
+                PValue = Result.PValue
+                if Result.LFDR != None:
+                    PValue = Result.LFDR
+                if PValue > Finder.PValueLimit:
+                    continue
+                if Result.ProteinName[:3] == "XXX":
+                    if not Aminos in FalseAminos:
+                        FalseAminos.append(Aminos)
+                    continue
+                PeptideSources.setdefault(Aminos, []).append((os.path.split(Result.SpectrumFile)[1], Result.ScanNumber))
+                AllPeptides[Aminos] = min(PValue, AllPeptides.get(Aminos, PValue))
+            self.assertTrue( len(AllPeptides) > 0 )
+            self.assertEqual( AllPeptides, Finder.AllPeptides )
+            self.assertEqual( PeptideSources, dict([(Aminos, list(Sources)) for (Aminos, Sources) in Finder.PeptideSources.items()]) )
+            self.assertEqual( len(FalseAminos), Finder.Report.Info["DecoyPeptides"] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,6 +11,10 @@ and comment it's purpose
 """
 
 import unittest
+import random
+import os
+import shutil
+import tempfile
 
 import PGORFFilters
 import GenomicLocations
@@ -136,6 +140,53 @@ class Test(unittest.TestCase):
         self.assertEqual(Filter.filterORF(ORFLacksTryptic), 1)
         self.assertEqual(Filter.filterORF(ORFUnset), 1)
 
+    def MakeRandomORFs(self, Seed):
+        "ORFs with random peptides, some of them close together, some alone"
+        random.seed(Seed)
+        ORFs = {}
+        for Index in range(200):
+            Strand = random.choice("+-")
+            ORF = PGPeptide.OpenReadingFrame(name = "Protein%s"%Index)
+            ORF.location = PGPeptide.GenomicLocation(1, 5000, Strand, 'NC_001263')
+            if random.random() < 0.3:
+                ORF.annotatedProtein = PGPeptide.LocatedProtein(ORF.location)
+            for PeptideIndex in range(random.choice([0, 1, 2, 3, 5, 10, 20])):
+                Aminos = "".join([random.choice("GGGAAAKRSTWP") for Letter in range(random.randint(5, 14))])
+                Start = random.choice([random.randint(1, 4000), random.randint(1, 400)])
+                if random.random() < 0.1 and ORF.numPeptides():
+                    Start = random.choice(list(ORF.peptideIter())).GetStart()
+                Location = PGPeptide.GenomicLocation(Start, Start + 3 * len(Aminos) - 1, Strand, 'NC_001263')
+                Peptide = PGPeptide.LocatedPeptide(Aminos, Location)
+                Peptide.isUnique = random.random() < 0.6 and 1 or None
+                Peptide.SetTryptic(random.choice("KRG"))
+                ORF.addLocatedPeptide(Peptide)
+            ORFs[ORF.name] = ORF
+        return ORFs
+
+    def testFilterColumns(self):
+        "Name: filtering all ORFs at once deletes the same ORFs and peptides as one ORF at a time"
+        if not PGORFFilters.numpy:
+            return
+        TempDir = tempfile.mkdtemp()
+        try:
+            for Seed in range(5):
+                Results = []
+                for UseColumns in (0, 1):
+                    ReportPath = os.path.join(TempDir, "Filter%s.txt"%UseColumns)
+                    Filters = PGORFFilters.FilterList([PGORFFilters.SequenceComplexityFilter(),
+                        PGORFFilters.PeptideDistance(300), PGORFFilters.UniquenessFilter(),
+                        PGORFFilters.TrypticFilter(), PGORFFilters.MinPeptideFilter(2)], ReportPath)
+                    Filters.UseColumns = UseColumns
+                    Kept = Filters.ApplyAllFilters(self.MakeRandomORFs(Seed))
+                    Filters.Handle.close()
+                    Peptides = [(Name, [(Peptide.aminos, Peptide.GetStart()) for Peptide in ORF.peptideIter()])
+                                for (Name, ORF) in sorted(Kept.items())]
+                    Report = open(os.path.join(TempDir, "Filter%s.filterreport.txt"%UseColumns)).read()
+                    Results.append((Peptides, Report))
+                self.assertEqual(Results[0], Results[1])
+        finally:
+            shutil.rmtree(TempDir)
+
 
 
 if __name__ == "__main__":
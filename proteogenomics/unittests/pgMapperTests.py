@@ -155,5 +155,39 @@ class Test(unittest.TestCase):
         self.assertEqual(2, genome.numOrfs())
         self.assertEqual(2, genome.numOrfs('Simple'))
 
+    def testPeptideStore(self):
+        "Peptides mapped into a PeptideStore look the same as LocatedPeptides."
+        self.SetUpPeptides()
+        Mapper = PeptideMapper.PeptideMappingClass()
+        Mapper.LoadDatabases(self.Databases)
+        StoreMapper = PeptideMapper.PeptideMappingClass()
+        StoreMapper.LoadDatabases(self.Databases)
+        StoreMapper.PeptideStore = PGPeptide.PeptideStore()
+        def Values(Peptide):
+            return (Peptide.aminos, Peptide.name, Peptide.ORFName, Peptide.bestScore,
+                    Peptide.spectrumCount, Peptide.isUnique, Peptide.TrypticNTerm,
+                    Peptide.TrypticCTerm, Peptide.GetMSMSSource(), str(Peptide.location),
+                    Peptide.location.frame, Peptide.chromosome, Peptide.GetFivePrimeNucleotide(),
+                    Peptide.GetThreePrimeNucleotide(), Peptide.isFullyTryptic(), str(Peptide))
+        for Aminos in self.AminoList + ["K"]:
+            Peptides = Mapper.MapPeptide(Aminos, 0.01, self.FakeMSMSSource)
+            Stored = StoreMapper.MapPeptide(Aminos, 0.01, self.FakeMSMSSource)
+            self.assertEqual( map(Values, Peptides), map(Values, Stored) )
+            for (Peptide, StoredPeptide) in zip(Peptides, Stored):
+                self.assertEqual( 0, cmp(Peptide, StoredPeptide) )
+                self.assertEqual( 0, Peptide.location.SortFivePrime(StoredPeptide.location) )
+        Store = StoreMapper.PeptideStore
+        self.assertEqual( StoreMapper.UniquePeptideCount, len(Store) )
+        self.assertEqual( list(Store.Start), list(Store.GetColumn("Start")) )
+        # sources are shared between the rows, and copied on append
+        self.assertTrue( Stored[0].GetMSMSSource() is Stored[1].GetMSMSSource() )
+        Stored[0].AppendMSMSSource([("other.mzxml", 4)])
+        self.assertEqual( (2, 1), (Stored[0].spectrumCount, Stored[1].spectrumCount) )
+        Stored[1].bestScore = None
+        Stored[1].isUnique = 1
+        Stored[1].location = PGPeptide.GenomicLocation(10, 21, "-", "Other")
+        self.assertEqual( (None, 1, 10, 21, "-", "Other"), (Stored[1].bestScore, Stored[1].isUnique,
+            Stored[1].GetStart(), Stored[1].GetStop(), Stored[1].Strand(), Stored[1].chromosome) )
+
 if __name__ == "__main__":
     unittest.main()
@@ -10,6 +10,8 @@ Some unit tests for the Peptide location code
 import unittest
 import filecmp
 import os
+import shutil
+import tempfile
 
 import PGPeptide
 
@@ -136,6 +138,40 @@ class Test(unittest.TestCase):
 
         os.remove( gffOut )
 
+    def testStoredPeptideChanges(self):
+        'Changes made through a StoredPeptide and its location stay in the store'
+        store = PGPeptide.PeptideStore()
+        sources = [('a.mzXML', 1)]
+        peps = []
+        for (start, stop, strand) in ((100, 120, '+'), (400, 420, '-')):
+            located = PGPeptide.LocatedPeptide('PEPTIDE', PGPeptide.GenomicLocation(start, stop, strand, 'NC_1'))
+            stored = store.AddPeptide('PEPTIDE', PGPeptide.GenomicLocation(start, stop, strand, 'NC_1'))
+            for pep in (located, stored):
+                pep.AppendMSMSSource(sources)
+            peps.append( (located, stored) )
+        self.assertFalse( hasattr(peps[0][1], '__dict__') )
+        self.assertFalse( hasattr(peps[0][0], '__dict__') )
+        self.assertTrue( peps[0][1].GetMSMSSource() is peps[1][1].GetMSMSSource() )
+
+        def Values(pep):
+            return (str(pep.location), pep.location.frame, pep.location.GetFivePrime(),
+                    pep.GetStart(), pep.GetStop(), pep.chromosome, pep.MSMSSource, pep.spectrumCount)
+        for (located, stored) in peps:
+            for pep in (located, stored):
+                pep.location.AddOneAminoAcidFivePrime()
+                pep.location.frame = 2
+                pep.MSMSSource.append( ('b.mzXML', 7) )
+            self.assertEqual( Values(located), Values(stored) )
+        peps[1][1].location.chromosome = 'NC_2'
+        self.assertEqual( ('NC_2', 'NC_1'), (peps[1][1].chromosome, peps[0][1].chromosome) )
+        # the shared list was copied before it was changed, so each has one append
+        self.assertEqual( [('a.mzXML', 1)], sources )
+        self.assertEqual( [('a.mzXML', 1), ('b.mzXML', 7)], peps[1][1].GetMSMSSource() )
+        self.assertEqual( (97, 423), (peps[0][1].GetStart(), peps[1][1].GetStop()) ) # moved 5' ends
+        fresh = store.AddPeptide('PEPTIDE', PGPeptide.GenomicLocation(1, 9, '+', 'NC_1'))
+        fresh.MSMSSource.append( ('c.mzXML', 3) )
+        self.assertEqual( [('c.mzXML', 3)], fresh.GetMSMSSource() )
+
     def testChromsomeGBInput(self):
         'Reading and mapping ORFs to a genbank chromosome'
 
@@ -167,7 +203,62 @@ class Test(unittest.TestCase):
             self.assertEqual(LocatedProtein.GetStart(), self.ProteinStarts[Name])
             self.assertEqual(LocatedProtein.GetStop(), self.ProteinStops[Name])
             self.assertEqual(LocatedProtein.GetORFName(), self.ProteinORFLocation[Name])
-            
+        if os.path.exists(PGPeptide.GenomeIndexPath(gbkFile)):
+            os.remove(PGPeptide.GenomeIndexPath(gbkFile))
+
+    def testGenomeIndex(self):
+        'A genome loaded from the annotation index matches the one parsed from genbank'
+        tmpDir = tempfile.mkdtemp()
+        try:
+            for path in ("NC_004837.gbk", "NC_004837.6frame.trie", "NC_004837.6frame.index", self.SixFrame):
+                shutil.copy( path, tmpDir )
+            gbkFile = os.path.join(tmpDir, "NC_004837.gbk")
+            def Describe(genome):
+                chrom = genome.chromosomes["NC_004837"]
+                orfs = []
+                for (kind, table) in (("Simple", chrom.simpleOrfs), ("Complex", chrom.complexOrfs), ("Other", chrom.otherOrfs)):
+                    for orf in table.values():
+                        orfs.append( (kind, orf.name, orf.aaseq, str(orf.location),
+                                      str(orf.annotatedProtein and orf.annotatedProtein.location),
+                                      [(key, orf.CDS.qualifiers[key][0]) for key in PGPeptide.GENOME_INDEX_QUALIFIERS]) )
+                orfs.sort()
+                return (str(chrom.sequence), orfs, sorted(chrom.endToCDS.keys()))
+            for sixFrame in ("NC_004837.6frame.trie", self.SixFrame):
+                sixFrame = os.path.join(tmpDir, sixFrame)
+                reader = PGPeptide.GenbankGenomeReader(gbkFile, sixFrame)
+                reader.useIndex = 0
+                expected = Describe(reader.makeGenomeWithProteinORFs())
+                self.assertEqual( None, PGPeptide.LoadGenomeIndex(gbkFile, sixFrame) )
+                for i in range(2): # builds the index, then loads it
+                    genome = PGPeptide.GenbankGenomeReader(gbkFile, sixFrame).makeGenomeWithProteinORFs()
+                    self.assertTrue( genome.annotationIndex != None )
+                    self.assertEqual( expected, Describe(genome) )
+                    self.assertTrue( os.path.exists(PGPeptide.GenomeIndexPath(gbkFile)) )
+
+                # pepOnly ORFs get their sequences through the index
+                orfSeq = list(PGPeptide.bioseq.SequenceIO(sixFrame))[-1]
+                orf = PGPeptide.OpenReadingFrame(orfSeq.acc, orfSeq.seq)
+                stub = PGPeptide.OpenReadingFrame(name=orf.name)
+                stub.location = PGPeptide.GenomicLocation(0, 0, '+', orf.chromosome)
+                genome.addOrf( stub, 'PepOnly' )
+                genome.addSeqToPepOnlyOrfs( sixFrame )
+                self.assertEqual( (orf.aaseq, str(orf.location)), (stub.aaseq, str(stub.location)) )
+
+                # a truncated or corrupt index is not used, and gets rebuilt
+                indexPath = PGPeptide.GenomeIndexPath(gbkFile)
+                good = open(indexPath, "rb").read()
+                for bad in (good[:-3], good[:len(good)/2], good[:-4] + "\xff\xff\xff\x7f"):
+                    stamp = os.stat(indexPath)
+                    open(indexPath, "wb").write(bad)
+                    os.utime(indexPath, (stamp.st_atime, stamp.st_mtime))
+                    self.assertEqual( None, PGPeptide.LoadGenomeIndex(gbkFile, sixFrame) )
+                    self.assertTrue( PGPeptide.GetGenomeIndex(gbkFile, sixFrame) != None )
+                    self.assertEqual( good, open(indexPath, "rb").read() )
+                os.remove(indexPath)
+            self.assertEqual( [], [name for name in os.listdir(tmpDir) if name.startswith("tmp")] )
+        finally:
+            shutil.rmtree(tmpDir)
+
             
 
 
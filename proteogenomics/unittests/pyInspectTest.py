@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+'''
+Smoke tests for the PyInspect extension build
+'''
+import unittest
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import subprocess
+
+import ReleasePyInspect
+
+SourceDir = os.path.dirname(os.path.abspath(ReleasePyInspect.__file__))
+
+class Test(unittest.TestCase):
+
+    def testSourceList(self):
+        "Every PyInspect source file is built into the extension"
+        for Path in glob.glob(os.path.join(SourceDir, "PyInspect", "*.c")):
+            FileName = "PyInspect/%s"%os.path.basename(Path)
+            self.assertTrue(FileName in ReleasePyInspect.PyInspectFileNames, FileName)
+
+    def testImport(self):
+        "The extension links and exports both the BN-training and the search API"
+        BuildDir = tempfile.mkdtemp()
+        CurrentDir = os.getcwd()
+        try:
+            os.chdir(SourceDir)
+            try:
+                ReleasePyInspect.Main(["-q", "build_ext", "-b", BuildDir,
+                                       "-t", os.path.join(BuildDir, "temp")])
+            except SystemExit, Error:
+                self.skipTest("PyInspect does not build here: %s"%Error)
+            # In a fresh interpreter, since an extension can't be unloaded:
+            Script = "import PyInspect; PyInspect.TrainBNOnSpectrum; PyInspect.LoadSearch; PyInspect.Search"
+            Process = subprocess.Popen([sys.executable, "-c", Script], cwd = BuildDir,
+                                       stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+            Output = Process.communicate()[0]
+            self.assertEqual(0, Process.returncode, Output)
+        finally:
+            os.chdir(CurrentDir)
+            shutil.rmtree(BuildDir)
+
+if __name__ == "__main__":
+    unittest.main()
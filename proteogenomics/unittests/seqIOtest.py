@@ -10,6 +10,8 @@ Some unit tests for the database setup code.
 import unittest
 import filecmp
 import os
+import shutil
+import tempfile
 
 import bioseq
 
@@ -69,6 +71,46 @@ class Test(unittest.TestCase):
         self.assertEqual('CCSSIITPLLCRMSRRWRVDDAGGVCRSSPDFHQDARHTLFSPEAVPAWTAALRASDRRDGPGLFHAFVG',
                          trieIndex.seqs[index])
 
+    def testQGramIndexBatch(self):
+        "The batch search finds the same locations as one at a time."
+        trieIndex = bioseq.QGramIndex(Test.TRIE)
+        trieIndex.index()
+        peptides = ['TPEIRSR', 'VTNGAIV', 'RADYPLD', 'SSII', 'WWWWWWW']
+        batch = trieIndex.accessionsWhereSeqsFound(peptides)
+        self.assertEqual( len(batch), len(peptides) )
+        for (pep, pairs) in zip(peptides, batch):
+            self.assertEqual( trieIndex.accessionsWhereSeqFound(pep), pairs )
+        self.assertEqual( len(batch[3]), 2 )
+        self.assertEqual( batch[4], [] )
+
+    def testQGramIndexCache(self):
+        "The saved q-gram index is used until the trie changes."
+        tmpDir = tempfile.mkdtemp()
+        trie = os.path.join(tmpDir, Test.TRIE)
+        shutil.copy(Test.TRIE, tmpDir)
+        shutil.copy(os.path.splitext(Test.TRIE)[0] + '.index', tmpDir)
+        self.failIf( bioseq.QGramIndex.isCacheCurrent(trie) )
+        bioseq.QGramIndex.prepare(trie)
+        self.assert_( bioseq.QGramIndex.isCacheCurrent(trie) )
+
+        trieIndex = bioseq.QGramIndex(trie)
+        trieIndex.index()
+        pairs = trieIndex.accessionsWhereSeqFound('RADYPLD')
+        self.assertEqual( len(pairs), 1)
+        acc,index,offset = pairs[0]
+        self.assertEqual( offset, 2 )
+        self.assertEqual('Protein595.Chr:NC_004837.Frame3.StartNuc74.Strand-',acc)
+
+        open(trie, 'a').write('A')
+        self.failIf( bioseq.QGramIndex.isCacheCurrent(trie) )
+
+        # a regenerated .index also makes the saved index stale
+        bioseq.QGramIndex.prepare(trie)
+        self.assert_( bioseq.QGramIndex.isCacheCurrent(trie) )
+        open(os.path.splitext(trie)[0] + '.index', 'ab').write('\0')
+        self.failIf( bioseq.QGramIndex.isCacheCurrent(trie) )
+        shutil.rmtree(tmpDir)
+
     def testFastaReader(self):
         "Fasta sequence correctly parsed into acc, seq and desc."
         reader = bioseq.SequenceIO(Test.IN)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+'''
+Some unit tests for the scan index and the SpectrumStore
+'''
+import unittest
+import os
+import shutil
+import tempfile
+
+import CountScans
+import MSSpectrum
+import SpectrumStore
+
+class Test(unittest.TestCase):
+
+    SPECTRA = ('../TestSuite/DictySmall.mzXML', '../TestSuite/Phosphopeptides.mgf')
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        for path in self.SPECTRA:
+            shutil.copy( path, self.tmpDir )
+        self.paths = [os.path.join(self.tmpDir, os.path.basename(path)) for path in self.SPECTRA]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testScanIndex(self):
+        "The index has every scan, and is saved and reloaded unchanged."
+        (mzxml, mgf) = self.paths
+        entries = SpectrumStore.BuildScanIndex(mzxml)
+        self.assertEqual( range(1, 9), [e.ScanNumber for e in entries] )
+        self.assertEqual( (458, 2, 1111.27148, 1388), (entries[0].ByteOffset,
+            entries[0].MSLevel, entries[0].PrecursorMZ, entries[0].PeakCount) )
+        self.assertEqual( entries[1].ByteOffset, entries[0].ByteOffset + entries[0].Length )
+        entries = SpectrumStore.BuildScanIndex(mgf)
+        self.assertEqual( range(6), [e.ScanNumber for e in entries] )
+        self.assertEqual( (0, 695.606812, 2, 87), (entries[0].ByteOffset,
+            entries[0].PrecursorMZ, entries[0].Charge, entries[0].PeakCount) )
+
+        self.assertEqual( None, SpectrumStore.LoadScanIndex(mgf) )
+        SpectrumStore.GetScanIndex(mgf, Save = 1)
+        self.assertEqual( [str(e) for e in entries],
+                          [str(e) for e in SpectrumStore.LoadScanIndex(mgf)] )
+
+    def testCountScans(self):
+        "The streaming scanner finds the scans of the index, serially or in parallel."
+        (mzxml, mgf) = self.paths
+        self.assertEqual( [(e.ScanNumber, e.ByteOffset, e.Length, e.MSLevel, e.PeakCount)
+                           for e in SpectrumStore.BuildScanIndex(mzxml)],
+                          [(e.ScanNumber, e.ByteOffset, e.Length, e.MSLevel, e.PeakCount)
+                           for e in CountScans.ScanMZXML(mzxml)] )
+        counts = []
+        for processes in ("1", "2"):
+            countFile = os.path.join(self.tmpDir, "ScanCount%s.txt"%processes)
+            counter = CountScans.main(["-r", self.tmpDir, "-w", countFile, "-p", processes])
+            self.assertEqual( [], counter.BadFiles )
+            counts.append(open(countFile).read())
+        self.assertEqual( counts[0], counts[1] )
+        self.assertEqual( "DictySmall.mzXML\tDictySmall\t8\t8\t95861\t2:8\t", counts[0].split("\n")[0] )
+
+    def testStore(self):
+        "The store reads the same spectra as ReadPeaks, and hands out copies."
+        store = SpectrumStore.SpectrumStore(CacheSize = 3)
+        for path in self.paths:
+            for entry in store.GetScanIndex(path).values():
+                spectrum = MSSpectrum.SpectrumClass()
+                spectrum.ReadPeaks(path, entry.ByteOffset)
+                stored = store.GetSpectrum(path, entry.ByteOffset)
+                self.assertEqual( spectrum.PrecursorMZ, stored.PrecursorMZ )
+                self.assertEqual( [(p.Mass, p.Intensity) for p in spectrum.Peaks],
+                                  [(p.Mass, p.Intensity) for p in stored.Peaks] )
+        stored = store.GetSpectrumByScan(self.paths[1], 5)
+        stored.Peaks = []
+        hits = store.Hits
+        self.assertEqual( 117, len(store.GetSpectrumByScan(self.paths[1], 5).Peaks) )
+        self.assertEqual( hits + 1, store.Hits )
+        self.assertEqual( None, store.GetSpectrumByScan(self.paths[1], 6) )
+        store.close()
+
+if __name__ == "__main__":
+    unittest.main()
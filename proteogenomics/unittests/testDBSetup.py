@@ -10,6 +10,9 @@ Some unit tests for the database setup code.
 import unittest
 import filecmp
 import os
+import random
+import shutil
+import tempfile
 
 import SixFrameFasta
 import bioseq
@@ -27,7 +30,38 @@ class Test(unittest.TestCase):
         translate.Main()
         self.assert_(filecmp.cmp(Test.OUT,Test.SIX))
         os.remove(Test.OUT)
-        os.remove("Temp.RT.fasta")
+        if SixFrameFasta.numpy:
+            # Both strands are translated in memory:
+            self.assertFalse(os.path.exists("Temp.RT.fasta"))
+        else:
+            os.remove("Temp.RT.fasta")
+
+    def test6FrameArrays(self):
+        "The numpy translation writes the same ORFs as the codon by codon one."
+        if not SixFrameFasta.numpy:
+            return
+        numpy = SixFrameFasta.numpy
+        random.seed(1)
+        tmpDir = tempfile.mkdtemp()
+        dna = os.path.join(tmpDir, "Test.fa")
+        Handle = open(dna, "w")
+        Handle.write(">Test\n")
+        for Line in range(100):
+            Handle.write("".join([random.choice("ACGTACGTNacgt") for Index in range(60)]) + "\n")
+        Handle.close()
+        outputs = []
+        try:
+            for UseNumpy in (numpy, None):
+                SixFrameFasta.numpy = UseNumpy
+                outputs.append(os.path.join(tmpDir, "Test%s.6frame.fa"%len(outputs)))
+                translate = SixFrameFasta.AbacusClass()
+                translate.TempRTFileName = os.path.join(tmpDir, "Temp.RT.fasta")
+                translate.ParseCommandLine(["-r",dna,"-w",outputs[-1],"-c","Test"])
+                translate.Main()
+            self.assert_(filecmp.cmp(outputs[0],outputs[1],shallow=False))
+        finally:
+            SixFrameFasta.numpy = numpy
+            shutil.rmtree(tmpDir)
 
 if __name__ == "__main__":
     unittest.main()